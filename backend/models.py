@@ -1,58 +1,45 @@
-from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from flask_login import UserMixin
 
-db = SQLAlchemy()
-
-def init_db(app):
-    db.init_app(app)
-    with app.app_context():
-        db.create_all()
-
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    google_id = db.Column(db.String(100), unique=True)
-    email = db.Column(db.String(120), unique=True)
-    name = db.Column(db.String(120))
-    picture = db.Column(db.String(200))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    portfolio = db.relationship('Portfolio', backref='user', uselist=False)
-    transactions = db.relationship('Transaction', backref='user')
-    subscription = db.relationship('Subscription', backref='user', uselist=False)
-
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'email': self.email,
-            'name': self.name,
-            'picture': self.picture,
-            'created_at': self.created_at.isoformat()
-        }
+# One SQLAlchemy instance per app: these tables share the root models' db,
+# and user_id columns refer to its users table (models.User)
+from models import db
 
 class Portfolio(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     cash_balance = db.Column(db.Numeric(15, 2), default=1000000)  # Default 10 lakhs
+    # Sum of quantity * avg_price over the holdings, kept up to date by every trade
+    invested_value = db.Column(db.Numeric(15, 2), default=0)
+    # Credit limit of the user's subscription until it expires, copied here when it changes
+    credit_limit = db.Column(db.Numeric(15, 2))
+    credit_limit_expires_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     holdings = db.relationship('Holding', backref='portfolio', cascade='all, delete-orphan')
 
-    def to_dict(self):
-        return {
+    def to_dict(self, include_holdings=True):
+        data = {
             'id': self.id,
             'user_id': self.user_id,
             'cash_balance': float(self.cash_balance),
-            'created_at': self.created_at.isoformat(),
-            'holdings': [h.to_dict() for h in self.holdings]
+            'invested_value': float(self.invested_value or 0),
+            'created_at': self.created_at.isoformat()
         }
+        if include_holdings:
+            data['holdings'] = [h.to_dict() for h in self.holdings]
+        return data
 
 class Holding(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     portfolio_id = db.Column(db.Integer, db.ForeignKey('portfolio.id'))
-    symbol = db.Column(db.String(20))
+    symbol = db.Column(db.String(40))
     quantity = db.Column(db.Integer)
     avg_price = db.Column(db.Numeric(15, 2))
+    # Bumped by every trade; a trade only writes the holding at the version it read
+    version = db.Column(db.Integer, nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (db.UniqueConstraint('portfolio_id', 'symbol', name='_portfolio_symbol_uc'),)
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -65,8 +52,8 @@ class Holding(db.Model):
 
 class Transaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    symbol = db.Column(db.String(20))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    symbol = db.Column(db.String(40))
     quantity = db.Column(db.Integer)
     price = db.Column(db.Numeric(15, 2))
     type = db.Column(db.String(10))  # 'buy' or 'sell'
@@ -83,9 +70,77 @@ class Transaction(db.Model):
             'created_at': self.created_at.isoformat()
         }
 
+class Order(db.Model):
+    """A paper order; OPEN orders rest in the matching engine until filled or cancelled"""
+    __tablename__ = 'paper_order'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    symbol = db.Column(db.String(40), nullable=False)
+    side = db.Column(db.String(4), nullable=False)  # 'BUY' or 'SELL'
+    order_type = db.Column(db.String(10), nullable=False)  # 'MARKET', 'LIMIT', 'SL' or 'SL-M'
+    quantity = db.Column(db.Integer, nullable=False)
+    limit_price = db.Column(db.Numeric(15, 2))
+    trigger_price = db.Column(db.Numeric(15, 2))
+    session_id = db.Column(db.String(32))  # replay session the order trades in, if any
+    status = db.Column(db.String(10), nullable=False, default='OPEN')
+    reason = db.Column(db.String(200))
+    filled_price = db.Column(db.Numeric(15, 2))
+    version = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Active orders and history pages per user
+        db.Index('ix_paper_order_user_status_created', 'user_id', 'status', 'created_at'),
+        # Resting orders per symbol and side, best price first
+        db.Index('ix_paper_order_symbol_status_side_price', 'symbol', 'status', 'side', 'limit_price'),
+        # Orders changed since a worker's last sync
+        db.Index('ix_paper_order_updated', 'updated_at'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'symbol': self.symbol,
+            'type': self.side,
+            'quantity': self.quantity,
+            'price': float(self.limit_price) if self.limit_price is not None else None,
+            'trigger_price': float(self.trigger_price) if self.trigger_price is not None else None,
+            'order_type': self.order_type,
+            'status': self.status,
+            'filled_price': float(self.filled_price) if self.filled_price is not None else None,
+            'reason': self.reason,
+            'session_id': self.session_id,
+            'timestamp': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+
+class Fill(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('paper_order.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'))
+    symbol = db.Column(db.String(40), nullable=False)
+    side = db.Column(db.String(4), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Numeric(15, 2), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'order_id': self.order_id,
+            'symbol': self.symbol,
+            'side': self.side,
+            'quantity': self.quantity,
+            'price': float(self.price),
+            'created_at': self.created_at.isoformat()
+        }
+
 class Subscription(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     plan_id = db.Column(db.String(20))  # 'basic', 'standard', 'premium', 'ultimate'
     credit_limit = db.Column(db.Numeric(15, 2))
     price_paid = db.Column(db.Numeric(10, 2))
@@ -0,0 +1,46 @@
+from functools import partial
+
+
+def parse_global_quote(payload):
+    """Turn an Alpha Vantage GLOBAL_QUOTE payload into a flat quote, or None if empty"""
+    quote = payload.get('Global Quote') if payload else None
+    if not quote:
+        return None
+    return {
+        'price': float(quote.get('05. price', 0)),
+        'change': float(quote.get('09. change', 0)),
+        'change_percent': quote.get('10. change percent', '0%').replace('%', ''),
+        'volume': int(quote.get('06. volume', 0))
+    }
+
+
+class BatchQuoteFetcher:
+    """Fetch quotes for many symbols concurrently through the market gateway.
+
+    fetch_one(symbol) returns a raw GLOBAL_QUOTE payload and is expected to
+    handle caching and upstream quota itself; this class only fans the calls
+    out and reports a status per symbol so callers can use whatever subset
+    succeeded.
+    """
+
+    def __init__(self, fetch_one, gateway):
+        self.fetch_one = fetch_one
+        self.gateway = gateway
+
+    def _fetch(self, symbol):
+        try:
+            quote = parse_global_quote(self.fetch_one(symbol))
+        except Exception as e:
+            status = 'rate_limited' if getattr(e, 'status_code', None) == 429 else 'error'
+            return {'status': status, 'quote': None, 'error': str(e)}
+        if quote is None:
+            return {'status': 'not_found', 'quote': None, 'error': 'No quote returned'}
+        return {'status': 'ok', 'quote': quote, 'error': None}
+
+    def fetch(self, symbols, timeout=30):
+        """Return {symbol: {'status', 'quote', 'error'}} for each distinct symbol"""
+        calls = {symbol: partial(self._fetch, symbol) for symbol in dict.fromkeys(symbols)}
+        results, errors = self.gateway.gather(calls, deadline=timeout)
+        for symbol in errors:
+            results[symbol] = {'status': 'timeout', 'quote': None, 'error': 'Quote did not arrive in time'}
+        return results
@@ -20,6 +20,61 @@ class Config:
     SESSION_COOKIE_SAMESITE = 'None'
     PERMANENT_SESSION_LIFETIME = timedelta(days=7)
     RENDER_EXTERNAL_URL = os.environ.get('RENDER_EXTERNAL_URL')
+    # Market data cache limits (per worker)
+    MARKET_CACHE_MAX_BYTES = int(os.environ.get('MARKET_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    MARKET_CACHE_STRIPES = int(os.environ.get('MARKET_CACHE_STRIPES', 16))
+    # 'memory' keeps a private cache per worker; 'sqlite' shares one cache
+    # file between all gunicorn workers on the host
+    MARKET_CACHE_BACKEND = os.environ.get('MARKET_CACHE_BACKEND', 'memory')
+    MARKET_CACHE_PATH = os.environ.get('MARKET_CACHE_PATH')
+    MARKET_CACHE_LOCAL_TTL = int(os.environ.get('MARKET_CACHE_LOCAL_TTL', 30))
+    # How long expired entries stay available as a fallback when over quota
+    MARKET_CACHE_STALE_GRACE = int(os.environ.get('MARKET_CACHE_STALE_GRACE', 3600))
+    # Upstream call budgets. A daily cap of 0 means
+    # unlimited; background refreshes never use the last reserve share.
+    ALPHA_VANTAGE_CALLS_PER_MINUTE = int(os.environ.get('ALPHA_VANTAGE_CALLS_PER_MINUTE', 75))
+    ALPHA_VANTAGE_CALLS_PER_DAY = int(os.environ.get('ALPHA_VANTAGE_CALLS_PER_DAY', 0))
+    NSE_CALLS_PER_MINUTE = int(os.environ.get('NSE_CALLS_PER_MINUTE', 30))
+    UPSTREAM_BACKGROUND_RESERVE = float(os.environ.get('UPSTREAM_BACKGROUND_RESERVE', 0.2))
+    # Where the budgets' token buckets live: 'sqlite' shares them between all
+    # workers on the host, 'memory' gives each worker the full budget
+    UPSTREAM_QUOTA_BACKEND = os.environ.get('UPSTREAM_QUOTA_BACKEND', 'sqlite')
+    UPSTREAM_QUOTA_PATH = os.environ.get('UPSTREAM_QUOTA_PATH')
+    # Pooled keep-alive HTTP clients for upstream providers
+    HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+    HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 2))
+    HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))
+    HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 15))
+    NSE_SESSION_TTL = int(os.environ.get('NSE_SESSION_TTL', 300))
+    # Threads behind the per-worker asyncio gateway used for fan-out fetches
+    GATEWAY_WORKERS = int(os.environ.get('GATEWAY_WORKERS', 16))
+    # Directory of memory-mapped per-symbol price columns; defaults to the
+    # system temp dir and is rebuilt from the database when missing
+    PRICE_STORE_DIR = os.environ.get('PRICE_STORE_DIR')
+    # Snapshots of the incremental per-symbol indicator state
+    INDICATOR_STATE_DIR = os.environ.get('INDICATOR_STATE_DIR')
+    # Annualised risk-free rate for option pricing and implied volatility
+    RISK_FREE_RATE = float(os.environ.get('RISK_FREE_RATE', 0.065))
+    # Comma-separated instrument CSV dumps (e.g. NSE's EQUITY_L.csv) for
+    # local symbol search; without them search calls the upstream providers
+    INSTRUMENT_FILES = os.environ.get('INSTRUMENT_FILES', '')
+    # Simulated order book depth: levels per side, tick size, spread in basis
+    # points and how long a book's quote is reused before re-pricing
+    MARKET_DEPTH_LEVELS = int(os.environ.get('MARKET_DEPTH_LEVELS', 10))
+    MARKET_DEPTH_TICK_SIZE = float(os.environ.get('MARKET_DEPTH_TICK_SIZE', 0.05))
+    MARKET_DEPTH_SPREAD_BPS = float(os.environ.get('MARKET_DEPTH_SPREAD_BPS', 10))
+    MARKET_DEPTH_QUOTE_TTL = int(os.environ.get('MARKET_DEPTH_QUOTE_TTL', 60))
+    # Streaming quotes: poll interval per watched symbol, keep-alive interval
+    # and the most concurrent streaming clients per worker
+    QUOTE_STREAM_INTERVAL = int(os.environ.get('QUOTE_STREAM_INTERVAL', 15))
+    QUOTE_STREAM_HEARTBEAT = int(os.environ.get('QUOTE_STREAM_HEARTBEAT', 15))
+    QUOTE_STREAM_MAX_SUBSCRIBERS = int(os.environ.get('QUOTE_STREAM_MAX_SUBSCRIBERS', 500))
+    # Historical replay: concurrent sessions per worker and how long an
+    # unused session is kept
+    REPLAY_MAX_SESSIONS = int(os.environ.get('REPLAY_MAX_SESSIONS', 500))
+    REPLAY_IDLE_TIMEOUT = int(os.environ.get('REPLAY_IDLE_TIMEOUT', 1800))
+    # Seconds a user's mark-to-market valuation is reused; trades invalidate it
+    PORTFOLIO_VALUATION_TTL = int(os.environ.get('PORTFOLIO_VALUATION_TTL', 30))
 
 class DevelopmentConfig(Config):
     """Development configuration."""
@@ -0,0 +1,141 @@
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+# Quantity at the touch in units of the base size grows by this much per level
+DEPTH_SLOPE = 0.35
+# Share of each level's quantity replaced by fresh interest on every update
+REPLENISH_RATE = 0.3
+QUANTITY_NOISE = 0.25
+
+
+class SimulatedBook:
+    """Array-backed simulated order book for one symbol.
+
+    Levels are spaced by a whole number of ticks around a spread derived from
+    the price, so the book is never locked or crossed. When the price moves,
+    levels that survive keep their quantity (shifted to their new position),
+    levels the price ran through are consumed, and new levels are seeded from
+    the depth profile; every level then drifts towards the profile with
+    noise.
+    """
+
+    def __init__(self, symbol, levels, tick_size, spread_bps):
+        self.symbol = symbol
+        self.levels = levels
+        self.tick_size = tick_size
+        self.spread_bps = spread_bps
+        self.bid_prices = np.zeros(levels)
+        self.ask_prices = np.zeros(levels)
+        self.bid_qty = np.zeros(levels, dtype=np.int64)
+        self.ask_qty = np.zeros(levels, dtype=np.int64)
+        self.last_price = None
+        self.volume = 0
+        self.updated_at = 0.0
+        self._step = 1
+        self._anchor = 0
+        # Seeded per symbol so a restarted worker draws the same book
+        self._rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+
+    def _profile(self, volume):
+        base = max(1, int(volume / 20000)) if volume else 100
+        return base * (1 + DEPTH_SLOPE * np.arange(self.levels))
+
+    def _noisy(self, target):
+        return np.maximum(1, np.rint(target * self._rng.lognormal(0, QUANTITY_NOISE, self.levels))).astype(np.int64)
+
+    def update(self, price, volume=None):
+        """Move the book to a new last traded price"""
+        ticks = max(1, int(round(price / self.tick_size)))
+        # Touch is half the spread either side of the price; levels are a full spread apart
+        half_spread = max(1, int(round(ticks * self.spread_bps / 20000)))
+        step = max(1, int(round(ticks * self.spread_bps / 10000)))
+        profile = self._profile(volume if volume is not None else self.volume)
+
+        if self.last_price is None or step != self._step:
+            self.bid_qty = self._noisy(profile)
+            self.ask_qty = self._noisy(profile)
+        else:
+            # Levels the book moved by; positive means the price went up
+            moved = int(round((ticks - self._anchor) / step))
+            fresh_bids = self._noisy(profile)
+            fresh_asks = self._noisy(profile)
+            if moved > 0:
+                # Asks below the new price were taken; bids gain new levels at the top
+                self.ask_qty = np.concatenate([self.ask_qty[moved:], fresh_asks[self.levels - min(moved, self.levels):]])
+                self.bid_qty = np.concatenate([fresh_bids[:min(moved, self.levels)], self.bid_qty[:max(self.levels - moved, 0)]])
+            elif moved < 0:
+                moved = -moved
+                self.bid_qty = np.concatenate([self.bid_qty[moved:], fresh_bids[self.levels - min(moved, self.levels):]])
+                self.ask_qty = np.concatenate([fresh_asks[:min(moved, self.levels)], self.ask_qty[:max(self.levels - moved, 0)]])
+            self.bid_qty = np.rint((1 - REPLENISH_RATE) * self.bid_qty + REPLENISH_RATE * fresh_bids).astype(np.int64)
+            self.ask_qty = np.rint((1 - REPLENISH_RATE) * self.ask_qty + REPLENISH_RATE * fresh_asks).astype(np.int64)
+
+        offsets = half_spread + step * np.arange(self.levels)
+        self.bid_prices = np.maximum(ticks - offsets, 1) * self.tick_size
+        self.ask_prices = (ticks + offsets) * self.tick_size
+        self._anchor = ticks
+        self._step = step
+        self.last_price = price
+        if volume is not None:
+            self.volume = volume
+        self.updated_at = time.time()
+
+    def snapshot(self, levels=None):
+        levels = min(levels or self.levels, self.levels)
+        return {
+            'bids': [
+                {'price': round(float(p), 2), 'quantity': int(q)}
+                for p, q in zip(self.bid_prices[:levels], self.bid_qty[:levels])
+            ],
+            'asks': [
+                {'price': round(float(p), 2), 'quantity': int(q)}
+                for p, q in zip(self.ask_prices[:levels], self.ask_qty[:levels])
+            ],
+            'last_price': self.last_price,
+            'volume': self.volume,
+            'timestamp': datetime.fromtimestamp(self.updated_at).isoformat()
+        }
+
+
+class DepthSimulator:
+    """Simulated order books for the symbols clients are watching.
+
+    Books evolve on every on_quote() and depth snapshots are served from
+    memory. Only the max_books most recently used symbols keep a book.
+    """
+
+    def __init__(self, levels=10, tick_size=0.05, spread_bps=10, max_books=1000):
+        self.levels = levels
+        self.tick_size = tick_size
+        self.spread_bps = spread_bps
+        self.max_books = max_books
+        self._books = OrderedDict()
+        self._lock = threading.Lock()
+
+    def on_quote(self, symbol, price, volume=None):
+        """Feed a new quote for symbol into its book, creating the book if needed"""
+        if not price:
+            return
+        with self._lock:
+            book = self._books.get(symbol)
+            if book is None:
+                book = SimulatedBook(symbol, self.levels, self.tick_size, self.spread_bps)
+                self._books[symbol] = book
+                if len(self._books) > self.max_books:
+                    self._books.popitem(last=False)
+            self._books.move_to_end(symbol)
+            book.update(price, volume)
+
+    def depth(self, symbol, levels=None):
+        """Return (snapshot, age in seconds) for symbol, or (None, None) without a book"""
+        with self._lock:
+            book = self._books.get(symbol)
+            if book is None:
+                return None, None
+            self._books.move_to_end(symbol)
+            return book.snapshot(levels), time.time() - book.updated_at
@@ -0,0 +1,242 @@
+import sys
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+from market_cache import estimate_size
+from option_pricing import price_chain
+
+# Underlyings NSE serves through the index= form of the equity-derivatives API
+INDEX_UNDERLYINGS = {'NIFTY', 'BANKNIFTY', 'FINNIFTY', 'MIDCPNIFTY', 'NIFTYNXT50'}
+
+EXPIRY_FORMATS = ('%d-%b-%Y', '%Y-%m-%d')
+
+
+def nse_query(underlying):
+    """The equity-derivatives query string for an underlying"""
+    if underlying.upper() in INDEX_UNDERLYINGS:
+        return f"index={underlying.upper()}"
+    return f"symbol={underlying.upper()}"
+
+
+def parse_expiry(expiry):
+    """Expiry string as a date, or None when it is in no known format"""
+    for fmt in EXPIRY_FORMATS:
+        try:
+            return datetime.strptime(expiry, fmt).date()
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def contract_symbol(underlying, expiry, strike=None, option_type=None):
+    """Contract key in the position format: 'UNDERLYING:EXPIRY:FUT' or 'UNDERLYING:EXPIRY:STRIKE:CE|PE'"""
+    if option_type is None:
+        return f"{underlying.upper()}:{expiry}:FUT"
+    return f"{underlying.upper()}:{expiry}:{float(strike):g}:{option_type.upper()}"
+
+
+def parse_contract_symbol(symbol):
+    """(underlying, expiry, strike, option_type) for a contract key, or None for a plain symbol"""
+    parts = symbol.split(':')
+    if len(parts) == 3 and parts[2] == 'FUT':
+        return parts[0], parts[1], None, None
+    if len(parts) == 4 and parts[3] in ('CE', 'PE'):
+        try:
+            return parts[0], parts[1], float(parts[2]), parts[3]
+        except ValueError:
+            return None
+    return None
+
+
+def _float(contract, key):
+    try:
+        return float(contract.get(key) or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _int(contract, key):
+    try:
+        return int(contract.get(key) or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class DerivativesSnapshot:
+    """One underlying's equity-derivatives payload, parsed once into indexes.
+
+    Futures are kept as records in expiry order. Options are kept as columns
+    (strike, expiry index, CE/PE flag, prices, OI, NSE greeks) sorted by
+    expiry, strike and type, with sorted unique expiries and strikes and a
+    (expiry, strike, type) -> row index. Model pricing is computed up front
+    so the snapshot's size is fixed by the time it is cached; the futures,
+    options and chain endpoints are projections of it, built on demand and
+    cached by the caller under their own keys.
+    """
+
+    OPTION_FIELDS = ('last_price', 'change', 'oi', 'volume', 'implied_volatility',
+                     'delta', 'gamma', 'theta', 'vega', 'underlying_value')
+
+    def __init__(self, underlying, payload, fetched_at=None):
+        self.underlying = underlying
+        self.fetched_at = fetched_at or time.time()
+
+        futures = []
+        options = []
+        expiry_dates = {}
+        for contract in payload.get('data', []):
+            instrument = contract.get('instrumentType')
+            if instrument not in ('FUT', 'OPT'):
+                continue
+            expiry = contract.get('expiryDate')
+            if expiry not in expiry_dates:
+                expiry_dates[expiry] = parse_expiry(expiry)
+            if instrument == 'FUT':
+                futures.append({
+                    'symbol': contract.get('symbol'),
+                    'expiry': expiry,
+                    'strike': _float(contract, 'strikePrice'),
+                    'last_price': _float(contract, 'lastPrice'),
+                    'change': _float(contract, 'pChange'),
+                    'oi': _int(contract, 'openInterest'),
+                    'volume': _int(contract, 'totalTradedVolume'),
+                    'basis': _float(contract, 'basis'),
+                    'cost_of_carry': _float(contract, 'costOfCarry')
+                })
+            else:
+                options.append((
+                    contract.get('symbol'), expiry, _float(contract, 'strikePrice'),
+                    contract.get('optionType') == 'CE',
+                    _float(contract, 'lastPrice'), _float(contract, 'pChange'),
+                    _int(contract, 'openInterest'), _int(contract, 'totalTradedVolume'),
+                    _float(contract, 'impliedVolatility'), _float(contract, 'delta'),
+                    _float(contract, 'gamma'), _float(contract, 'theta'), _float(contract, 'vega'),
+                    _float(contract, 'underlyingValue')
+                ))
+
+        # Unparseable expiries sort after real dates, by their text
+        self.expiries = sorted(expiry_dates, key=lambda e: (expiry_dates[e] or date.max, e or ''))
+        self.expiry_dates = [expiry_dates[e] for e in self.expiries]
+        expiry_rank = {expiry: i for i, expiry in enumerate(self.expiries)}
+        futures.sort(key=lambda f: expiry_rank[f['expiry']])
+        self.futures_records = futures
+
+        n = len(options)
+        self.symbols = [o[0] for o in options]
+        self.expiry_index = np.fromiter((expiry_rank[o[1]] for o in options), dtype=np.int32, count=n)
+        self.strike = np.fromiter((o[2] for o in options), dtype=float, count=n)
+        self.is_call = np.fromiter((o[3] for o in options), dtype=bool, count=n)
+        numeric = np.array([o[4:] for o in options], dtype=float).reshape(n, len(self.OPTION_FIELDS))
+
+        order = np.lexsort((~self.is_call, self.strike, self.expiry_index))
+        self.symbols = [self.symbols[i] for i in order]
+        self.expiry_index = self.expiry_index[order]
+        self.strike = self.strike[order]
+        self.is_call = self.is_call[order]
+        self.columns = {name: numeric[order, i] for i, name in enumerate(self.OPTION_FIELDS)}
+        self.strikes = np.unique(self.strike)
+        self.index = {
+            (self.expiries[e], s, 'CE' if c else 'PE'): row
+            for row, (e, s, c) in enumerate(zip(self.expiry_index.tolist(), self.strike.tolist(), self.is_call.tolist()))
+        }
+        self.pricing = price_chain(self)
+
+    def __len__(self):
+        return len(self.strike) + len(self.futures_records)
+
+    def __sizeof__(self):
+        arrays = ([self.expiry_index, self.strike, self.is_call] + list(self.columns.values())
+                  + list(self.pricing.values()))
+        return (object.__sizeof__(self) + sum(a.nbytes for a in arrays)
+                + estimate_size(self.futures_records) + estimate_size(self.symbols)
+                + sys.getsizeof(self.index))
+
+    def rows(self, expiry=None, option_type=None):
+        """Option row indices, optionally for one expiry and/or 'CE'/'PE'"""
+        mask = np.ones(len(self.strike), dtype=bool)
+        if expiry is not None:
+            if expiry not in self.expiries:
+                return np.empty(0, dtype=np.intp)
+            mask &= self.expiry_index == self.expiries.index(expiry)
+        if option_type is not None:
+            mask &= self.is_call if option_type == 'CE' else ~self.is_call
+        return np.flatnonzero(mask)
+
+    def contract_quote(self, expiry, strike=None, option_type=None):
+        """(last traded price, percent change) of a future (no strike/type) or option, or None when not traded"""
+        if option_type is None:
+            future = next((f for f in self.futures_records if f['expiry'] == expiry), None)
+            quote = (future['last_price'], future['change']) if future else None
+        else:
+            row = self.index.get((expiry, float(strike), option_type))
+            quote = None if row is None else (
+                self.columns['last_price'][row].item(), self.columns['change'][row].item()
+            )
+        return quote if quote and quote[0] else None
+
+    def contract_price(self, expiry, strike=None, option_type=None):
+        """Last traded price of a future (no strike/type) or option, or None when not traded"""
+        quote = self.contract_quote(expiry, strike, option_type)
+        return quote[0] if quote else None
+
+    def _option_record(self, row, fields):
+        record = {field: self.columns[field][row].item() for field in fields}
+        for field in ('oi', 'volume'):
+            if field in record:
+                record[field] = int(record[field])
+        return record
+
+    def futures(self):
+        """Futures contracts, nearest expiry first"""
+        keys = ('symbol', 'expiry', 'strike', 'last_price', 'change', 'oi', 'volume')
+        return [{k: f[k] for k in keys} for f in self.futures_records]
+
+    def futures_chain(self):
+        """Futures by expiry with basis and cost of carry"""
+        keys = ('expiry', 'last_price', 'change', 'oi', 'volume', 'basis', 'cost_of_carry')
+        return [{k: f[k] for k in keys} for f in self.futures_records]
+
+    def options(self):
+        """All options split into calls and puts"""
+        fields = ('last_price', 'change', 'oi', 'volume', 'implied_volatility')
+        result = {'calls': [], 'puts': []}
+        for row in range(len(self.strike)):
+            record = {
+                'symbol': self.symbols[row],
+                'expiry': self.expiries[self.expiry_index[row]],
+                'strike': self.strike[row].item()
+            }
+            record.update(self._option_record(row, fields))
+            result['calls' if self.is_call[row] else 'puts'].append(record)
+        return result
+
+    def option_analytics(self, row):
+        """Pricing and greeks for one option row; NSE's figures fill in where the model has none"""
+        pricing = self.pricing
+        record = {'theoretical_price': None}
+        for field in ('theoretical_price', 'implied_volatility', 'delta', 'gamma', 'theta', 'vega'):
+            value = pricing[field][row].item()
+            if np.isfinite(value):
+                record[field] = value
+            elif field in self.columns:
+                record[field] = self.columns[field][row].item()
+        return record
+
+    def options_chain(self):
+        """Options grouped by expiry and strike, with sorted expiries and strikes"""
+        fields = ('last_price', 'change', 'oi', 'volume')
+        chain = {
+            'expiry_dates': [self.expiries[i] for i in np.unique(self.expiry_index)],
+            'strikes': self.strikes.tolist(),
+            'calls': {},
+            'puts': {}
+        }
+        for row in range(len(self.strike)):
+            side = chain['calls' if self.is_call[row] else 'puts']
+            by_strike = side.setdefault(self.expiries[self.expiry_index[row]], {})
+            record = self._option_record(row, fields)
+            record.update(self.option_analytics(row))
+            by_strike[self.strike[row].item()] = record
+        return chain
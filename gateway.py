@@ -0,0 +1,81 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+
+class MarketGateway:
+    """Per-worker asyncio loop that runs upstream fetches concurrently.
+
+    Flask request threads hand gather() a dict of calls and block until all of
+    them finish or the deadline passes, so a fan-out costs roughly the slowest
+    call instead of the sum. Coroutine functions run natively on the loop;
+    plain blocking callables (requests, yfinance) run on the gateway's bounded
+    executor in a copy of the caller's context. Calls still pending at their
+    timeout are cancelled and reported as asyncio.TimeoutError; a blocking
+    call's thread finishes in the background and its result is discarded.
+    """
+
+    def __init__(self, max_workers=16):
+        self.max_workers = max_workers
+        self._loop = None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        if self._loop is not None and self._pid == os.getpid():
+            return self._loop
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name='market-gateway', daemon=True)
+                thread.start()
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='gateway-io')
+                self._loop = loop
+                self._pid = os.getpid()
+        return self._loop
+
+    async def _call(self, fn, timeout):
+        if asyncio.iscoroutinefunction(fn):
+            awaitable = fn()
+        else:
+            awaitable = asyncio.get_running_loop().run_in_executor(self._executor, fn)
+        return await asyncio.wait_for(awaitable, timeout)
+
+    async def _gather(self, calls, timeout, deadline):
+        tasks = {key: asyncio.ensure_future(self._call(fn, timeout)) for key, fn in calls.items()}
+        if not tasks:
+            return {}, {}
+        _, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+        for task in pending:
+            task.cancel()
+
+        results = {}
+        errors = {}
+        for key, task in tasks.items():
+            if task in pending:
+                errors[key] = asyncio.TimeoutError(f"{key} did not finish before the deadline")
+            elif task.exception() is not None:
+                errors[key] = task.exception()
+            else:
+                results[key] = task.result()
+        return results, errors
+
+    def gather(self, calls, timeout=None, deadline=None):
+        """Run {key: callable} concurrently and return (results, errors) keyed the same way.
+
+        timeout bounds each call; deadline bounds the whole batch.
+        """
+        loop = self._ensure_loop()
+        prepared = {}
+        for key, fn in calls.items():
+            if asyncio.iscoroutinefunction(fn):
+                prepared[key] = fn
+            else:
+                # A context can only be entered by one thread at a time, so copy per call
+                prepared[key] = partial(contextvars.copy_context().run, fn)
+        future = asyncio.run_coroutine_threadsafe(self._gather(prepared, timeout, deadline), loop)
+        return future.result()
@@ -0,0 +1,149 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+BROWSER_USER_AGENT = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+)
+
+# Transient upstream statuses worth another attempt
+RETRY_STATUSES = {500, 502, 503, 504}
+
+
+class ProviderClient:
+    """Keep-alive HTTP client for one upstream provider.
+
+    Holds a pooled requests.Session (rebuilt after a fork so workers never
+    share sockets), asks for gzip, applies (connect, read) timeouts, and
+    retries connection errors and 5xx responses with jittered exponential
+    backoff.
+    """
+
+    def __init__(self, name, headers=None, pool_size=10, timeout=(3.05, 15), retries=2, backoff=0.5):
+        self.name = name
+        self.headers = headers or {}
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+        session.headers.update(self.headers)
+        return session
+
+    @property
+    def session(self):
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    self._session = self._new_session()
+                    self._pid = os.getpid()
+        return self._session
+
+    def reset(self):
+        """Drop the pooled session and its cookies"""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter keeps workers that failed together from retrying together
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def get(self, url, **kwargs):
+        """GET url, retrying transient failures; raises requests.RequestException when out of attempts"""
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return response
+            self._sleep_before_retry(attempt)
+
+
+class NSEClient(ProviderClient):
+    """NSE client that keeps a warmed, cookie-carrying browser-like session.
+
+    NSE's JSON APIs reject requests without the cookies its home page sets,
+    so the session visits the home page first and again every session_ttl
+    seconds, or straight away when an API call is refused. Those extra
+    requests are charged to the 'nse' budget through admit(provider).
+    """
+
+    HOME_URL = 'https://www.nseindia.com/'
+
+    def __init__(self, session_ttl=300, admit=None, **kwargs):
+        headers = {
+            'User-Agent': BROWSER_USER_AGENT,
+            'Accept': 'application/json, text/plain, */*',
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Referer': 'https://www.nseindia.com/market-data/equity-derivatives-watch'
+        }
+        super().__init__('nse', headers=headers, **kwargs)
+        self.session_ttl = session_ttl
+        self.admit = admit
+        self._primed_at = 0.0
+        self._prime_lock = threading.Lock()
+
+    def _prime(self, force=False):
+        with self._prime_lock:
+            if not force and time.monotonic() - self._primed_at < self.session_ttl and self._pid == os.getpid():
+                return
+            if force:
+                self.reset()
+            self._admit()
+            super().get(self.HOME_URL, headers={'Accept': 'text/html'})
+            self._primed_at = time.monotonic()
+
+    def _admit(self):
+        if self.admit is not None:
+            self.admit(self.name)
+
+    def get(self, url, **kwargs):
+        self._prime()
+        response = super().get(url, **kwargs)
+        if response.status_code in (401, 403):
+            self._prime(force=True)
+            self._admit()
+            response = super().get(url, **kwargs)
+        return response
+
+
+clients = {
+    'alpha_vantage': ProviderClient('alpha_vantage'),
+    'nse': NSEClient()
+}
+
+
+def configure(config, admit=None):
+    """Rebuild the provider clients from app config; admit(provider) charges requests they make on their own"""
+    pool_size = config.get('HTTP_POOL_SIZE', 10)
+    retries = config.get('HTTP_RETRIES', 2)
+    timeout = (config.get('HTTP_CONNECT_TIMEOUT', 3.05), config.get('HTTP_READ_TIMEOUT', 15))
+    clients['alpha_vantage'] = ProviderClient('alpha_vantage', pool_size=pool_size, timeout=timeout, retries=retries)
+    clients['nse'] = NSEClient(
+        session_ttl=config.get('NSE_SESSION_TTL', 300), admit=admit,
+        pool_size=pool_size, timeout=timeout, retries=retries
+    )
+
+
+def get_client(provider):
+    return clients[provider]
@@ -0,0 +1,271 @@
+import json
+import math
+import os
+import tempfile
+import threading
+from collections import deque
+from urllib.parse import quote
+
+import numpy as np
+
+from indicators import shape_latest
+
+# Bump when the snapshot layout changes; older snapshots are rebuilt
+SNAPSHOT_VERSION = 1
+
+
+class _Recursive:
+    """Streaming counterpart of indicators._recursive_average"""
+
+    def __init__(self, period, alpha):
+        self.period = period
+        self.alpha = alpha
+        self.seed = []
+        self.value = None
+
+    def _next(self, x):
+        if self.value is None:
+            if len(self.seed) + 1 < self.period:
+                return None
+            return math.fsum(self.seed + [x]) / self.period
+        return self.alpha * x + (1 - self.alpha) * self.value
+
+    def update(self, x):
+        if x is None:
+            return
+        if self.value is None:
+            self.value = self._next(x)
+            self.seed = [] if self.value is not None else self.seed + [x]
+        else:
+            self.value = self._next(x)
+
+    def peek(self, x):
+        if x is None:
+            return self.value
+        return self._next(x)
+
+    def snapshot(self):
+        return {'seed': self.seed, 'value': self.value}
+
+    def restore(self, data):
+        self.seed = data['seed']
+        self.value = data['value']
+
+
+class _Window:
+    """The last period values, for moving sums and deviations"""
+
+    def __init__(self, period):
+        self.period = period
+        self.values = deque(maxlen=period)
+
+    def update(self, x):
+        self.values.append(x)
+
+    def _with(self, x):
+        if len(self.values) + 1 < self.period:
+            return None
+        return list(self.values)[1 - self.period:] + [x] if self.period > 1 else [x]
+
+    def peek_sum(self, x):
+        window = self._with(x)
+        return math.fsum(window) if window is not None else None
+
+    def peek_mean_std(self, x):
+        window = self._with(x)
+        if window is None:
+            return None, None
+        mean = math.fsum(window) / self.period
+        return mean, math.sqrt(math.fsum((v - mean) ** 2 for v in window) / self.period)
+
+    def snapshot(self):
+        return list(self.values)
+
+    def restore(self, data):
+        self.values = deque(data, maxlen=self.period)
+
+
+class IndicatorState:
+    """Incremental indicator accumulators for one symbol's daily bars.
+
+    update() commits a completed bar in constant time. The newest bar may
+    still be forming, so it is never committed: values() evaluates the
+    indicators as if that bar (or a live quote) closed now, and matches
+    indicators.latest() over the same history.
+    """
+
+    def __init__(self):
+        self.last_ts = None
+        self.prev_close = None
+        self.sma = {20: _Window(20), 50: _Window(50), 200: _Window(200)}
+        self.ema_fast = _Recursive(12, 2.0 / 13)
+        self.ema_slow = _Recursive(26, 2.0 / 27)
+        self.macd_signal = _Recursive(9, 2.0 / 10)
+        self.avg_gain = _Recursive(14, 1.0 / 14)
+        self.avg_loss = _Recursive(14, 1.0 / 14)
+        self.atr = _Recursive(14, 1.0 / 14)
+        self.traded = _Window(20)
+        self.volume = _Window(20)
+
+    def _true_range(self, high, low):
+        if self.prev_close is None:
+            return high - low
+        return max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+
+    def update(self, ts, high, low, close, volume):
+        """Commit a completed bar"""
+        for window in self.sma.values():
+            window.update(close)
+        self.ema_fast.update(close)
+        self.ema_slow.update(close)
+        if self.ema_fast.value is not None and self.ema_slow.value is not None:
+            self.macd_signal.update(self.ema_fast.value - self.ema_slow.value)
+        if self.prev_close is not None:
+            delta = close - self.prev_close
+            self.avg_gain.update(max(delta, 0.0))
+            self.avg_loss.update(max(-delta, 0.0))
+        self.atr.update(self._true_range(high, low))
+        self.traded.update((high + low + close) / 3 * volume)
+        self.volume.update(float(volume))
+        self.prev_close = close
+        self.last_ts = ts
+
+    def values(self, high, low, close, volume):
+        """Indicator values with the forming bar (high, low, close, volume) included"""
+        sma = {period: window.peek_sum(close) for period, window in self.sma.items()}
+        sma = {period: total / period if total is not None else None for period, total in sma.items()}
+
+        fast = self.ema_fast.peek(close)
+        slow = self.ema_slow.peek(close)
+        macd = fast - slow if fast is not None and slow is not None else None
+        signal = self.macd_signal.peek(macd)
+        if macd is None:
+            signal = None
+
+        rsi = None
+        if self.prev_close is not None:
+            delta = close - self.prev_close
+            gain = self.avg_gain.peek(max(delta, 0.0))
+            loss = self.avg_loss.peek(max(-delta, 0.0))
+            if gain is not None and loss is not None:
+                rsi = 100.0 if loss == 0 else 100 - 100 / (1 + gain / loss)
+
+        middle, deviation = self.sma[20].peek_mean_std(close)
+        traded = self.traded.peek_sum((high + low + close) / 3 * volume)
+        total = self.volume.peek_sum(float(volume))
+
+        return {
+            'sma_20': sma[20],
+            'sma_50': sma[50],
+            'sma_200': sma[200],
+            'ema_12': fast,
+            'ema_26': slow,
+            'rsi': rsi,
+            'macd': macd,
+            'macd_signal': signal,
+            'macd_histogram': macd - signal if macd is not None and signal is not None else None,
+            'bollinger_middle': middle,
+            'bollinger_upper': middle + 2 * deviation if middle is not None else None,
+            'bollinger_lower': middle - 2 * deviation if middle is not None else None,
+            'atr': self.atr.peek(self._true_range(high, low)),
+            'vwap_20': traded / total if total else None
+        }
+
+    def snapshot(self):
+        return {
+            'version': SNAPSHOT_VERSION,
+            'last_ts': self.last_ts,
+            'prev_close': self.prev_close,
+            'sma': {str(period): window.snapshot() for period, window in self.sma.items()},
+            'recursive': {
+                name: getattr(self, name).snapshot()
+                for name in ('ema_fast', 'ema_slow', 'macd_signal', 'avg_gain', 'avg_loss', 'atr')
+            },
+            'traded': self.traded.snapshot(),
+            'volume': self.volume.snapshot()
+        }
+
+    @classmethod
+    def restore(cls, data):
+        state = cls()
+        state.last_ts = data['last_ts']
+        state.prev_close = data['prev_close']
+        for period, window in state.sma.items():
+            window.restore(data['sma'][str(period)])
+        for name, accumulator in data['recursive'].items():
+            getattr(state, name).restore(accumulator)
+        state.traded.restore(data['traded'])
+        state.volume.restore(data['volume'])
+        return state
+
+
+class IndicatorStateStore:
+    """Per-symbol IndicatorState kept in memory and snapshotted to disk as JSON.
+
+    values(symbol, series) commits whatever completed bars the state has not
+    seen yet, so after the first call a symbol costs O(new bars) per request
+    instead of a pass over its whole history.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def _path(self, symbol):
+        return os.path.join(self.root, quote(symbol, safe='') + '.json')
+
+    def _load(self, symbol):
+        try:
+            with open(self._path(symbol)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != SNAPSHOT_VERSION:
+            return None
+        return IndicatorState.restore(data)
+
+    def _save(self, symbol, state):
+        # Write to a temp file and rename so readers never see half a snapshot
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state.snapshot(), f)
+        os.replace(tmp_path, self._path(symbol))
+
+    def _advance(self, symbol, series):
+        state = self._states.get(symbol) or self._load(symbol)
+        # Everything but the newest bar is complete
+        done = len(series) - 1
+        start = 0
+        if state is not None and state.last_ts is not None:
+            start = int(np.searchsorted(series.ts[:done], state.last_ts, side='right'))
+            if start == 0 or series.ts[start - 1] != state.last_ts:
+                # The stored history no longer contains our last bar; start over
+                state, start = None, 0
+        if state is None:
+            state = IndicatorState()
+
+        if start < done:
+            for i in range(start, done):
+                state.update(int(series.ts[i]), float(series.high[i]), float(series.low[i]),
+                             float(series.close[i]), int(series.volume[i]))
+            self._save(symbol, state)
+        self._states[symbol] = state
+        return state
+
+    def has_state(self, symbol):
+        """Whether symbol has state in memory or a snapshot on disk to advance from"""
+        return symbol in self._states or os.path.exists(self._path(symbol))
+
+    def values(self, symbol, series, close=None):
+        """Latest indicator values for symbol, shaped like indicators.latest().
+
+        close overrides the forming bar's close, e.g. with a live quote.
+        """
+        with self._lock:
+            state = self._advance(symbol, series)
+        last_close = float(series.close[-1]) if close is None else close
+        high = max(float(series.high[-1]), last_close)
+        low = min(float(series.low[-1]), last_close)
+        return shape_latest(state.values(high, low, last_close, int(series.volume[-1])))
@@ -0,0 +1,193 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Recursive averages are evaluated in blocks: inside a block every output is a
+# weighted sum of the block's inputs plus the decayed carry-in, i.e. one
+# small matrix product, so there is no per-bar Python loop
+EMA_BLOCK = 64
+
+
+def _nan(n):
+    return np.full(n, np.nan)
+
+
+def _decay_weights(alpha, size):
+    lags = np.arange(size)
+    decay = (1 - alpha) ** lags
+    weights = np.tril(alpha * decay[np.subtract.outer(lags, lags).clip(0)])
+    return weights, (1 - alpha) * decay
+
+
+def _recursive_average(values, alpha, period):
+    """y[t] = alpha * x[t] + (1 - alpha) * y[t-1], seeded with the mean of the first period values.
+
+    Leading NaNs are skipped; the output is NaN until the seed is available.
+    """
+    values = np.asarray(values, dtype=float)
+    out = _nan(len(values))
+    valid = np.flatnonzero(~np.isnan(values))
+    if not len(valid) or len(values) - valid[0] < period:
+        return out
+
+    seed_at = valid[0] + period - 1
+    out[seed_at] = values[valid[0]:seed_at + 1].mean()
+    weights, carry = _decay_weights(alpha, EMA_BLOCK)
+    prev = out[seed_at]
+    for start in range(seed_at + 1, len(values), EMA_BLOCK):
+        block = values[start:start + EMA_BLOCK]
+        size = len(block)
+        out[start:start + size] = weights[:size, :size] @ block + carry[:size] * prev
+        prev = out[start + size - 1]
+    return out
+
+
+def sma(values, period):
+    """Simple moving average"""
+    values = np.asarray(values, dtype=float)
+    out = _nan(len(values))
+    if len(values) >= period:
+        out[period - 1:] = sliding_window_view(values, period).mean(axis=1)
+    return out
+
+
+def ema(values, period):
+    """Exponential moving average (alpha = 2 / (period + 1)), seeded with an SMA"""
+    return _recursive_average(values, 2.0 / (period + 1), period)
+
+
+def wilder(values, period):
+    """Wilder's smoothed average (alpha = 1 / period), seeded with an SMA"""
+    return _recursive_average(values, 1.0 / period, period)
+
+
+def rsi(close, period=14):
+    """Relative Strength Index with Wilder smoothing"""
+    close = np.asarray(close, dtype=float)
+    out = _nan(len(close))
+    if len(close) <= period:
+        return out
+    delta = np.diff(close)
+    avg_gain = wilder(np.clip(delta, 0, None), period)
+    avg_loss = wilder(np.clip(-delta, 0, None), period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out[1:] = np.where(avg_loss == 0, 100.0, 100 - 100 / (1 + avg_gain / avg_loss))
+    return out
+
+
+def macd(close, fast=12, slow=26, signal=9):
+    """MACD line, signal line and histogram"""
+    line = ema(close, fast) - ema(close, slow)
+    signal_line = ema(line, signal)
+    return line, signal_line, line - signal_line
+
+
+def bollinger(close, period=20, width=2.0):
+    """Middle band (SMA), upper and lower bands at width population standard deviations"""
+    close = np.asarray(close, dtype=float)
+    middle = sma(close, period)
+    deviation = _nan(len(close))
+    if len(close) >= period:
+        deviation[period - 1:] = sliding_window_view(close, period).std(axis=1)
+    return middle, middle + width * deviation, middle - width * deviation
+
+
+def true_range(high, low, close):
+    high = np.asarray(high, dtype=float)
+    low = np.asarray(low, dtype=float)
+    close = np.asarray(close, dtype=float)
+    out = high - low
+    if len(close) > 1:
+        previous = close[:-1]
+        out[1:] = np.maximum(out[1:], np.maximum(np.abs(high[1:] - previous), np.abs(low[1:] - previous)))
+    return out
+
+
+def atr(high, low, close, period=14):
+    """Average True Range with Wilder smoothing"""
+    return wilder(true_range(high, low, close), period)
+
+
+def vwap(high, low, close, volume, period=None):
+    """Volume-weighted average of the typical price.
+
+    Anchored at the first bar, or over a rolling window of period bars. NaN
+    where the window traded no volume (indices report none).
+    """
+    typical = (np.asarray(high, dtype=float) + np.asarray(low, dtype=float) + np.asarray(close, dtype=float)) / 3
+    volume = np.asarray(volume, dtype=float)
+    if period is None:
+        traded = np.cumsum(typical * volume)
+        total = np.cumsum(volume)
+    else:
+        traded = _nan(len(volume))
+        total = _nan(len(volume))
+        if len(volume) >= period:
+            traded[period - 1:] = sliding_window_view(typical * volume, period).sum(axis=1)
+            total[period - 1:] = sliding_window_view(volume, period).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total > 0, traded / total, np.nan)
+
+
+def compute(series):
+    """Evaluate every indicator over the full series; returns {name: array}"""
+    macd_line, macd_signal, macd_histogram = macd(series.close)
+    bb_middle, bb_upper, bb_lower = bollinger(series.close)
+    return {
+        'sma_20': sma(series.close, 20),
+        'sma_50': sma(series.close, 50),
+        'sma_200': sma(series.close, 200),
+        'ema_12': ema(series.close, 12),
+        'ema_26': ema(series.close, 26),
+        'rsi': rsi(series.close),
+        'macd': macd_line,
+        'macd_signal': macd_signal,
+        'macd_histogram': macd_histogram,
+        'bollinger_middle': bb_middle,
+        'bollinger_upper': bb_upper,
+        'bollinger_lower': bb_lower,
+        'atr': atr(series.high, series.low, series.close),
+        'vwap_20': vwap(series.high, series.low, series.close, series.volume, 20)
+    }
+
+
+def _value(array):
+    if not len(array) or np.isnan(array[-1]):
+        return None
+    return float(array[-1])
+
+
+def shape_latest(values):
+    """Nest flat {name: value} indicator values the way the API returns them"""
+    return {
+        'sma_20': values['sma_20'],
+        'sma_50': values['sma_50'],
+        'sma_200': values['sma_200'],
+        'ema_12': values['ema_12'],
+        'ema_26': values['ema_26'],
+        'rsi': values['rsi'],
+        'macd': {
+            'macd': values['macd'],
+            'signal': values['macd_signal'],
+            'histogram': values['macd_histogram']
+        },
+        'bollinger': {
+            'middle': values['bollinger_middle'],
+            'upper': values['bollinger_upper'],
+            'lower': values['bollinger_lower']
+        },
+        'atr': values['atr'],
+        'vwap_20': values['vwap_20']
+    }
+
+
+def latest(series):
+    """Latest value of every indicator, shaped for JSON (None where undefined)"""
+    return shape_latest({name: _value(array) for name, array in compute(series).items()})
+
+
+def latest_batch(series_by_symbol):
+    """latest() for many symbols in one call; symbols with no series map to None"""
+    return {
+        symbol: latest(series) if series is not None and len(series) else None
+        for symbol, series in series_by_symbol.items()
+    }
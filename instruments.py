@@ -0,0 +1,271 @@
+import csv
+import re
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+import numpy as np
+
+# Listings rank by exchange first, then by liquidity within an exchange
+EXCHANGE_PRIORITY = {'NSE': 0, 'BSE': 1, 'NFO': 2, 'BFO': 3, 'CDS': 4, 'MCX': 5}
+EQUITY_TYPES = {'EQ', 'BE', 'BZ', 'SM', 'ST'}
+
+# Header aliases for the instrument dumps we accept: a plain
+# symbol,name,exchange,... file, NSE's EQUITY_L.csv and broker instrument dumps
+COLUMN_ALIASES = {
+    'symbol': ('symbol', 'tradingsymbol', 'trading_symbol', 'SYMBOL'),
+    'name': ('name', 'company_name', 'NAME OF COMPANY', 'Security Name'),
+    'exchange': ('exchange', 'EXCHANGE'),
+    'instrument_type': ('instrument_type', 'series', 'SERIES', 'type'),
+    'isin': ('isin', 'ISIN NUMBER', 'ISIN No'),
+    'lot_size': ('lot_size', 'MARKET LOT'),
+    'expiry': ('expiry', 'EXPIRY'),
+    'strike': ('strike', 'STRIKE'),
+    'liquidity': ('liquidity', 'avg_volume', 'volume', 'VOLUME')
+}
+
+# Prefixes up to this length get their best matches precomputed
+CACHED_PREFIX_LENGTH = 2
+MAX_RESULTS = 50
+MIN_TRIGRAM_SCORE = 0.3
+
+
+class Instrument:
+    __slots__ = ('symbol', 'name', 'exchange', 'instrument_type', 'isin', 'lot_size', 'expiry', 'strike', 'liquidity')
+
+    def __init__(self, symbol, name='', exchange='NSE', instrument_type='EQ', isin='', lot_size=1,
+                 expiry='', strike=0.0, liquidity=0.0):
+        self.symbol = symbol
+        self.name = name
+        self.exchange = exchange
+        self.instrument_type = instrument_type
+        self.isin = isin
+        self.lot_size = lot_size
+        self.expiry = expiry
+        self.strike = strike
+        self.liquidity = liquidity
+
+    @property
+    def is_equity(self):
+        return self.instrument_type in EQUITY_TYPES
+
+    def rank_key(self):
+        return (EXCHANGE_PRIORITY.get(self.exchange, len(EXCHANGE_PRIORITY)), not self.is_equity,
+                -self.liquidity, self.symbol)
+
+    def to_dict(self):
+        return {
+            'symbol': self.symbol,
+            'name': self.name,
+            'exchange': self.exchange,
+            'instrument_type': self.instrument_type,
+            'isin': self.isin,
+            'lot_size': self.lot_size,
+            'expiry': self.expiry or None,
+            'strike': self.strike or None
+        }
+
+
+_NON_ALNUM = re.compile(r'[^0-9A-Z]+')
+
+# Trigrams are packed into ints over a 37-character alphabet
+_ALPHABET = ' 0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_CHAR_CODES = np.zeros(256, dtype=np.int64)
+_CHAR_CODES[[ord(ch) for ch in _ALPHABET]] = np.arange(len(_ALPHABET))
+GRAM_SPACE = len(_ALPHABET) ** 3
+
+
+def normalize(text):
+    """Upper-case words of letters and digits separated by single spaces"""
+    return _NON_ALNUM.sub(' ', text.upper()).strip()
+
+
+def compact(text):
+    """Symbol form used for exact and prefix matching: letters and digits only"""
+    return _NON_ALNUM.sub('', text.upper())
+
+
+def trigram_codes(texts, owners):
+    """Unique (owner, trigram code) pairs for texts, each padded and split into trigrams"""
+    segments = [f"  {normalize(text)} " for text in texts]
+    lengths = np.fromiter((len(segment) for segment in segments), dtype=np.int64, count=len(segments))
+    chars = _CHAR_CODES[np.frombuffer(''.join(segments).encode('ascii'), dtype=np.uint8)]
+    codes = chars[:-2] * len(_ALPHABET) ** 2 + chars[1:-1] * len(_ALPHABET) + chars[2:]
+
+    # Keep only trigrams that start and end inside one segment
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)[:-2]
+    offsets = np.arange(len(codes)) - starts
+    valid = offsets <= np.repeat(lengths, lengths)[:-2] - 3
+    owner = np.repeat(np.asarray(owners, dtype=np.int64), lengths)[:-2]
+    pairs = np.unique(owner[valid] * GRAM_SPACE + codes[valid])
+    return pairs // GRAM_SPACE, pairs % GRAM_SPACE
+
+
+def _field(row, name):
+    for alias in COLUMN_ALIASES[name]:
+        value = row.get(alias)
+        if value not in (None, ''):
+            return value.strip()
+    return ''
+
+
+def _number(value, cast, default):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def read_instrument_file(path, default_exchange='NSE'):
+    """Read instruments from a CSV dump, mapping known header aliases"""
+    instruments = []
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        reader.fieldnames = [name.strip() for name in reader.fieldnames or []]
+        for row in reader:
+            symbol = _field(row, 'symbol').upper()
+            if not symbol:
+                continue
+            instruments.append(Instrument(
+                symbol,
+                name=_field(row, 'name'),
+                exchange=(_field(row, 'exchange') or default_exchange).upper(),
+                instrument_type=(_field(row, 'instrument_type') or 'EQ').upper(),
+                isin=_field(row, 'isin'),
+                lot_size=_number(_field(row, 'lot_size'), int, 1),
+                expiry=_field(row, 'expiry'),
+                strike=_number(_field(row, 'strike'), float, 0.0),
+                liquidity=_number(_field(row, 'liquidity'), float, 0.0)
+            ))
+    return instruments
+
+
+class InstrumentIndex:
+    """In-memory instrument master with prefix and fuzzy search.
+
+    Instruments are stored in rank order (exchange, equity first, liquidity),
+    so an instrument's id doubles as its rank. Prefix search works on a
+    flattened trie: the sorted array of (key, id) pairs for every symbol and
+    name word, where a prefix's matches are one contiguous bisect range, and
+    the best matches of every short prefix are precomputed. Fuzzy search
+    scores candidates by shared trigrams from per-trigram posting arrays.
+    """
+
+    def __init__(self, instruments=()):
+        self.instruments = sorted(instruments, key=Instrument.rank_key)
+        self.by_symbol = defaultdict(list)
+
+        pairs = []
+        texts = []
+        owners = []
+        for i, instrument in enumerate(self.instruments):
+            symbol = compact(instrument.symbol)
+            self.by_symbol[symbol].append(i)
+            keys = {symbol}
+            texts.append(instrument.symbol)
+            owners.append(i)
+            name = normalize(instrument.name)
+            if name:
+                keys.add(name)
+                keys.update(name.split())
+                texts.append(name)
+                owners.append(i)
+            pairs.extend((key, i) for key in keys)
+
+        pairs.sort()
+        self._keys = [key for key, _ in pairs]
+        self._ids = np.array([i for _, i in pairs], dtype=np.int32)
+
+        # Postings: instrument ids grouped by trigram code, ids ascending within a code
+        owner, code = trigram_codes(texts, owners) if texts else (np.empty(0, np.int64), np.empty(0, np.int64))
+        self._trigram_counts = np.bincount(owner, minlength=len(self.instruments))
+        order = np.argsort(code, kind='stable')
+        self._posting_codes = code[order]
+        self._posting_ids = owner[order].astype(np.int32)
+
+        self._prefix_cache = {}
+        short_prefixes = {key[:n] for key in self._keys for n in range(1, CACHED_PREFIX_LENGTH + 1)}
+        for prefix in short_prefixes:
+            self._prefix_cache[prefix] = self._prefix_ids(prefix, MAX_RESULTS)
+
+    def __len__(self):
+        return len(self.instruments)
+
+    @classmethod
+    def from_files(cls, paths):
+        """Build an index from CSV instrument files, skipping ones that cannot be read"""
+        instruments = []
+        for path in paths:
+            try:
+                instruments.extend(read_instrument_file(path))
+            except (OSError, csv.Error, UnicodeDecodeError) as e:
+                print(f"Could not load instruments from {path}: {e}")
+        print(f"Loaded {len(instruments)} instruments")
+        return cls(instruments)
+
+    def _prefix_ids(self, prefix, limit):
+        start = bisect_left(self._keys, prefix)
+        stop = bisect_right(self._keys, prefix + '\uffff')
+        # The same instrument can match on several keys
+        return np.unique(self._ids[start:stop])[:limit]
+
+    def _cached_prefix_ids(self, prefix, limit):
+        cached = self._prefix_cache.get(prefix)
+        if cached is not None:
+            return cached[:limit]
+        return self._prefix_ids(prefix, limit)
+
+    def prefix(self, text, limit=10):
+        """Ids of instruments whose symbol, name or a name word starts with text, best ranked first"""
+        prefixes = {p for p in (normalize(text), compact(text)) if p}
+        if not prefixes:
+            return []
+        ids = np.unique(np.concatenate([self._cached_prefix_ids(p, limit) for p in prefixes]))
+        return ids[:limit].tolist()
+
+    def fuzzy(self, text, limit=10):
+        """Ids of instruments sharing enough trigrams with text, best scored first"""
+        if len(compact(text)) < 3 or not len(self._posting_codes):
+            return []
+        query = trigram_codes([text], [0])[1]
+        starts = np.searchsorted(self._posting_codes, query, side='left')
+        stops = np.searchsorted(self._posting_codes, query, side='right')
+        grams = [self._posting_ids[start:stop] for start, stop in zip(starts, stops) if stop > start]
+        if not grams:
+            return []
+        candidates, hits = np.unique(np.concatenate(grams), return_counts=True)
+        # Dice coefficient over trigram sets
+        score = 2 * hits / (len(query) + self._trigram_counts[candidates])
+        keep = score >= MIN_TRIGRAM_SCORE
+        candidates, score = candidates[keep], score[keep]
+        order = np.lexsort((candidates, -score))[:limit]
+        return candidates[order].tolist()
+
+    def search(self, text, limit=10, exchanges=None):
+        """Exact symbol matches, then prefix matches, then fuzzy matches"""
+        limit = min(limit, MAX_RESULTS)
+        seen = set()
+        results = []
+        # Over-fetch when filtering so the filter does not empty the page
+        fetch = limit if not exchanges else MAX_RESULTS
+        sources = (
+            lambda: self.by_symbol.get(compact(text), []),
+            lambda: self.prefix(text, fetch),
+            lambda: self.fuzzy(text, fetch)
+        )
+        for source in sources:
+            # Later, costlier sources only run when the page is not full yet
+            for i in source():
+                instrument = self.instruments[i]
+                if i in seen or (exchanges and instrument.exchange not in exchanges):
+                    continue
+                seen.add(i)
+                results.append(instrument)
+                if len(results) == limit:
+                    return results
+        return results
+
+
+def load_instrument_index(config):
+    """Build the instrument index from the app's INSTRUMENT_FILES (comma-separated paths)"""
+    paths = [p.strip() for p in (config.get('INSTRUMENT_FILES') or '').split(',') if p.strip()]
+    return InstrumentIndex.from_files(paths)
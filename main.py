@@ -6,6 +6,7 @@ from market_data import market_data_bp
 from portfolio import portfolio_bp
 from config import config
 from models import db, User  # Import db from models.py
+import backend.models  # Portfolio, trading and price history tables, created with the rest below
 from datetime import datetime, timedelta, time, date
 from decimal import Decimal
 from functools import wraps
@@ -0,0 +1,360 @@
+import os
+import pickle
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+def estimate_size(value):
+    """Approximate the memory footprint of a cached JSON-like value in bytes"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += estimate_size(k) + estimate_size(v)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += estimate_size(item)
+    return size
+
+
+class _Stripe:
+    """One lock-protected LRU segment of the cache"""
+
+    def __init__(self, max_bytes):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (value, expires_at, size)
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+
+
+class MarketDataCache:
+    """Bounded in-process cache with per-key TTL and LRU eviction.
+
+    Keys are spread over several independently locked stripes so concurrent
+    gthread/gevent requests for different keys do not contend on one lock.
+    Each stripe owns an equal share of the byte budget and evicts its least
+    recently used entries once that share is exceeded. Expired entries are
+    kept for stale_grace more seconds so get_stale() can still serve them
+    when the upstream is unavailable.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, stripes=16, default_ttl=900, stale_grace=3600):
+        self.default_ttl = default_ttl
+        self.stale_grace = stale_grace
+        self.max_bytes = max_bytes
+        self._stripes = [_Stripe(max_bytes // stripes) for _ in range(stripes)]
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _stripe(self, key):
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def _count(self, hits=0, misses=0, evictions=0, expirations=0):
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
+            self.expirations += expirations
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired"""
+        stripe = self._stripe(key)
+        with stripe.lock:
+            entry = stripe.entries.get(key)
+            if entry is not None:
+                value, expires_at, size = entry
+                now = time.monotonic()
+                if now < expires_at:
+                    stripe.entries.move_to_end(key)
+                    self._count(hits=1)
+                    return value
+                if now >= expires_at + self.stale_grace:
+                    del stripe.entries[key]
+                    stripe.used_bytes -= size
+                    self._count(misses=1, expirations=1)
+                    return None
+        self._count(misses=1)
+        return None
+
+    def get_stale(self, key):
+        """Return the value for key even if expired, as long as it is within the stale grace"""
+        stripe = self._stripe(key)
+        with stripe.lock:
+            entry = stripe.entries.get(key)
+            if entry is not None and time.monotonic() < entry[1] + self.stale_grace:
+                return entry[0]
+        return None
+
+    def set(self, key, value, ttl=None):
+        """Store value under key for ttl seconds (default_ttl when omitted)"""
+        ttl = self.default_ttl if ttl is None else ttl
+        size = estimate_size(value)
+        stripe = self._stripe(key)
+        if size > stripe.max_bytes:
+            # Too large to ever fit; don't flush the whole stripe for it
+            self.delete(key)
+            return False
+
+        evicted = 0
+        with stripe.lock:
+            old = stripe.entries.pop(key, None)
+            if old is not None:
+                stripe.used_bytes -= old[2]
+            stripe.entries[key] = (value, time.monotonic() + ttl, size)
+            stripe.used_bytes += size
+            while stripe.used_bytes > stripe.max_bytes:
+                _, (_, _, old_size) = stripe.entries.popitem(last=False)
+                stripe.used_bytes -= old_size
+                evicted += 1
+        if evicted:
+            self._count(evictions=evicted)
+        return True
+
+    def delete(self, key):
+        """Remove key from the cache if present"""
+        stripe = self._stripe(key)
+        with stripe.lock:
+            entry = stripe.entries.pop(key, None)
+            if entry is not None:
+                stripe.used_bytes -= entry[2]
+
+    def clear(self):
+        """Drop every entry"""
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.entries.clear()
+                stripe.used_bytes = 0
+
+    def purge_expired(self):
+        """Remove entries past their stale grace so they stop counting against the budget"""
+        now = time.monotonic() - self.stale_grace
+        purged = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                expired = [k for k, (_, expires_at, _) in stripe.entries.items() if expires_at <= now]
+                for k in expired:
+                    stripe.used_bytes -= stripe.entries.pop(k)[2]
+                purged += len(expired)
+        if purged:
+            self._count(expirations=purged)
+        return purged
+
+    def stats(self):
+        """Return hit/miss/eviction counters and current memory usage"""
+        entries = 0
+        used_bytes = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                entries += len(stripe.entries)
+                used_bytes += stripe.used_bytes
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': entries,
+                'used_bytes': used_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None
+            }
+
+
+class SQLiteCacheBackend:
+    """Cache shared by every worker on a host through one SQLite WAL file.
+
+    Values are stored pickled so a hit costs one unpickle instead of a JSON
+    parse, and expiry uses wall-clock time so all processes agree on it.
+    Connections are opened lazily per thread (and per process after a fork).
+    """
+
+    def __init__(self, path, default_ttl=900, timeout=5.0, stale_grace=3600):
+        self.path = path
+        self.default_ttl = default_ttl
+        self.stale_grace = stale_grace
+        self.timeout = timeout
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS market_cache ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_market_cache_expires ON market_cache (expires_at)')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, hits=0, misses=0, errors=0):
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += misses
+            self.errors += errors
+
+    def get_with_ttl(self, key):
+        """Return (value, remaining_seconds) for key, or (None, 0) on a miss"""
+        try:
+            row = self._connection().execute(
+                'SELECT value, expires_at FROM market_cache WHERE key = ?', (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Shared cache read failed for {key}: {e}")
+            self._count(misses=1, errors=1)
+            return None, 0
+        if row is not None:
+            remaining = row[1] - time.time()
+            if remaining > 0:
+                self._count(hits=1)
+                return pickle.loads(row[0]), remaining
+        self._count(misses=1)
+        return None, 0
+
+    def get(self, key):
+        return self.get_with_ttl(key)[0]
+
+    def get_stale(self, key):
+        try:
+            row = self._connection().execute(
+                'SELECT value FROM market_cache WHERE key = ? AND expires_at > ?',
+                (key, time.time() - self.stale_grace)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Shared cache read failed for {key}: {e}")
+            self._count(errors=1)
+            return None
+        return pickle.loads(row[0]) if row is not None else None
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        try:
+            payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            self._connection().execute(
+                'INSERT OR REPLACE INTO market_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, payload, time.time() + ttl)
+            )
+        except (sqlite3.Error, pickle.PicklingError, TypeError, AttributeError) as e:
+            print(f"Shared cache write failed for {key}: {e}")
+            self._count(errors=1)
+            return False
+        return True
+
+    def delete(self, key):
+        try:
+            self._connection().execute('DELETE FROM market_cache WHERE key = ?', (key,))
+        except sqlite3.Error as e:
+            print(f"Shared cache delete failed for {key}: {e}")
+            self._count(errors=1)
+
+    def clear(self):
+        self._connection().execute('DELETE FROM market_cache')
+
+    def purge_expired(self):
+        try:
+            cursor = self._connection().execute(
+                'DELETE FROM market_cache WHERE expires_at <= ?', (time.time() - self.stale_grace,)
+            )
+        except sqlite3.Error as e:
+            print(f"Shared cache purge failed: {e}")
+            self._count(errors=1)
+            return 0
+        return cursor.rowcount
+
+    def stats(self):
+        try:
+            entries, used_bytes = self._connection().execute(
+                'SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM market_cache'
+            ).fetchone()
+        except sqlite3.Error:
+            entries = used_bytes = None
+        with self._stats_lock:
+            return {
+                'backend': 'sqlite',
+                'path': self.path,
+                'entries': entries,
+                'used_bytes': used_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors
+            }
+
+
+class TieredCache:
+    """Per-worker MarketDataCache in front of a cache shared across workers.
+
+    Local hits return the already-deserialized object. Values pulled from the
+    shared tier are kept locally for at most local_ttl seconds so a delete in
+    one worker is seen by the others shortly afterwards.
+    """
+
+    def __init__(self, local, shared, local_ttl=30):
+        self.local = local
+        self.shared = shared
+        self.local_ttl = local_ttl
+        self.max_bytes = local.max_bytes
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        value, remaining = self.shared.get_with_ttl(key)
+        if value is not None:
+            self.local.set(key, value, ttl=min(remaining, self.local_ttl))
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.local.default_ttl if ttl is None else ttl
+        self.local.set(key, value, ttl=min(ttl, self.local_ttl))
+        return self.shared.set(key, value, ttl=ttl)
+
+    def get_stale(self, key):
+        value = self.local.get_stale(key)
+        return value if value is not None else self.shared.get_stale(key)
+
+    def delete(self, key):
+        self.local.delete(key)
+        self.shared.delete(key)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def purge_expired(self):
+        return self.local.purge_expired() + self.shared.purge_expired()
+
+    def stats(self):
+        return {'local': self.local.stats(), 'shared': self.shared.stats()}
+
+
+def create_market_cache(config):
+    """Build the cache selected by MARKET_CACHE_BACKEND ('memory' or 'sqlite')"""
+    stale_grace = config.get('MARKET_CACHE_STALE_GRACE', 3600)
+    local = MarketDataCache(
+        max_bytes=config.get('MARKET_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+        stripes=config.get('MARKET_CACHE_STRIPES', 16),
+        stale_grace=stale_grace
+    )
+    backend = config.get('MARKET_CACHE_BACKEND', 'memory')
+    if backend == 'memory':
+        return local
+    if backend == 'sqlite':
+        path = config.get('MARKET_CACHE_PATH') or os.path.join(tempfile.gettempdir(), 'virtualtrade_cache.db')
+        shared = SQLiteCacheBackend(path, stale_grace=stale_grace)
+        return TieredCache(local, shared, local_ttl=config.get('MARKET_CACHE_LOCAL_TTL', 30))
+    raise ValueError(f"Unknown MARKET_CACHE_BACKEND: {backend}")
@@ -1,111 +1,314 @@
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, Response, jsonify, request, current_app
 import requests
 import os
 from datetime import datetime, timedelta
 import json
-import uuid
 import yfinance as yf
-from functools import lru_cache
+from functools import partial
 import threading
 import time
+import tempfile
+from market_cache import MarketDataCache, create_market_cache
+from singleflight import SingleFlight, SingleFlightTimeout
+from refresher import RefreshScheduler
+from batch_quotes import BatchQuoteFetcher, parse_global_quote
+from quota import QuotaManager, QuotaExceeded, background_priority, create_quota_store
+import http_client
+from gateway import MarketGateway
+from derivatives import DerivativesSnapshot, nse_query, contract_symbol, parse_contract_symbol
+import option_pricing
+from instruments import InstrumentIndex, load_instrument_index
+from depth import DepthSimulator
+from quote_stream import QuoteStreamHub
+from replay import ReplayEngine, ReplayError, parse_timestamp, series_key, time_series_columns
+from matching_engine import MatchingEngine, Order, OrderError
+from portfolio import get_user_id
+import order_store
+import valuation
+from price_history import sync_daily_history, latest_stored_date, export_to_store
+from timeseries_store import TimeSeriesStore, PriceSeries
+import indicators
+from indicator_state import IndicatorStateStore
 
 market_data_bp = Blueprint('market_data', __name__)
 
 # Alpha Vantage API key
 ALPHA_VANTAGE_API_KEY = os.environ.get('ALPHA_VANTAGE_API_KEY', 'demo')
 
-# Cache for storing market data to reduce API calls
-market_data_cache = {}
-cache_expiry = {}
+# Every upstream call draws on its provider's budget. Alpha Vantage limits
+# come from the API plan; NSE is throttled to stay clear of its bot blocking.
+quota_manager = QuotaManager()
+quota_manager.add_provider('alpha_vantage', int(os.environ.get('ALPHA_VANTAGE_CALLS_PER_MINUTE', 75)))
+quota_manager.add_provider('nse', 30)
 
-# Cache for market data
-market_data_cache = {}
-cache_lock = threading.Lock()
-CACHE_DURATION = 60  # seconds
+# Cache for storing market data to reduce API calls. Replaced with the
+# backend selected by MARKET_CACHE_* config when the blueprint is registered.
+market_cache = MarketDataCache()
+CACHE_PURGE_INTERVAL = 60  # seconds
 
-def get_cached_data(cache_key, expiry_minutes=15):
+@market_data_bp.record_once
+def configure_cache(state):
+    """Rebuild the market data cache from the app's configured backend"""
+    global market_cache
+    market_cache = create_market_cache(state.app.config)
+    refresher.cache = market_cache
+
+@market_data_bp.record_once
+def configure_upstream(state):
+    """Apply the app's upstream budgets and batch concurrency settings"""
+    global gateway, quote_batcher
+    config = state.app.config
+    reserve = config.get('UPSTREAM_BACKGROUND_RESERVE', 0.2)
+    quota_manager.store = create_quota_store(config)
+    quota_manager.add_provider(
+        'alpha_vantage',
+        config.get('ALPHA_VANTAGE_CALLS_PER_MINUTE', 75),
+        per_day=config.get('ALPHA_VANTAGE_CALLS_PER_DAY'),
+        background_reserve=reserve
+    )
+    quota_manager.add_provider('nse', config.get('NSE_CALLS_PER_MINUTE', 30), background_reserve=reserve)
+    http_client.configure(config, admit=quota_manager.acquire)
+    option_pricing.configure(config)
+    gateway = MarketGateway(max_workers=config.get('GATEWAY_WORKERS', 16))
+    quote_batcher = BatchQuoteFetcher(fetch_global_quote, gateway)
+
+# Memory-mapped daily bars, shared by every worker on the host through the
+# page cache. Rebuilt from PRICE_STORE_DIR when the blueprint is registered.
+price_store = None
+
+@market_data_bp.record_once
+def configure_price_store(state):
+    """Open the columnar price store under the app's PRICE_STORE_DIR"""
+    global price_store
+    root = state.app.config.get('PRICE_STORE_DIR') or os.path.join(tempfile.gettempdir(), 'virtualtrade_prices')
+    price_store = TimeSeriesStore(root)
+
+# Incremental per-symbol indicator accumulators, snapshotted under
+# INDICATOR_STATE_DIR so a restarted worker resumes instead of replaying
+indicator_states = None
+
+@market_data_bp.record_once
+def configure_indicator_states(state):
+    """Open the indicator state snapshots under the app's INDICATOR_STATE_DIR"""
+    global indicator_states
+    root = state.app.config.get('INDICATOR_STATE_DIR') or os.path.join(tempfile.gettempdir(), 'virtualtrade_indicators')
+    indicator_states = IndicatorStateStore(root)
+
+# Local instrument master for symbol search; empty until INSTRUMENT_FILES
+# are loaded, in which case search falls back to the upstream providers
+instrument_index = InstrumentIndex()
+SEARCH_LIMIT = 10
+YAHOO_SUFFIXES = {'NSE': '.NS', 'BSE': '.BO'}
+
+@market_data_bp.record_once
+def configure_instruments(state):
+    """Load the instrument master from the app's INSTRUMENT_FILES"""
+    global instrument_index
+    instrument_index = load_instrument_index(state.app.config)
+
+# Simulated order books for symbols whose depth is being watched. Books are
+# re-priced from a quote at most every DEPTH_QUOTE_TTL seconds and otherwise
+# served from memory.
+depth_simulator = DepthSimulator()
+DEPTH_QUOTE_TTL = 60
+
+@market_data_bp.record_once
+def configure_depth(state):
+    """Apply the app's MARKET_DEPTH_* settings to the depth simulator"""
+    global depth_simulator, DEPTH_QUOTE_TTL
+    config = state.app.config
+    depth_simulator = DepthSimulator(
+        levels=config.get('MARKET_DEPTH_LEVELS', 10),
+        tick_size=config.get('MARKET_DEPTH_TICK_SIZE', 0.05),
+        spread_bps=config.get('MARKET_DEPTH_SPREAD_BPS', 10)
+    )
+    DEPTH_QUOTE_TTL = config.get('MARKET_DEPTH_QUOTE_TTL', DEPTH_QUOTE_TTL)
+
+class UpstreamError(Exception):
+    """An upstream market data call failed; carries the HTTP status to return"""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+# Concurrent misses on the same cache key share a single upstream fetch
+upstream_flights = SingleFlight()
+UPSTREAM_WAIT_TIMEOUT = 30  # seconds a coalesced caller waits for the leader
+
+def get_cached_data(cache_key):
     """Get data from cache if available and not expired"""
-    if cache_key in market_data_cache and cache_key in cache_expiry:
-        if datetime.now() < cache_expiry[cache_key]:
-            return market_data_cache[cache_key]
-    return None
+    return market_cache.get(cache_key)
 
 def set_cached_data(cache_key, data, expiry_minutes=15):
     """Store data in cache with expiry time"""
-    market_data_cache[cache_key] = data
-    cache_expiry[cache_key] = datetime.now() + timedelta(minutes=expiry_minutes)
+    market_cache.set(cache_key, data, ttl=expiry_minutes * 60)
 
-def update_cache():
-    while True:
-        with cache_lock:
-            current_time = datetime.now()
-            market_data_cache.clear()
-        time.sleep(CACHE_DURATION)
+def get_or_fetch(cache_key, fetch, expiry_minutes=15):
+    """Return cached data, or run fetch() once for all concurrent callers and cache it"""
+    cached_data = get_cached_data(cache_key)
+    if cached_data is not None:
+        return cached_data
 
-# Start cache update thread
-cache_thread = threading.Thread(target=update_cache, daemon=True)
-cache_thread.start()
+    def load():
+        # Another flight may have filled the cache while we were queued
+        cached_data = get_cached_data(cache_key)
+        if cached_data is not None:
+            return cached_data
+        data = fetch()
+        set_cached_data(cache_key, data, expiry_minutes)
+        return data
 
-@lru_cache(maxsize=100)
-def get_stock_data(symbol):
     try:
-        stock = yf.Ticker(symbol)
-        return stock.info
-    except Exception as e:
-        print(f"Error fetching stock data: {e}")
-        return None
+        return upstream_flights.do(cache_key, load, timeout=UPSTREAM_WAIT_TIMEOUT)
+    except SingleFlightTimeout as e:
+        raise UpstreamError(str(e), 504)
+    except QuotaExceeded as e:
+        # Out of upstream budget: an expired copy beats an error
+        stale_data = market_cache.get_stale(cache_key)
+        if stale_data is not None:
+            print(f"Serving stale {cache_key}: {e}")
+            return stale_data
+        raise UpstreamError('API rate limit reached. Please try again later.', 429)
 
-@market_data_bp.route('/search', methods=['GET'])
-def search_symbol():
-    """Search for a stock symbol"""
-    query = request.args.get('q', '')
-    if not query:
-        print("Search query is empty")
-        return jsonify({'error': 'Query parameter is required'}), 400
-    
-    print(f"Searching for stocks with query: {query}")
-    
-    cache_key = f"search_{query}"
-    cached_data = get_cached_data(cache_key)
-    if cached_data:
-        print(f"Found cached data for query: {query}")
-        return jsonify(cached_data)
-    
+def fetch_alpha_vantage(url, error_message='Failed to fetch data from Alpha Vantage'):
+    """Fetch a raw Alpha Vantage payload within the provider's quota"""
+    quota_manager.acquire('alpha_vantage')
+    try:
+        response = http_client.get_client('alpha_vantage').get(url)
+    except requests.RequestException as e:
+        print(f"Alpha Vantage request failed: {e}")
+        raise UpstreamError(error_message, 502)
+
+    if response.status_code != 200:
+        print(f"Error from Alpha Vantage API ({response.status_code}): {response.text}")
+        raise UpstreamError(error_message)
+
+    return response.json()
+
+# Hot endpoints are refreshed in the background and served stale-while-revalidate
+refresher = RefreshScheduler(market_cache, upstream_flights)
+refresher.every(CACHE_PURGE_INTERVAL, lambda: market_cache.purge_expired())
+refresher.start()
+
+def get_hot_data(key):
+    """Serve a refresher-managed key, converting wait and quota failures to UpstreamError"""
+    try:
+        return refresher.get(key)
+    except SingleFlightTimeout as e:
+        raise UpstreamError(str(e), 504)
+    except QuotaExceeded:
+        raise UpstreamError('API rate limit reached. Please try again later.', 429)
+
+def with_staleness(response, meta):
+    """Attach the age of a stale-while-revalidate value to the response headers"""
+    response.headers['X-Data-Fetched-At'] = datetime.fromtimestamp(meta['fetched_at']).isoformat()
+    response.headers['X-Data-Age'] = str(int(meta['age']))
+    response.headers['X-Data-Stale'] = 'true' if meta['stale'] else 'false'
+    return response
+
+@market_data_bp.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Get market data cache and request coalescing counters for this worker"""
+    return jsonify({
+        'cache': market_cache.stats(),
+        'singleflight': upstream_flights.stats(),
+        'refresher': refresher.stats()
+    })
+
+@market_data_bp.route('/upstream/quota', methods=['GET'])
+def get_upstream_quota():
+    """Get the remaining upstream call budget per provider for this worker"""
+    return jsonify(quota_manager.stats())
+
+# Shared per-worker event loop for endpoints that fan out to several upstream calls
+gateway = MarketGateway()
+YAHOO_CALL_TIMEOUT = 10  # seconds per yfinance call in a fan-out
+
+def fetch_yahoo_info(symbol):
+    """Get yfinance Ticker.info for a symbol through the short-lived cache"""
+    return get_or_fetch(f"yahoo_info_{symbol}", lambda: yf.Ticker(symbol).info, expiry_minutes=1)
+
+def fetch_symbol_search(query):
+    """Search Alpha Vantage for a symbol and keep only Indian listings"""
     url = f"https://www.alphavantage.co/query?function=SYMBOL_SEARCH&keywords={query}&apikey={ALPHA_VANTAGE_API_KEY}"
     print(f"Making API request to: {url}")
-    response = requests.get(url)
-    
-    if response.status_code != 200:
-        print(f"Error from Alpha Vantage API: {response.status_code}")
-        return jsonify({'error': 'Failed to fetch data from Alpha Vantage'}), 500
-    
-    data = response.json()
-    print(f"Received data from Alpha Vantage: {data}")
-    
+    data = fetch_alpha_vantage(url)
+
     # Check for API errors
     if 'Error Message' in data:
         print(f"Alpha Vantage API error: {data['Error Message']}")
-        return jsonify({'error': data['Error Message']}), 500
-    
+        raise UpstreamError(data['Error Message'])
+
     if 'Note' in data:
         print(f"Alpha Vantage API note: {data['Note']}")
-        return jsonify({'error': 'API rate limit reached. Please try again later.'}), 429
-    
-    # Filter for Indian stocks (NSE/BSE)
-    if 'bestMatches' in data:
-        indian_stocks = [stock for stock in data['bestMatches'] 
-                        if stock['4. region'] == 'India' or 
-                           '.BSE' in stock['1. symbol'] or 
-                           '.NSE' in stock['1. symbol']]
-        print(f"Filtered Indian stocks: {indian_stocks}")
-        
-        # Return the filtered bestMatches array
-        data['bestMatches'] = indian_stocks
-        set_cached_data(cache_key, data)
-        return jsonify(data)
-    else:
+        raise UpstreamError('API rate limit reached. Please try again later.', 429)
+
+    if 'bestMatches' not in data:
         print("No bestMatches found in response")
-        return jsonify({'bestMatches': [], 'message': 'No matching stocks found'})
+        return {'bestMatches': [], 'message': 'No matching stocks found'}
+
+    # Filter for Indian stocks (NSE/BSE)
+    data['bestMatches'] = [stock for stock in data['bestMatches']
+                           if stock['4. region'] == 'India' or
+                              '.BSE' in stock['1. symbol'] or
+                              '.NSE' in stock['1. symbol']]
+    print(f"Filtered Indian stocks: {data['bestMatches']}")
+    return data
+
+def search_instruments_alpha(query):
+    """Search the instrument master, shaped like an Alpha Vantage SYMBOL_SEARCH response"""
+    matches = []
+    for instrument in instrument_index.search(query, SEARCH_LIMIT):
+        suffix = f".{instrument.exchange}" if instrument.exchange in ('NSE', 'BSE') else ''
+        matches.append({
+            '1. symbol': instrument.symbol + suffix,
+            '2. name': instrument.name,
+            '3. type': 'Equity' if instrument.is_equity else instrument.instrument_type,
+            '4. region': 'India',
+            '8. currency': 'INR',
+            'exchange': instrument.exchange
+        })
+    if not matches:
+        return {'bestMatches': [], 'message': 'No matching stocks found'}
+    return {'bestMatches': matches}
+
+def search_symbols(query):
+    """Symbol search from the instrument master, or Alpha Vantage when none is loaded"""
+    if len(instrument_index):
+        return search_instruments_alpha(query)
+    return get_or_fetch(f"search_{query}", lambda: fetch_symbol_search(query))
+
+@market_data_bp.route('/search', methods=['GET'])
+def search_symbol():
+    """Search for a stock symbol"""
+    query = request.args.get('q', '')
+    if not query:
+        print("Search query is empty")
+        return jsonify({'error': 'Query parameter is required'}), 400
+
+    print(f"Searching for stocks with query: {query}")
+
+    try:
+        data = search_symbols(query)
+    except UpstreamError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    return jsonify(data)
+
+def fetch_global_quote(symbol):
+    """Get the GLOBAL_QUOTE payload for a symbol through the short-lived quote cache"""
+    def fetch():
+        url = f"https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={symbol}&apikey={ALPHA_VANTAGE_API_KEY}"
+        data = fetch_alpha_vantage(url)
+        if 'Note' in data or 'Information' in data:
+            # Don't cache throttling notices as if they were quotes
+            raise UpstreamError('API rate limit reached. Please try again later.', 429)
+        return data
+
+    return get_or_fetch(f"quote_{symbol}", fetch, expiry_minutes=1)  # Short cache for quotes
+
+# Shared by every endpoint that needs quotes for a list of symbols
+quote_batcher = BatchQuoteFetcher(fetch_global_quote, gateway)
+MAX_BATCH_SYMBOLS = 50
 
 @market_data_bp.route('/quote', methods=['GET'])
 def get_quote():
@@ -113,44 +316,381 @@ def get_quote():
     symbol = request.args.get('symbol', '')
     if not symbol:
         return jsonify({'error': 'Symbol parameter is required'}), 400
-    
-    cache_key = f"quote_{symbol}"
-    cached_data = get_cached_data(cache_key, expiry_minutes=1)  # Short cache for quotes
-    if cached_data:
-        return jsonify(cached_data)
-    
-    url = f"https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={symbol}&apikey={ALPHA_VANTAGE_API_KEY}"
-    response = requests.get(url)
-    
-    if response.status_code != 200:
-        return jsonify({'error': 'Failed to fetch data from Alpha Vantage'}), 500
-    
-    data = response.json()
-    set_cached_data(cache_key, data)
+
+    try:
+        data = fetch_global_quote(symbol)
+    except UpstreamError as e:
+        return jsonify({'error': str(e)}), e.status_code
     return jsonify(data)
 
+def fetch_stream_quotes(symbols):
+    """GLOBAL_QUOTE payloads for the streamed symbols, fetched as background work"""
+    with background_priority():
+        results, errors = gateway.gather({s: partial(fetch_global_quote, s) for s in symbols},
+                                         deadline=STREAM_POLL_INTERVAL)
+    for symbol, error in errors.items():
+        print(f"Quote stream could not fetch {symbol}: {error}")
+    return {symbol: data for symbol, data in results.items() if data.get('Global Quote')}
+
+# One poller per worker fans quotes out to every streaming client; the
+# shared quote cache keeps it to one upstream call per symbol per host
+STREAM_POLL_INTERVAL = 15  # seconds
+STREAM_HEARTBEAT = 15  # seconds between keep-alive comments on an idle stream
+quote_hub = QuoteStreamHub(fetch_stream_quotes, interval=STREAM_POLL_INTERVAL)
+
+@market_data_bp.record_once
+def configure_quote_stream(state):
+    """Apply the app's QUOTE_STREAM_* settings"""
+    global quote_hub, STREAM_POLL_INTERVAL, STREAM_HEARTBEAT
+    config = state.app.config
+    STREAM_POLL_INTERVAL = config.get('QUOTE_STREAM_INTERVAL', STREAM_POLL_INTERVAL)
+    STREAM_HEARTBEAT = config.get('QUOTE_STREAM_HEARTBEAT', STREAM_HEARTBEAT)
+    quote_hub = QuoteStreamHub(fetch_stream_quotes, interval=STREAM_POLL_INTERVAL,
+                               max_subscribers=config.get('QUOTE_STREAM_MAX_SUBSCRIBERS', 500))
+
+def load_replay_series(symbol, interval):
+    """Stored bars to replay for symbol; daily history is synced first, intraday must already be stored"""
+    if interval == 'daily':
+        try:
+            return ensure_daily_history(symbol)
+        except UpstreamError as e:
+            raise ReplayError(f'No stored history for {symbol}: {e}', 404)
+    series = price_store.read(series_key(symbol, interval))
+    if series is None:
+        raise ReplayError(f'No stored {interval} bars for {symbol}', 404)
+    return series
+
+# Replay sessions stream stored bars through the same quote protocol on a
+# virtual clock; the engine is built once the market cache is configured
+replay_engine = None
+
+@market_data_bp.record_once
+def configure_replay(state):
+    """Create the replay engine with the app's REPLAY_* settings"""
+    global replay_engine
+    config = state.app.config
+    replay_engine = ReplayEngine(
+        load_replay_series, market_cache,
+        max_sessions=config.get('REPLAY_MAX_SESSIONS', 500),
+        idle_timeout=config.get('REPLAY_IDLE_TIMEOUT', 1800)
+    )
+
+def server_sent_event(message):
+    return f"id: {message.seq}\nevent: {message.type}\ndata: {message.encoded()}\n\n"
+
+def quote_event_stream(hub, subscriber):
+    """SSE response relaying a hub subscriber's messages until the client disconnects"""
+    if subscriber is None:
+        return jsonify({'error': 'Too many streaming clients. Please try again later.'}), 503
+
+    def events():
+        try:
+            while True:
+                updates = subscriber.next(timeout=STREAM_HEARTBEAT)
+                if not updates:
+                    yield ': keep-alive\n\n'
+                for _, message in updates:
+                    yield server_sent_event(message)
+        finally:
+            # Runs when the client disconnects and the generator is closed
+            hub.unsubscribe(subscriber)
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@market_data_bp.route('/stream/quotes', methods=['GET'])
+def stream_quotes():
+    """Stream quotes for a comma-separated list of symbols as Server-Sent Events.
+
+    Each symbol starts with a 'snapshot' event {'symbol', 'seq', 'data'},
+    where data is what /quote returns. After that 'delta' events
+    {'symbol', 'seq', 'base_seq', 'changes'} carry only the changed
+    'Global Quote' fields (None for removed ones). A client whose seq for
+    the symbol is not base_seq has missed an update and resyncs from
+    /stream/quotes/snapshot or by reconnecting.
+    """
+    symbols = [s.strip() for s in request.args.get('symbols', '').split(',') if s.strip()]
+    if not symbols:
+        return jsonify({'error': 'Symbols parameter is required'}), 400
+    if len(symbols) > MAX_BATCH_SYMBOLS:
+        return jsonify({'error': f'At most {MAX_BATCH_SYMBOLS} symbols per request'}), 400
+
+    return quote_event_stream(quote_hub, quote_hub.subscribe(symbols))
+
+@market_data_bp.route('/stream/quotes/snapshot', methods=['GET'])
+def get_stream_snapshot():
+    """Get the latest streamed snapshot {'seq', 'data'} of each watched symbol, for resyncing"""
+    symbols = [s.strip() for s in request.args.get('symbols', '').split(',') if s.strip()]
+    if not symbols:
+        return jsonify({'error': 'Symbols parameter is required'}), 400
+
+    snapshots = quote_hub.snapshot(symbols)
+    return jsonify({
+        symbol: {'seq': message.seq, 'data': message.payload}
+        for symbol, message in snapshots.items()
+    })
+
+@market_data_bp.route('/stream/stats', methods=['GET'])
+def get_stream_stats():
+    """Get streaming subscribers, watched symbols and poll counters for this worker"""
+    return jsonify(quote_hub.stats())
+
+def get_replay_session(session_id):
+    session = replay_engine.get(session_id)
+    if session is None:
+        raise ReplayError('Replay session not found', 404)
+    return session
+
+@market_data_bp.route('/replay/sessions', methods=['POST'])
+def create_replay_session():
+    """Start replaying stored bars for symbols between start and end at speed x real time"""
+    data = request.get_json() or {}
+    symbols = data.get('symbols') or []
+    if isinstance(symbols, str):
+        symbols = [s.strip() for s in symbols.split(',') if s.strip()]
+    if not symbols:
+        return jsonify({'error': 'Symbols are required'}), 400
+    if len(symbols) > MAX_BATCH_SYMBOLS:
+        return jsonify({'error': f'At most {MAX_BATCH_SYMBOLS} symbols per session'}), 400
+
+    try:
+        session = replay_engine.create(
+            symbols,
+            parse_timestamp(data.get('start')),
+            parse_timestamp(data.get('end')),
+            speed=float(data.get('speed', 1)),
+            interval=data.get('interval', 'daily')
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), getattr(e, 'status_code', 400)
+    return jsonify(session.to_dict()), 201
+
+@market_data_bp.route('/replay/sessions/<session_id>', methods=['GET', 'PATCH', 'DELETE'])
+def replay_session(session_id):
+    """Get a replay session, change its speed or pause it, or end it"""
+    try:
+        if request.method == 'DELETE':
+            if not replay_engine.delete(session_id):
+                raise ReplayError('Replay session not found', 404)
+            return jsonify({'message': f'Ended replay session {session_id}'})
+        if request.method == 'PATCH':
+            data = request.get_json() or {}
+            speed = data.get('speed')
+            paused = data.get('paused')
+            session = replay_engine.update(
+                session_id,
+                speed=float(speed) if speed is not None else None,
+                paused=bool(paused) if paused is not None else None
+            )
+            if session is None:
+                raise ReplayError('Replay session not found', 404)
+        else:
+            session = get_replay_session(session_id)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), getattr(e, 'status_code', 400)
+    return jsonify(session.to_dict())
+
+@market_data_bp.route('/replay/sessions/<session_id>/quote', methods=['GET'])
+def get_replay_quote(session_id):
+    """Get the replayed quote for a symbol in the /quote schema"""
+    symbol = request.args.get('symbol', '')
+    try:
+        session = get_replay_session(session_id)
+    except ReplayError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    if symbol not in session.symbols:
+        return jsonify({'error': f'{symbol} is not part of this replay session'}), 400
+    return jsonify(session.quotes.get(symbol, {}))
+
+@market_data_bp.route('/replay/sessions/<session_id>/stream', methods=['GET'])
+def stream_replay_session(session_id):
+    """Stream a replay session's quotes as Server-Sent Events, in the /stream/quotes protocol"""
+    try:
+        session = get_replay_session(session_id)
+    except ReplayError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    return quote_event_stream(session.hub, session.subscribe())
+
+@market_data_bp.route('/replay/stats', methods=['GET'])
+def get_replay_stats():
+    """Get replay session counters for this worker"""
+    return jsonify(replay_engine.stats())
+
+# Paper orders are stored in the order tables and rest in every worker's
+# matching engine, filling on quote ticks: live equities through the quote
+# hub's poller, replay sessions through their bars and F&O contracts through
+# the derivatives snapshots. Each worker picks up orders placed, modified or
+# closed elsewhere every ORDER_SYNC_INTERVAL; a fill claims its order row
+# first, so an order is only ever booked once. Fills run inside the app's
+# context.
+order_app = None
+ORDER_MATCH_INTERVAL = 30  # seconds between derivative price checks for resting F&O orders
+ORDER_SYNC_INTERVAL = 10  # seconds between loads of orders changed by other workers
+ORDER_SYNC_OVERLAP = timedelta(seconds=5)  # re-read window for commits that land late
+last_order_sync = None
+
+def execute_order_fill(order, price):
+    """Book a filled order as a portfolio trade; raises to reject the fill"""
+    with order_app.app_context():
+        return order_store.fill_order(order, price)
+
+def watch_order_symbol(symbol):
+    # F&O contracts are priced from derivatives snapshots, not polled quotes
+    if parse_contract_symbol(symbol) is None:
+        quote_hub.watch(symbol)
+
+def unwatch_order_symbol(symbol):
+    if parse_contract_symbol(symbol) is None:
+        quote_hub.unwatch(symbol)
+
+matching_engine = MatchingEngine(execute_order_fill, watch=watch_order_symbol, unwatch=unwatch_order_symbol)
+
+def quote_price(quote):
+    parsed = parse_global_quote(quote)
+    return parsed['price'] if parsed else None
+
+def match_live_quote(symbol, quote):
+    price = quote_price(quote)
+    if price:
+        matching_engine.on_quote(symbol, price)
+
+def match_replay_quote(session, symbol, quote):
+    price = quote_price(quote)
+    if price:
+        matching_engine.on_quote(symbol, price, market=session.id)
+
+def match_derivative_orders():
+    """Check resting F&O orders against their underlyings' latest derivatives snapshots"""
+    by_underlying = {}
+    for market, symbol in matching_engine.resting_symbols():
+        contract = parse_contract_symbol(symbol) if market is None else None
+        if contract is not None:
+            by_underlying.setdefault(contract[0], []).append((symbol, contract))
+    for underlying, contracts in by_underlying.items():
+        try:
+            with background_priority():
+                snapshot = get_derivatives_snapshot(underlying)[0]
+        except Exception as e:
+            print(f"Could not price resting {underlying} orders: {e}")
+            continue
+        for symbol, (_, expiry, strike, option_type) in contracts:
+            price = snapshot.contract_price(expiry, strike, option_type)
+            if price:
+                matching_engine.on_quote(symbol, price)
+
+refresher.every(ORDER_MATCH_INTERVAL, match_derivative_orders)
+
+def sync_open_orders():
+    """Load every OPEN order on the first run, then the orders changed since the last one"""
+    global last_order_sync
+    if order_app is None:
+        return
+    started = datetime.utcnow()
+    with order_app.app_context():
+        if last_order_sync is None:
+            rows = order_store.open_orders()
+        else:
+            rows = order_store.changed_orders(last_order_sync - ORDER_SYNC_OVERLAP)
+    for row in rows:
+        try:
+            order_store.apply_to_engine(matching_engine, row)
+        except Exception as e:
+            print(f"Could not sync order {row.id}: {e}")
+    last_order_sync = started
+
+refresher.every(ORDER_SYNC_INTERVAL, sync_open_orders)
+
+@market_data_bp.record_once
+def configure_matching(state):
+    """Feed live and replayed quotes to the matching engine and book its fills in this app"""
+    global order_app
+    order_app = state.app
+    quote_hub.add_listener(match_live_quote)
+    replay_engine.add_listener(match_replay_quote)
+
+def current_order_price(symbol, session_id=None):
+    """Current price for an order on symbol, live or in a replay session; None when unknown"""
+    if session_id:
+        session = get_replay_session(session_id)
+        if symbol not in session.symbols:
+            raise OrderError(f'{symbol} is not part of this replay session')
+        return session.price(symbol)
+    contract = parse_contract_symbol(symbol)
+    if contract is not None:
+        underlying, expiry, strike, option_type = contract
+        return get_derivatives_snapshot(underlying)[0].contract_price(expiry, strike, option_type)
+    return quote_price(fetch_global_quote(symbol))
+
+def optional_price(data, field):
+    value = data.get(field)
+    return float(value) if value not in (None, '') else None
+
+def place_order(symbol, data):
+    """Validate and store an order request for symbol, then hand it to the matching engine"""
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Authentication required'}), 401
+    try:
+        order = Order(
+            user_id, symbol,
+            data.get('side', 'BUY'),
+            int(data['quantity']),
+            data.get('order_type', 'MARKET'),
+            limit_price=optional_price(data, 'price'),
+            stop_price=optional_price(data, 'trigger_price'),
+            market=data.get('session_id')
+        )
+        price = current_order_price(symbol, order.market)
+        matching_engine.validate(order, price)
+    except UpstreamError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except (ValueError, TypeError, KeyError) as e:
+        return jsonify({'error': str(e)}), getattr(e, 'status_code', 400)
+
+    order_store.create_order(order)
+    try:
+        matching_engine.place(order, price)
+    except OrderError as e:
+        # The price moved past the trigger since validation
+        order_store.reject_order(order.id, str(e))
+        return jsonify({'error': str(e)}), e.status_code
+    return jsonify(order.to_dict())
+
+@market_data_bp.route('/orders', methods=['POST'])
+def place_equity_order():
+    """Place a market, limit, SL or SL-M order for an equity symbol"""
+    data = request.json or {}
+    if not data.get('symbol') or 'quantity' not in data:
+        return jsonify({'error': 'Missing required field: symbol or quantity'}), 400
+    return place_order(data['symbol'].upper(), data)
+
+@market_data_bp.route('/quote/batch', methods=['GET'])
+def get_batch_quotes():
+    """Get quotes for a comma-separated list of symbols with a status per symbol"""
+    symbols = [s.strip() for s in request.args.get('symbols', '').split(',') if s.strip()]
+    if not symbols:
+        return jsonify({'error': 'Symbols parameter is required'}), 400
+    if len(symbols) > MAX_BATCH_SYMBOLS:
+        return jsonify({'error': f'At most {MAX_BATCH_SYMBOLS} symbols per request'}), 400
+
+    return jsonify(quote_batcher.fetch(symbols))
+
 @market_data_bp.route('/intraday', methods=['GET'])
 def get_intraday():
     """Get intraday data for a symbol"""
     symbol = request.args.get('symbol', '')
     interval = request.args.get('interval', '5min')
-    
+
     if not symbol:
         return jsonify({'error': 'Symbol parameter is required'}), 400
-    
-    cache_key = f"intraday_{symbol}_{interval}"
-    cached_data = get_cached_data(cache_key, expiry_minutes=5)
-    if cached_data:
-        return jsonify(cached_data)
-    
+
     url = f"https://www.alphavantage.co/query?function=TIME_SERIES_INTRADAY&symbol={symbol}&interval={interval}&apikey={ALPHA_VANTAGE_API_KEY}"
-    response = requests.get(url)
-    
-    if response.status_code != 200:
-        return jsonify({'error': 'Failed to fetch data from Alpha Vantage'}), 500
-    
-    data = response.json()
-    set_cached_data(cache_key, data)
+    try:
+        data = get_or_fetch(f"intraday_{symbol}_{interval}", lambda: fetch_alpha_vantage(url), expiry_minutes=5)
+    except UpstreamError as e:
+        return jsonify({'error': str(e)}), e.status_code
     return jsonify(data)
 
 @market_data_bp.route('/daily', methods=['GET'])
@@ -158,180 +698,174 @@ def get_daily():
     """Get daily data for a symbol"""
     symbol = request.args.get('symbol', '')
     outputsize = request.args.get('outputsize', 'compact')
-    
+
     if not symbol:
         return jsonify({'error': 'Symbol parameter is required'}), 400
-    
-    cache_key = f"daily_{symbol}_{outputsize}"
-    cached_data = get_cached_data(cache_key)
-    if cached_data:
-        return jsonify(cached_data)
-    
+
     url = f"https://www.alphavantage.co/query?function=TIME_SERIES_DAILY&symbol={symbol}&outputsize={outputsize}&apikey={ALPHA_VANTAGE_API_KEY}"
-    response = requests.get(url)
-    
-    if response.status_code != 200:
-        return jsonify({'error': 'Failed to fetch data from Alpha Vantage'}), 500
-    
-    data = response.json()
-    set_cached_data(cache_key, data)
+    try:
+        data = get_or_fetch(f"daily_{symbol}_{outputsize}", lambda: fetch_alpha_vantage(url))
+    except UpstreamError as e:
+        return jsonify({'error': str(e)}), e.status_code
     return jsonify(data)
 
 @market_data_bp.route('/top-gainers-losers', methods=['GET'])
 def get_top_gainers_losers():
     """Get top gainers and losers"""
-    cache_key = "top_gainers_losers"
-    cached_data = get_cached_data(cache_key, expiry_minutes=60)  # Cache for 1 hour
-    if cached_data:
-        return jsonify(cached_data)
-    
     url = f"https://www.alphavantage.co/query?function=TOP_GAINERS_LOSERS&apikey={ALPHA_VANTAGE_API_KEY}"
-    response = requests.get(url)
-    
-    if response.status_code != 200:
-        return jsonify({'error': 'Failed to fetch data from Alpha Vantage'}), 500
-    
-    data = response.json()
-    set_cached_data(cache_key, data)
+    try:
+        data = get_or_fetch("top_gainers_losers", lambda: fetch_alpha_vantage(url), expiry_minutes=60)  # Cache for 1 hour
+    except UpstreamError as e:
+        return jsonify({'error': str(e)}), e.status_code
     return jsonify(data)
 
-@market_data_bp.route('/stock/<symbol>', methods=['GET'])
-def get_stock_data(symbol):
-    """Get stock data for a symbol with specified interval"""
-    interval = request.args.get('interval', 'daily') # Default to daily
-    
-    if not symbol:
-        return jsonify({'error': 'Symbol is required'}), 400
+# Bars shown per daily chart interval (None = full stored history)
+DAILY_WINDOWS = {'daily': 30, '5day': 5, '1month': 30, '1year': 365, 'lifetime': None}
+HISTORY_SYNC_MINUTES = 15  # how often stored daily bars are topped up from upstream
 
-    print(f"Fetching stock data for {symbol} with interval: {interval}")
+def fetch_daily_series(symbol, outputsize):
+    """Fetch the Alpha Vantage daily adjusted series for a symbol"""
+    url = f"https://www.alphavantage.co/query?function=TIME_SERIES_DAILY_ADJUSTED&symbol={symbol}&outputsize={outputsize}&apikey={ALPHA_VANTAGE_API_KEY}"
+    print(f"Making Alpha Vantage API request: {url}")
+    data = fetch_alpha_vantage(url)
 
-    cache_key = f"stock_{symbol}_{interval}"
-    cached_data = get_cached_data(cache_key)
-    if cached_data:
-        print(f"Found cached data for {symbol} ({interval})")
-        return jsonify(cached_data)
+    if 'Error Message' in data:
+        print(f"Alpha Vantage Error: {data['Error Message']}")
+        raise UpstreamError(data['Error Message'], 400)
 
-    api_key = current_app.config.get('ALPHA_VANTAGE_API_KEY')
-    if not api_key:
-        return jsonify({'error': 'Alpha Vantage API key not configured'}), 500
+    if 'Time Series (Daily)' not in data:
+        print(f"No daily time series data found for {symbol}")
+        raise UpstreamError('No time series data found', 404)
 
-    url = ""
-    time_series_key = ""
-    
-    # Determine which Alpha Vantage function to call based on interval
-    if interval in ['1min', '5min']:
-        url = f"https://www.alphavantage.co/query?function=TIME_SERIES_INTRADAY&symbol={symbol}&interval={interval}&outputsize=full&apikey={api_key}"
-        time_series_key = f"Time Series ({interval})"
-    elif interval == 'daily' or interval == '5day' or interval == '1month' or interval == '1year' or interval == 'lifetime':
-        url = f"https://www.alphavantage.co/query?function=TIME_SERIES_DAILY_ADJUSTED&symbol={symbol}&outputsize=full&apikey={api_key}" # Use outputsize=full for longer history
-        time_series_key = "Time Series (Daily)"
-    else:
-        return jsonify({'error': 'Invalid interval specified'}), 400
+    return data['Time Series (Daily)']
+
+def sync_history(symbol):
+    """Top up stored daily bars from upstream, then append them to the price store"""
+    try:
+        written = sync_daily_history(symbol, fetch_daily_series)
+    except (UpstreamError, QuotaExceeded) as e:
+        if latest_stored_date(symbol) is None:
+            raise
+        print(f"Serving stored history for {symbol} without syncing: {e}")
+        written = 0
+    export_to_store(price_store, symbol)
+    return written
+
+def ensure_daily_history(symbol):
+    """Bring the price store up to date for a symbol, at most once per HISTORY_SYNC_MINUTES"""
+    get_or_fetch(f"history_synced_{symbol}", lambda: sync_history(symbol), expiry_minutes=HISTORY_SYNC_MINUTES)
+    series = price_store.read(symbol)
+    if series is None:
+        raise UpstreamError('No time series data found', 404)
+    return series
+
+def build_daily_series(symbol, interval):
+    """Shape the chart series for a daily interval from the local price store.
+
+    All daily intervals are windows over the symbol's one stored series, so
+    they share a single cached copy instead of one cache entry per interval.
+    """
+    series = ensure_daily_history(symbol)
+    # Format every date label once on the full series; windows slice them
+    series.dates()
+
+    window = DAILY_WINDOWS[interval]
+    current_price = float(series.close[-1])
+    previous_close = float(series.close[-2]) if len(series) > 1 else None
+
+    change = None
+    change_percent = None
+    if previous_close is not None:
+        change = current_price - previous_close
+        if previous_close != 0:
+            change_percent = (change / previous_close) * 100
+
+    if window is not None:
+        series = series.tail(window)
+    dates = series.dates()
+
+    return {
+        'symbol': symbol,
+        'price': current_price,
+        'change': change,
+        'change_percent': f"{change_percent:.2f}%" if change_percent is not None else None,
+        'latest_trading_day': dates[-1],
+        'dates': dates,
+        'prices': series.close.tolist()
+    }
+
+def fetch_intraday_series(symbol, interval, api_key):
+    """Fetch and shape the intraday chart series for a symbol"""
+    url = f"https://www.alphavantage.co/query?function=TIME_SERIES_INTRADAY&symbol={symbol}&interval={interval}&outputsize=full&apikey={api_key}"
+    time_series_key = f"Time Series ({interval})"
 
     print(f"Making Alpha Vantage API request: {url}")
-    response = requests.get(url)
-    
-    if response.status_code != 200:
-        print(f"Error from Alpha Vantage API ({response.status_code}): {response.text}")
-        return jsonify({'error': 'Failed to fetch data from Alpha Vantage'}), 500
-    
-    data = response.json()
-    print(f"Received data from Alpha Vantage: {data}")
+    data = fetch_alpha_vantage(url)
 
     if 'Error Message' in data:
         print(f"Alpha Vantage Error: {data['Error Message']}")
-        return jsonify({'error': data['Error Message']}), 400
-    
+        raise UpstreamError(data['Error Message'], 400)
+
     if time_series_key not in data:
         print(f"No time series data found for {symbol} with interval {interval}")
-        return jsonify({'error': 'No time series data found'}), 404
-    
+        raise UpstreamError('No time series data found', 404)
+
     time_series = data[time_series_key]
-    
-    # Process the data
-    dates_raw = sorted(time_series.keys())
-    
-    # Limit data for '5day' interval to last 5 days (approx 5*24*60/interval_minutes if intraday)
-    # For simplicity, we'll just take the last 5 days worth of data points from the daily series
-    # or a recent subset for intraday. Let's aim for a reasonable number of points for display.
-    
-    processed_dates = []
-    processed_prices = []
-    current_price = None
-    previous_close = None
-    
-    # Get the latest quote information for display
-    latest_date_str = sorted(time_series.keys(), reverse=True)[0]
-    latest_day_data = time_series[latest_date_str]
-
-    # Use '4. close' for daily, and '4. close' for intraday
-    current_price = float(latest_day_data.get('4. close', latest_day_data.get('5. adjusted close', 0.0)))
-    
-    # Try to get previous close for change calculation
-    if len(dates_raw) > 1: # If there's more than one data point
-        second_latest_date_str = sorted(time_series.keys(), reverse=True)[1]
-        previous_close = float(time_series[second_latest_date_str].get('4. close', time_series[second_latest_date_str].get('5. adjusted close', 0.0)))
-    
+    # Keep the bars so replay sessions can run over them later
+    price_store.append(series_key(symbol, interval), time_series_columns(time_series))
+
+    # For intraday, take the most recent 200 data points for a meaningful chart
+    recent = sorted(time_series.keys(), reverse=True)[:200]
+    latest_date_str = recent[0]
+    current_price = float(time_series[latest_date_str]['4. close'])
+
     change = None
     change_percent = None
-    if current_price is not None and previous_close is not None:
+    if len(recent) > 1:
+        previous_close = float(time_series[recent[1]]['4. close'])
         change = current_price - previous_close
         if previous_close != 0:
             change_percent = (change / previous_close) * 100
 
-    # Populate processed_dates and processed_prices based on interval and desired display length
-    if interval == 'daily':
-        # Get last 30 days of daily data
-        for date_str in sorted(time_series.keys(), reverse=True)[:30]:
-            processed_dates.insert(0, date_str)
-            processed_prices.insert(0, float(time_series[date_str].get('4. close', time_series[date_str].get('5. adjusted close'))))
-    elif interval == '5day':
-        # Get last 5 days of daily data (approx 5 data points)
-        for date_str in sorted(time_series.keys(), reverse=True)[:5]:
-            processed_dates.insert(0, date_str)
-            processed_prices.insert(0, float(time_series[date_str].get('4. close', time_series[date_str].get('5. adjusted close'))))
-    elif interval == '1month':
-        # Get last 30 days of daily data
-        for date_str in sorted(time_series.keys(), reverse=True)[:30]:
-            processed_dates.insert(0, date_str)
-            processed_prices.insert(0, float(time_series[date_str].get('4. close', time_series[date_str].get('5. adjusted close'))))
-    elif interval == '1year':
-        # Get last 365 days of daily data
-        for date_str in sorted(time_series.keys(), reverse=True)[:365]:
-            processed_dates.insert(0, date_str)
-            processed_prices.insert(0, float(time_series[date_str].get('4. close', time_series[date_str].get('5. adjusted close'))))
-    elif interval == 'lifetime':
-        # Get all available daily data
-        for date_str in sorted(time_series.keys()): # Sort chronologically for chart
-            processed_dates.append(date_str)
-            processed_prices.append(float(time_series[date_str].get('4. close', time_series[date_str].get('5. adjusted close'))))
-    elif interval in ['1min', '5min']:
-        # For intraday, take the most recent 200 data points for a meaningful chart
-        for date_time_str in sorted(time_series.keys(), reverse=True)[:200]:
-            processed_dates.insert(0, date_time_str)
-            processed_prices.insert(0, float(time_series[date_time_str]['4. close']))
-
-    processed_data = {
+    recent.reverse()
+    return {
         'symbol': symbol,
         'price': current_price,
         'change': change,
         'change_percent': f"{change_percent:.2f}%" if change_percent is not None else None,
-        'latest_trading_day': latest_date_str, # This could be date or datetime depending on interval
-        'dates': processed_dates,
-        'prices': processed_prices
+        'latest_trading_day': latest_date_str,
+        'dates': recent,
+        'prices': [float(time_series[date_time_str]['4. close']) for date_time_str in recent]
     }
-    
-    set_cached_data(cache_key, processed_data)
+
+@market_data_bp.route('/stock/<symbol>', methods=['GET'])
+def get_stock_data(symbol):
+    """Get stock data for a symbol with specified interval"""
+    interval = request.args.get('interval', 'daily') # Default to daily
+
+    if not symbol:
+        return jsonify({'error': 'Symbol is required'}), 400
+
+    if interval not in ['1min', '5min', 'daily', '5day', '1month', '1year', 'lifetime']:
+        return jsonify({'error': 'Invalid interval specified'}), 400
+
+    print(f"Fetching stock data for {symbol} with interval: {interval}")
+
+    api_key = current_app.config.get('ALPHA_VANTAGE_API_KEY')
+    if not api_key:
+        return jsonify({'error': 'Alpha Vantage API key not configured'}), 500
+
+    try:
+        if interval in DAILY_WINDOWS:
+            processed_data = build_daily_series(symbol, interval)
+        else:
+            processed_data = get_or_fetch(f"stock_{symbol}_{interval}", lambda: fetch_intraday_series(symbol, interval, api_key))
+    except UpstreamError as e:
+        return jsonify({'error': str(e)}), e.status_code
     return jsonify(processed_data)
 
-@market_data_bp.route('/indices', methods=['GET'])
-def get_indices():
-    """Get major Indian market indices"""
-    cache_key = "indices"
-    cached_data = get_cached_data(cache_key, expiry_minutes=5)  # Cache for 5 minutes
-    if cached_data:
-        return jsonify(cached_data)
-    
+def fetch_indices():
+    """Fetch quotes for the major Indian indices"""
     indices = {
         'NIFTY 50': '^NSEI',
         'SENSEX': '^BSESN',
@@ -343,37 +877,31 @@ def get_indices():
         'NIFTY METAL': '^CNXMETAL',
         'NIFTY REALTY': '^CNXREALTY'
     }
-    
+
+    quotes = quote_batcher.fetch(indices.values())
     results = {}
     for name, symbol in indices.items():
-        try:
-            url = f"https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={symbol}&apikey={ALPHA_VANTAGE_API_KEY}"
-            response = requests.get(url)
-            if response.status_code == 200:
-                data = response.json()
-                if 'Global Quote' in data:
-                    quote = data['Global Quote']
-                    results[name] = {
-                        'price': float(quote.get('05. price', 0)),
-                        'change': float(quote.get('09. change', 0)),
-                        'change_percent': quote.get('10. change percent', '0%').replace('%', ''),
-                        'volume': int(quote.get('06. volume', 0))
-                    }
-        except Exception as e:
-            print(f"Error fetching {name}: {e}")
-            continue
-    
-    set_cached_data(cache_key, results)
-    return jsonify(results)
+        result = quotes[symbol]
+        if result['status'] == 'ok':
+            results[name] = result['quote']
+        else:
+            print(f"Error fetching {name}: {result['error']}")
 
-@market_data_bp.route('/sectors', methods=['GET'])
-def get_sectors():
-    """Get sector performance"""
-    cache_key = "sectors"
-    cached_data = get_cached_data(cache_key, expiry_minutes=15)  # Cache for 15 minutes
-    if cached_data:
-        return jsonify(cached_data)
-    
+    return results
+
+refresher.register("indices", fetch_indices, ttl=5 * 60)  # Refresh every 5 minutes
+
+@market_data_bp.route('/indices', methods=['GET'])
+def get_indices():
+    """Get major Indian market indices"""
+    try:
+        results, meta = get_hot_data("indices")
+    except UpstreamError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    return with_staleness(jsonify(results), meta)
+
+def fetch_sectors():
+    """Fetch quotes for a basket of stocks per sector and average their moves"""
     sectors = {
         'IT': ['TCS', 'INFY', 'WIPRO', 'HCLTECH', 'TECHM'],
         'BANKING': ['HDFCBANK', 'ICICIBANK', 'KOTAKBANK', 'AXISBANK', 'SBIN'],
@@ -383,25 +911,25 @@ def get_sectors():
         'METAL': ['TATASTEEL', 'JSWSTEEL', 'HINDALCO', 'SAIL', 'JINDALSTEL'],
         'REALTY': ['DLF', 'SUNTV', 'GODREJPROP', 'OBEROIRLTY', 'PRESTIGE']
     }
-    
+
+    # One batch for every sector's constituents instead of 35 sequential calls
+    quotes = quote_batcher.fetch(f"{stock}.BSE" for stocks in sectors.values() for stock in stocks)
+
     results = {}
     for sector, stocks in sectors.items():
         try:
             sector_data = []
             for stock in stocks:
-                url = f"https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={stock}.BSE&apikey={ALPHA_VANTAGE_API_KEY}"
-                response = requests.get(url)
-                if response.status_code == 200:
-                    data = response.json()
-                    if 'Global Quote' in data:
-                        quote = data['Global Quote']
-                        sector_data.append({
-                            'symbol': stock,
-                            'price': float(quote.get('05. price', 0)),
-                            'change': float(quote.get('09. change', 0)),
-                            'change_percent': quote.get('10. change percent', '0%').replace('%', '')
-                        })
-            
+                result = quotes[f"{stock}.BSE"]
+                if result['status'] == 'ok':
+                    quote = result['quote']
+                    sector_data.append({
+                        'symbol': stock,
+                        'price': quote['price'],
+                        'change': quote['change'],
+                        'change_percent': quote['change_percent']
+                    })
+
             if sector_data:
                 avg_change = sum(float(stock['change_percent']) for stock in sector_data) / len(sector_data)
                 results[sector] = {
@@ -411,40 +939,49 @@ def get_sectors():
         except Exception as e:
             print(f"Error fetching {sector} sector: {e}")
             continue
-    
-    set_cached_data(cache_key, results)
-    return jsonify(results)
 
-@market_data_bp.route('/most-active', methods=['GET'])
-def get_most_active():
-    """Get most active stocks by volume"""
-    cache_key = "most_active"
-    cached_data = get_cached_data(cache_key, expiry_minutes=5)  # Cache for 5 minutes
-    if cached_data:
-        return jsonify(cached_data)
-    
+    return results
+
+refresher.register("sectors", fetch_sectors, ttl=15 * 60)  # Refresh every 15 minutes
+
+@market_data_bp.route('/sectors', methods=['GET'])
+def get_sectors():
+    """Get sector performance"""
+    try:
+        results, meta = get_hot_data("sectors")
+    except UpstreamError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    return with_staleness(jsonify(results), meta)
+
+def fetch_most_active():
+    """Fetch the top gainers, losers and most traded stocks"""
     url = f"https://www.alphavantage.co/query?function=TOP_GAINERS_LOSERS&apikey={ALPHA_VANTAGE_API_KEY}"
-    response = requests.get(url)
-    
-    if response.status_code != 200:
-        return jsonify({'error': 'Failed to fetch data'}), 500
-    
-    data = response.json()
+    data = fetch_alpha_vantage(url, 'Failed to fetch data')
     results = {
         'gainers': [],
         'losers': [],
         'most_active': []
     }
-    
+
     if 'top_gainers' in data:
         results['gainers'] = data['top_gainers'][:5]
     if 'top_losers' in data:
         results['losers'] = data['top_losers'][:5]
     if 'most_actively_traded' in data:
         results['most_active'] = data['most_actively_traded'][:5]
-    
-    set_cached_data(cache_key, results)
-    return jsonify(results)
+
+    return results
+
+refresher.register("most_active", fetch_most_active, ttl=5 * 60)  # Refresh every 5 minutes
+
+@market_data_bp.route('/most-active', methods=['GET'])
+def get_most_active():
+    """Get most active stocks by volume"""
+    try:
+        results, meta = get_hot_data("most_active")
+    except UpstreamError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    return with_staleness(jsonify(results), meta)
 
 @market_data_bp.route('/stock/search', methods=['GET'])
 def search_stocks_alpha():
@@ -452,185 +989,153 @@ def search_stocks_alpha():
     query = request.args.get('q', '')
     if not query:
         return jsonify({'error': 'Query parameter is required'}), 400
-    
-    cache_key = f"search_{query}"
-    cached_data = get_cached_data(cache_key)
-    if cached_data:
-        return jsonify(cached_data)
-    
-    url = f"https://www.alphavantage.co/query?function=SYMBOL_SEARCH&keywords={query}&apikey={ALPHA_VANTAGE_API_KEY}"
-    response = requests.get(url)
-    
-    if response.status_code != 200:
-        return jsonify({'error': 'Failed to fetch data from Alpha Vantage'}), 500
-    
-    data = response.json()
-    
-    # Check for API errors
-    if 'Error Message' in data:
-        return jsonify({'error': data['Error Message']}), 500
-    
-    if 'Note' in data:
-        return jsonify({'error': 'API rate limit reached. Please try again later.'}), 429
-    
-    # Filter for Indian stocks (NSE/BSE)
-    if 'bestMatches' in data:
-        indian_stocks = [stock for stock in data['bestMatches'] 
-                        if stock['4. region'] == 'India' or 
-                           '.BSE' in stock['1. symbol'] or 
-                           '.NSE' in stock['1. symbol']]
-        data['bestMatches'] = indian_stocks
-        set_cached_data(cache_key, data)
-        return jsonify(data)
-    else:
-        return jsonify({'bestMatches': [], 'message': 'No matching stocks found'})
+
+    try:
+        data = search_symbols(query)
+    except UpstreamError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    return jsonify(data)
+
+def technical_summary(symbol, series):
+    """Latest indicator values and price change for a stored daily series"""
+    closes = series.close
+    current = float(closes[-1])
+    previous = float(closes[-2]) if len(closes) > 1 else None
+    return {
+        'symbol': symbol,
+        'indicators': indicator_states.values(f"{symbol}.BSE", series),
+        'current_price': current,
+        'price_change': current - previous if previous is not None else None,
+        'price_change_percent': (current - previous) / previous * 100 if previous else None
+    }
+
+def fetch_technical_indicators(symbol):
+    """Compute technical indicators over the full stored daily history"""
+    return technical_summary(symbol, ensure_daily_history(f"{symbol}.BSE"))
 
 @market_data_bp.route('/stock/technical/<symbol>', methods=['GET'])
 def get_technical_indicators(symbol):
     """Get technical indicators for a stock"""
-    cache_key = f"technical_{symbol}"
-    cached_data = get_cached_data(cache_key, expiry_minutes=5)
-    if cached_data:
-        return jsonify(cached_data)
-    
     try:
-        # Get daily data for technical analysis
-        url = f"https://www.alphavantage.co/query?function=TIME_SERIES_DAILY&symbol={symbol}.BSE&apikey={ALPHA_VANTAGE_API_KEY}"
-        response = requests.get(url)
-        if response.status_code != 200:
-            return jsonify({'error': 'Failed to fetch stock data'}), 500
-            
-        data = response.json()
-        if 'Time Series (Daily)' not in data:
-            return jsonify({'error': 'Invalid data format'}), 500
-            
-        # Calculate technical indicators
-        daily_data = data['Time Series (Daily)']
-        dates = sorted(daily_data.keys())[:30]  # Last 30 days
-        prices = [float(daily_data[date]['4. close']) for date in dates]
-        
-        # Calculate SMA (Simple Moving Average)
-        sma_20 = sum(prices[:20]) / 20 if len(prices) >= 20 else None
-        sma_50 = sum(prices[:50]) / 50 if len(prices) >= 50 else None
-        
-        # Calculate RSI (Relative Strength Index)
-        if len(prices) >= 14:
-            gains = [max(prices[i] - prices[i-1], 0) for i in range(1, len(prices))]
-            losses = [max(prices[i-1] - prices[i], 0) for i in range(1, len(prices))]
-            avg_gain = sum(gains[:14]) / 14
-            avg_loss = sum(losses[:14]) / 14
-            rsi = 100 - (100 / (1 + avg_gain/avg_loss)) if avg_loss != 0 else 100
-        else:
-            rsi = None
-        
-        # Calculate MACD (Moving Average Convergence Divergence)
-        if len(prices) >= 26:
-            ema_12 = sum(prices[:12]) / 12
-            ema_26 = sum(prices[:26]) / 26
-            macd = ema_12 - ema_26
-            signal_line = sum(prices[:9]) / 9
-            macd_histogram = macd - signal_line
-        else:
-            macd = signal_line = macd_histogram = None
-        
-        results = {
-            'symbol': symbol,
-            'indicators': {
-                'sma_20': sma_20,
-                'sma_50': sma_50,
-                'rsi': rsi,
-                'macd': {
-                    'macd': macd,
-                    'signal': signal_line,
-                    'histogram': macd_histogram
-                }
-            },
-            'current_price': prices[0] if prices else None,
-            'price_change': prices[0] - prices[1] if len(prices) > 1 else None,
-            'price_change_percent': ((prices[0] - prices[1]) / prices[1] * 100) if len(prices) > 1 else None
-        }
-        
-        set_cached_data(cache_key, results)
+        # Indicator state is advanced incrementally, so there is nothing to cache
+        results = fetch_technical_indicators(symbol)
         return jsonify(results)
+    except UpstreamError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         print(f"Error calculating technical indicators: {e}")
         return jsonify({'error': 'Failed to calculate technical indicators'}), 500
 
+@market_data_bp.route('/technical/batch', methods=['GET'])
+def get_batch_technical_indicators():
+    """Get technical indicators for a comma-separated list of symbols in one call"""
+    symbols = [s.strip() for s in request.args.get('symbols', '').split(',') if s.strip()]
+    if not symbols:
+        return jsonify({'error': 'Symbols parameter is required'}), 400
+    if len(symbols) > MAX_BATCH_SYMBOLS:
+        return jsonify({'error': f'At most {MAX_BATCH_SYMBOLS} symbols per request'}), 400
+
+    results = {}
+    cold = {}
+    for symbol in symbols:
+        try:
+            series = ensure_daily_history(f"{symbol}.BSE")
+        except UpstreamError as e:
+            results[symbol] = {'status': 'error', 'error': str(e)}
+            continue
+        if indicator_states.has_state(f"{symbol}.BSE"):
+            results[symbol] = {'status': 'ok', 'indicators': indicator_states.values(f"{symbol}.BSE", series)}
+        else:
+            cold[symbol] = series
+    # Symbols without persisted state are evaluated over their full history in
+    # one batch rather than replayed bar by bar into new state
+    for symbol, values in indicators.latest_batch(cold).items():
+        results[symbol] = {'status': 'ok', 'indicators': values}
+    return jsonify(results)
+
+def fetch_fundamentals(symbol):
+    """Fetch company overview fundamentals"""
+    url = f"https://www.alphavantage.co/query?function=OVERVIEW&symbol={symbol}.BSE&apikey={ALPHA_VANTAGE_API_KEY}"
+    data = fetch_alpha_vantage(url, 'Failed to fetch fundamental data')
+    if not data:
+        raise UpstreamError('No data available', 404)
+
+    return {
+        'symbol': symbol,
+        'name': data.get('Name'),
+        'sector': data.get('Sector'),
+        'industry': data.get('Industry'),
+        'market_cap': float(data.get('MarketCapitalization', 0)),
+        'pe_ratio': float(data.get('PERatio', 0)),
+        'eps': float(data.get('EPS', 0)),
+        'dividend_yield': float(data.get('DividendYield', 0)),
+        'beta': float(data.get('Beta', 0)),
+        '52_week_high': float(data.get('52WeekHigh', 0)),
+        '52_week_low': float(data.get('52WeekLow', 0)),
+        'volume': int(data.get('Volume', 0)),
+        'avg_volume': int(data.get('AverageVolume', 0))
+    }
+
 @market_data_bp.route('/stock/fundamentals/<symbol>', methods=['GET'])
 def get_fundamentals(symbol):
     """Get fundamental data for a stock"""
-    cache_key = f"fundamentals_{symbol}"
-    cached_data = get_cached_data(cache_key, expiry_minutes=60)  # Cache for 1 hour
-    if cached_data:
-        return jsonify(cached_data)
-    
     try:
-        url = f"https://www.alphavantage.co/query?function=OVERVIEW&symbol={symbol}.BSE&apikey={ALPHA_VANTAGE_API_KEY}"
-        response = requests.get(url)
-        if response.status_code != 200:
-            return jsonify({'error': 'Failed to fetch fundamental data'}), 500
-            
-        data = response.json()
-        if not data:
-            return jsonify({'error': 'No data available'}), 404
-            
-        results = {
-            'symbol': symbol,
-            'name': data.get('Name'),
-            'sector': data.get('Sector'),
-            'industry': data.get('Industry'),
-            'market_cap': float(data.get('MarketCapitalization', 0)),
-            'pe_ratio': float(data.get('PERatio', 0)),
-            'eps': float(data.get('EPS', 0)),
-            'dividend_yield': float(data.get('DividendYield', 0)),
-            'beta': float(data.get('Beta', 0)),
-            '52_week_high': float(data.get('52WeekHigh', 0)),
-            '52_week_low': float(data.get('52WeekLow', 0)),
-            'volume': int(data.get('Volume', 0)),
-            'avg_volume': int(data.get('AverageVolume', 0))
-        }
-        
-        set_cached_data(cache_key, results)
+        results = get_or_fetch(f"fundamentals_{symbol}", lambda: fetch_fundamentals(symbol), expiry_minutes=60)  # Cache for 1 hour
         return jsonify(results)
+    except UpstreamError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         print(f"Error fetching fundamental data: {e}")
         return jsonify({'error': 'Failed to fetch fundamental data'}), 500
 
+def fetch_nse_derivatives(query):
+    """Fetch the NSE equity-derivatives payload for an index or symbol query"""
+    url = f"https://www.nseindia.com/api/equity-derivatives?{query}"
+
+    quota_manager.acquire('nse')
+    try:
+        response = http_client.get_client('nse').get(url)
+    except requests.RequestException as e:
+        print(f"NSE request failed: {e}")
+        raise UpstreamError('Failed to fetch data from NSE', 502)
+    if response.status_code != 200:
+        raise UpstreamError('Failed to fetch data from NSE')
+    return response.json()
+
+def fetch_derivatives_snapshot(underlying):
+    """Fetch and index the equity-derivatives payload for an underlying"""
+    return DerivativesSnapshot(underlying, fetch_nse_derivatives(nse_query(underlying)))
+
+# The futures and options pages watch NIFTY, so its snapshot is kept warm;
+# other underlyings are fetched on demand and cached for 5 minutes
+HOT_DERIVATIVES = {'NIFTY'}
+for underlying in HOT_DERIVATIVES:
+    refresher.register(f"derivatives_{underlying}", partial(fetch_derivatives_snapshot, underlying), ttl=5 * 60)
+
+def get_derivatives_snapshot(underlying):
+    """Return (snapshot, meta) for an underlying; meta is None unless the snapshot is kept warm"""
+    underlying = underlying.upper()
+    if underlying in HOT_DERIVATIVES:
+        return get_hot_data(f"derivatives_{underlying}")
+    snapshot = get_or_fetch(f"derivatives_{underlying}", lambda: fetch_derivatives_snapshot(underlying), expiry_minutes=5)
+    return snapshot, None
+
+def derivatives_response(underlying, project):
+    """jsonify a projection of an underlying's derivatives snapshot.
+
+    Projections are cached under their own key per snapshot, so each is
+    built once and its size is counted when it is stored.
+    """
+    snapshot, meta = get_derivatives_snapshot(underlying)
+    key = f"derivatives_{underlying.upper()}_{project.__name__}_{snapshot.fetched_at}"
+    response = jsonify(get_or_fetch(key, lambda: project(snapshot), expiry_minutes=5))
+    return with_staleness(response, meta) if meta else response
+
 @market_data_bp.route('/futures', methods=['GET'])
 def get_futures():
     """Get available futures contracts"""
-    cache_key = "futures"
-    cached_data = get_cached_data(cache_key, expiry_minutes=5)
-    if cached_data:
-        return jsonify(cached_data)
-    
     try:
-        # Get NIFTY futures data
-        url = "https://www.nseindia.com/api/equity-derivatives?index=NIFTY"
-        headers = {
-            'User-Agent': 'Mozilla/5.0',
-            'Accept': 'application/json'
-        }
-        
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-            futures = []
-            
-            for contract in data.get('data', []):
-                if contract.get('instrumentType') == 'FUT':
-                    futures.append({
-                        'symbol': contract.get('symbol'),
-                        'expiry': contract.get('expiryDate'),
-                        'strike': float(contract.get('strikePrice', 0)),
-                        'last_price': float(contract.get('lastPrice', 0)),
-                        'change': float(contract.get('pChange', 0)),
-                        'oi': int(contract.get('openInterest', 0)),
-                        'volume': int(contract.get('totalTradedVolume', 0))
-                    })
-            
-            set_cached_data(cache_key, futures)
-            return jsonify(futures)
+        return derivatives_response('NIFTY', DerivativesSnapshot.futures)
     except Exception as e:
         print(f"Error fetching futures data: {e}")
         return jsonify({'error': 'Failed to fetch futures data'}), 500
@@ -638,47 +1143,8 @@ def get_futures():
 @market_data_bp.route('/options', methods=['GET'])
 def get_options():
     """Get available options contracts"""
-    cache_key = "options"
-    cached_data = get_cached_data(cache_key, expiry_minutes=5)
-    if cached_data:
-        return jsonify(cached_data)
-    
     try:
-        # Get NIFTY options data
-        url = "https://www.nseindia.com/api/equity-derivatives?index=NIFTY"
-        headers = {
-            'User-Agent': 'Mozilla/5.0',
-            'Accept': 'application/json'
-        }
-        
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-            options = {
-                'calls': [],
-                'puts': []
-            }
-            
-            for contract in data.get('data', []):
-                if contract.get('instrumentType') == 'OPT':
-                    option_data = {
-                        'symbol': contract.get('symbol'),
-                        'expiry': contract.get('expiryDate'),
-                        'strike': float(contract.get('strikePrice', 0)),
-                        'last_price': float(contract.get('lastPrice', 0)),
-                        'change': float(contract.get('pChange', 0)),
-                        'oi': int(contract.get('openInterest', 0)),
-                        'volume': int(contract.get('totalTradedVolume', 0)),
-                        'implied_volatility': float(contract.get('impliedVolatility', 0))
-                    }
-                    
-                    if contract.get('optionType') == 'CE':
-                        options['calls'].append(option_data)
-                    else:
-                        options['puts'].append(option_data)
-            
-            set_cached_data(cache_key, options)
-            return jsonify(options)
+        return derivatives_response('NIFTY', DerivativesSnapshot.options)
     except Exception as e:
         print(f"Error fetching options data: {e}")
         return jsonify({'error': 'Failed to fetch options data'}), 500
@@ -686,37 +1152,8 @@ def get_options():
 @market_data_bp.route('/futures/chain/<symbol>', methods=['GET'])
 def get_futures_chain(symbol):
     """Get futures chain for a specific symbol"""
-    cache_key = f"futures_chain_{symbol}"
-    cached_data = get_cached_data(cache_key, expiry_minutes=5)
-    if cached_data:
-        return jsonify(cached_data)
-    
     try:
-        url = f"https://www.nseindia.com/api/equity-derivatives?symbol={symbol}"
-        headers = {
-            'User-Agent': 'Mozilla/5.0',
-            'Accept': 'application/json'
-        }
-        
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-            futures_chain = []
-            
-            for contract in data.get('data', []):
-                if contract.get('instrumentType') == 'FUT':
-                    futures_chain.append({
-                        'expiry': contract.get('expiryDate'),
-                        'last_price': float(contract.get('lastPrice', 0)),
-                        'change': float(contract.get('pChange', 0)),
-                        'oi': int(contract.get('openInterest', 0)),
-                        'volume': int(contract.get('totalTradedVolume', 0)),
-                        'basis': float(contract.get('basis', 0)),
-                        'cost_of_carry': float(contract.get('costOfCarry', 0))
-                    })
-            
-            set_cached_data(cache_key, futures_chain)
-            return jsonify(futures_chain)
+        return derivatives_response(symbol, DerivativesSnapshot.futures_chain)
     except Exception as e:
         print(f"Error fetching futures chain: {e}")
         return jsonify({'error': 'Failed to fetch futures chain'}), 500
@@ -724,66 +1161,8 @@ def get_futures_chain(symbol):
 @market_data_bp.route('/options/chain/<symbol>', methods=['GET'])
 def get_options_chain(symbol):
     """Get options chain for a specific symbol"""
-    cache_key = f"options_chain_{symbol}"
-    cached_data = get_cached_data(cache_key, expiry_minutes=5)
-    if cached_data:
-        return jsonify(cached_data)
-    
     try:
-        url = f"https://www.nseindia.com/api/equity-derivatives?symbol={symbol}"
-        headers = {
-            'User-Agent': 'Mozilla/5.0',
-            'Accept': 'application/json'
-        }
-        
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-            options_chain = {
-                'expiry_dates': [],
-                'strikes': [],
-                'calls': {},
-                'puts': {}
-            }
-            
-            # Collect unique expiry dates and strikes
-            for contract in data.get('data', []):
-                if contract.get('instrumentType') == 'OPT':
-                    expiry = contract.get('expiryDate')
-                    strike = float(contract.get('strikePrice', 0))
-                    
-                    if expiry not in options_chain['expiry_dates']:
-                        options_chain['expiry_dates'].append(expiry)
-                    if strike not in options_chain['strikes']:
-                        options_chain['strikes'].append(strike)
-                    
-                    option_data = {
-                        'last_price': float(contract.get('lastPrice', 0)),
-                        'change': float(contract.get('pChange', 0)),
-                        'oi': int(contract.get('openInterest', 0)),
-                        'volume': int(contract.get('totalTradedVolume', 0)),
-                        'implied_volatility': float(contract.get('impliedVolatility', 0)),
-                        'delta': float(contract.get('delta', 0)),
-                        'gamma': float(contract.get('gamma', 0)),
-                        'theta': float(contract.get('theta', 0)),
-                        'vega': float(contract.get('vega', 0))
-                    }
-                    
-                    if contract.get('optionType') == 'CE':
-                        if expiry not in options_chain['calls']:
-                            options_chain['calls'][expiry] = {}
-                        options_chain['calls'][expiry][strike] = option_data
-                    else:
-                        if expiry not in options_chain['puts']:
-                            options_chain['puts'][expiry] = {}
-                        options_chain['puts'][expiry][strike] = option_data
-            
-            # Sort expiry dates and strikes
-            options_chain['expiry_dates'].sort()
-            options_chain['strikes'].sort()
-            
-            set_cached_data(cache_key, options_chain)
-            return jsonify(options_chain)
+        return derivatives_response(symbol, DerivativesSnapshot.options_chain)
     except Exception as e:
         print(f"Error fetching options chain: {e}")
         return jsonify({'error': 'Failed to fetch options chain'}), 500
@@ -791,105 +1170,86 @@ def get_options_chain(symbol):
 @market_data_bp.route('/futures/place-order', methods=['POST'])
 def place_futures_order():
     """Place a futures order"""
-    try:
-        data = request.json
-        # Validate order data
-        required_fields = ['symbol', 'expiry', 'quantity', 'order_type', 'price']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Missing required field: {field}'}), 400
-        
-        # In a real system, this would be saved to a database
-        order = {
-            'id': str(uuid.uuid4()),
-            'symbol': data['symbol'],
-            'expiry': data['expiry'],
-            'quantity': int(data['quantity']),
-            'order_type': data['order_type'],
-            'price': float(data['price']),
-            'status': 'PAPER_TRADING',
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        return jsonify(order)
-    except Exception as e:
-        print(f"Error placing futures order: {e}")
-        return jsonify({'error': 'Failed to place order'}), 500
+    data = request.json or {}
+    required_fields = ['symbol', 'expiry', 'quantity', 'order_type', 'price']
+    for field in required_fields:
+        if field not in data:
+            return jsonify({'error': f'Missing required field: {field}'}), 400
+    return place_order(contract_symbol(data['symbol'], data['expiry']), data)
 
 @market_data_bp.route('/options/place-order', methods=['POST'])
 def place_options_order():
     """Place an options order"""
+    data = request.json or {}
+    required_fields = ['symbol', 'expiry', 'strike', 'option_type', 'quantity', 'order_type', 'price']
+    for field in required_fields:
+        if field not in data:
+            return jsonify({'error': f'Missing required field: {field}'}), 400
+    if str(data['option_type']).upper() not in ('CE', 'PE'):
+        return jsonify({'error': 'option_type must be CE or PE'}), 400
     try:
-        data = request.json
-        # Validate order data
-        required_fields = ['symbol', 'expiry', 'strike', 'option_type', 'quantity', 'order_type', 'price']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Missing required field: {field}'}), 400
-        
-        # In a real system, this would be saved to a database
-        order = {
-            'id': str(uuid.uuid4()),
-            'symbol': data['symbol'],
-            'expiry': data['expiry'],
-            'strike': float(data['strike']),
-            'option_type': data['option_type'],
-            'quantity': int(data['quantity']),
-            'order_type': data['order_type'],
-            'price': float(data['price']),
-            'status': 'PAPER_TRADING',
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        return jsonify(order)
-    except Exception as e:
-        print(f"Error placing options order: {e}")
-        return jsonify({'error': 'Failed to place order'}), 500
+        symbol = contract_symbol(data['symbol'], data['expiry'], float(data['strike']), data['option_type'])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid strike'}), 400
+    return place_order(symbol, data)
+
+def fetch_valuation_quotes(symbols):
+    """{symbol: (price, previous close)} for holdings, in one batch per quote source.
+
+    Equities come from one batched quote fetch and F&O contracts from their
+    underlyings' derivatives snapshots, fetched in parallel. Symbols that
+    cannot be priced are left out.
+    """
+    contracts = {}
+    equities = []
+    for symbol in symbols:
+        contract = parse_contract_symbol(symbol)
+        if contract is None:
+            equities.append(symbol)
+        else:
+            contracts.setdefault(contract[0], []).append((symbol, contract))
+
+    quotes = {}
+    if equities:
+        for symbol, result in quote_batcher.fetch(equities).items():
+            quote = result['quote']
+            if quote and quote['price']:
+                quotes[symbol] = (quote['price'], quote['price'] - quote['change'])
+    if not contracts:
+        return quotes
+    snapshots, errors = gateway.gather(
+        {underlying: partial(get_derivatives_snapshot, underlying) for underlying in contracts}, deadline=30
+    )
+    for underlying, error in errors.items():
+        print(f"Could not price {underlying} holdings: {error}")
+    for underlying, (snapshot, _) in snapshots.items():
+        for symbol, (_, expiry, strike, option_type) in contracts[underlying]:
+            quote = snapshot.contract_quote(expiry, strike, option_type)
+            if quote:
+                price, change_percent = quote
+                quotes[symbol] = (price, price / (1 + change_percent / 100) if change_percent > -100 else None)
+    return quotes
+
+@market_data_bp.record_once
+def configure_valuation(state):
+    """Value holdings from this blueprint's quote sources, cached in the market cache"""
+    valuation.configure(fetch_valuation_quotes, market_cache, state.app.config.get('PORTFOLIO_VALUATION_TTL', 30))
 
 @market_data_bp.route('/portfolio/holdings', methods=['GET'])
 def get_holdings():
-    """Get user's holdings"""
-    try:
-        # In a real system, this would fetch from a database
-        holdings = [
-            {
-                'symbol': 'RELIANCE',
-                'quantity': 10,
-                'average_price': 2500.50,
-                'current_price': 2550.75,
-                'value': 25507.50,
-                'pnl': 507.50,
-                'pnl_percentage': 2.03,
-                'type': 'EQUITY'
-            },
-            {
-                'symbol': 'NIFTY',
-                'quantity': 1,
-                'average_price': 19500.00,
-                'current_price': 19650.25,
-                'value': 19650.25,
-                'pnl': 150.25,
-                'pnl_percentage': 0.77,
-                'type': 'FUTURES'
-            },
-            {
-                'symbol': 'BANKNIFTY',
-                'quantity': 2,
-                'strike': 45000,
-                'expiry': '2024-03-28',
-                'option_type': 'CE',
-                'average_price': 150.75,
-                'current_price': 165.50,
-                'value': 331.00,
-                'pnl': 29.50,
-                'pnl_percentage': 9.78,
-                'type': 'OPTIONS'
-            }
-        ]
-        return jsonify(holdings)
-    except Exception as e:
-        print(f"Error fetching holdings: {e}")
-        return jsonify({'error': 'Failed to fetch holdings'}), 500
+    """Get user's holdings marked to market"""
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Authentication required'}), 401
+    return jsonify(valuation.portfolio_valuer.value_user(user_id)['holdings'])
+
+@market_data_bp.route('/portfolio/valuation', methods=['GET'])
+def get_portfolio_valuation():
+    """Get user's holdings marked to market with portfolio totals"""
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Authentication required'}), 401
+    return jsonify(valuation.portfolio_valuer.value_user(user_id))
 
 @market_data_bp.route('/portfolio/transactions', methods=['GET'])
 def get_transactions():
@@ -980,99 +1340,92 @@ def remove_from_watchlist(symbol):
 @market_data_bp.route('/orders/active', methods=['GET'])
 def get_active_orders():
     """Get active orders"""
-    try:
-        # In a real system, this would fetch from a database
-        active_orders = [
-            {
-                'id': '1',
-                'symbol': 'RELIANCE',
-                'type': 'BUY',
-                'quantity': 5,
-                'price': 2480.00,
-                'order_type': 'LIMIT',
-                'status': 'PENDING',
-                'timestamp': '2024-03-22T09:15:00'
-            }
-        ]
-        return jsonify(active_orders)
-    except Exception as e:
-        print(f"Error fetching active orders: {e}")
-        return jsonify({'error': 'Failed to fetch active orders'}), 500
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Authentication required'}), 401
+    return jsonify([row.to_dict() for row in order_store.active_orders(user_id)])
 
 @market_data_bp.route('/orders/history', methods=['GET'])
 def get_order_history():
-    """Get order history"""
+    """Get a page of order history; the next page's cursor is in the X-Next-Cursor header"""
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Authentication required'}), 401
     try:
-        # In a real system, this would fetch from a database
-        order_history = [
-            {
-                'id': '1',
-                'symbol': 'RELIANCE',
-                'type': 'BUY',
-                'quantity': 10,
-                'price': 2500.50,
-                'order_type': 'MARKET',
-                'status': 'COMPLETED',
-                'timestamp': '2024-03-20T10:30:00'
-            }
-        ]
-        return jsonify(order_history)
-    except Exception as e:
-        print(f"Error fetching order history: {e}")
-        return jsonify({'error': 'Failed to fetch order history'}), 500
+        rows, next_cursor = order_store.order_history(
+            user_id,
+            status=request.args.get('status', '').upper() or None,
+            before=request.args.get('before'),
+            limit=request.args.get('limit', 50, type=int)
+        )
+    except OrderError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    response = jsonify([row.to_dict() for row in rows])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
-@market_data_bp.route('/orders/<order_id>', methods=['PUT'])
+@market_data_bp.route('/orders/<int:order_id>', methods=['PUT'])
 def modify_order(order_id):
-    """Modify an existing order"""
+    """Modify an existing order's quantity, limit price or trigger price"""
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Authentication required'}), 401
+    data = request.json or {}
     try:
-        data = request.json
-        # In a real system, this would update in a database
-        return jsonify({'message': f'Modified order {order_id}'})
-    except Exception as e:
-        print(f"Error modifying order: {e}")
-        return jsonify({'error': 'Failed to modify order'}), 500
+        quantity = int(data['quantity']) if data.get('quantity') is not None else None
+        limit_price = optional_price(data, 'price')
+        trigger_price = optional_price(data, 'trigger_price')
+        if quantity is not None and quantity <= 0:
+            raise OrderError('Quantity must be positive')
+        if any(price is not None and price <= 0 for price in (limit_price, trigger_price)):
+            raise OrderError('Prices must be positive')
+        row = order_store.modify_order(order_id, user_id, quantity, limit_price, trigger_price)
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), getattr(e, 'status_code', 400)
+    order_store.apply_to_engine(matching_engine, row)
+    return jsonify({'message': f'Modified order {order_id}', 'order': row.to_dict()})
 
-@market_data_bp.route('/orders/<order_id>', methods=['DELETE'])
+@market_data_bp.route('/orders/<int:order_id>', methods=['DELETE'])
 def cancel_order(order_id):
     """Cancel an existing order"""
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Authentication required'}), 401
     try:
-        # In a real system, this would update in a database
-        return jsonify({'message': f'Cancelled order {order_id}'})
-    except Exception as e:
-        print(f"Error cancelling order: {e}")
-        return jsonify({'error': 'Failed to cancel order'}), 500
+        row = order_store.cancel_order(order_id, user_id)
+    except OrderError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    matching_engine.discard(order_id)
+    return jsonify({'message': f'Cancelled order {order_id}', 'order': row.to_dict()})
+
+@market_data_bp.route('/orders/stats', methods=['GET'])
+def get_order_stats():
+    """Get resting order and fill counters for this worker's matching engine"""
+    return jsonify(matching_engine.stats())
+
+def market_depth(symbol, levels=None):
+    """Depth snapshot from the symbol's simulated book, re-pricing it when its quote is stale"""
+    snapshot, age = depth_simulator.depth(symbol, levels)
+    if snapshot is None or age > DEPTH_QUOTE_TTL:
+        info = fetch_yahoo_info(symbol)
+        depth_simulator.on_quote(symbol, info.get('regularMarketPrice'), info.get('regularMarketVolume'))
+        snapshot, _ = depth_simulator.depth(symbol, levels)
+    if snapshot is None:
+        raise UpstreamError(f'No price available for {symbol}', 404)
+    return snapshot
 
 @market_data_bp.route('/market/depth/<symbol>', methods=['GET'])
 def get_market_depth(symbol):
     """Get market depth for a symbol"""
     try:
-        stock = yf.Ticker(symbol)
-        info = stock.info
-        
-        # Simulate market depth data
-        last_price = info.get('regularMarketPrice', 0)
-        spread = last_price * 0.001  # 0.1% spread
-        
-        bids = [
-            {'price': last_price - spread * i, 'quantity': int(1000 * (1 - i/10))}
-            for i in range(10)
-        ]
-        
-        asks = [
-            {'price': last_price + spread * i, 'quantity': int(1000 * (1 - i/10))}
-            for i in range(10)
-        ]
-        
-        return jsonify({
-            'bids': bids,
-            'asks': asks,
-            'last_price': last_price,
-            'volume': info.get('regularMarketVolume', 0),
-            'timestamp': datetime.now().isoformat()
-        })
+        data = market_depth(symbol, request.args.get('levels', type=int))
+    except UpstreamError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         print(f"Error fetching market depth: {e}")
         return jsonify({'error': 'Failed to fetch market depth'}), 500
+    return jsonify(data)
 
 @market_data_bp.route('/market/chart/<symbol>', methods=['GET'])
 def get_chart_data(symbol):
@@ -1126,22 +1479,94 @@ def calculate_margin():
         print(f"Error calculating margin: {e}")
         return jsonify({'error': 'Failed to calculate margin'}), 500
 
+def parse_positions(spec):
+    """Parse 'SYMBOL:QTY', 'UNDERLYING:EXPIRY:FUT:QTY' and 'UNDERLYING:EXPIRY:STRIKE:CE|PE:QTY' legs"""
+    legs = []
+    for leg in filter(None, (part.strip() for part in spec.split(','))):
+        parts = leg.split(':')
+        try:
+            if len(parts) == 2:
+                legs.append({'kind': 'equity', 'symbol': parts[0].upper(), 'quantity': int(parts[1])})
+            elif len(parts) == 4 and parts[2].upper() == 'FUT':
+                legs.append({'kind': 'future', 'underlying': parts[0].upper(), 'expiry': parts[1],
+                             'quantity': int(parts[3])})
+            elif len(parts) == 5 and parts[3].upper() in ('CE', 'PE'):
+                legs.append({'kind': 'option', 'underlying': parts[0].upper(), 'expiry': parts[1],
+                             'strike': float(parts[2]), 'option_type': parts[3].upper(),
+                             'quantity': int(parts[4])})
+            else:
+                raise ValueError(leg)
+        except ValueError:
+            raise UpstreamError(f'Invalid position: {leg}', 400)
+    return legs
+
+def calculate_exposure(legs):
+    """Notional exposure and net greeks for a list of parsed position legs"""
+    exposure = {
+        'total_exposure': 0.0,
+        'equity_exposure': 0.0,
+        'futures_exposure': 0.0,
+        'options_exposure': 0.0,
+        'net_delta': 0.0,
+        'net_gamma': 0.0,
+        'net_theta': 0.0,
+        'net_vega': 0.0,
+        'unpriced': []
+    }
+
+    equities = [leg for leg in legs if leg['kind'] == 'equity']
+    quotes = quote_batcher.fetch([f"{leg['symbol']}.BSE" for leg in equities]) if equities else {}
+    for leg in equities:
+        result = quotes.get(f"{leg['symbol']}.BSE")
+        if not result or result['status'] != 'ok':
+            exposure['unpriced'].append(leg)
+            continue
+        exposure['equity_exposure'] += abs(leg['quantity']) * result['quote']['price']
+        exposure['net_delta'] += leg['quantity']
+
+    snapshots = {}
+    for leg in legs:
+        if leg['kind'] == 'equity':
+            continue
+        if leg['underlying'] not in snapshots:
+            snapshots[leg['underlying']] = get_derivatives_snapshot(leg['underlying'])[0]
+        snapshot = snapshots[leg['underlying']]
+
+        if leg['kind'] == 'future':
+            future = next((f for f in snapshot.futures_records if f['expiry'] == leg['expiry']), None)
+            if future is None:
+                exposure['unpriced'].append(leg)
+                continue
+            exposure['futures_exposure'] += abs(leg['quantity']) * future['last_price']
+            exposure['net_delta'] += leg['quantity']
+            continue
+
+        row = snapshot.index.get((leg['expiry'], leg['strike'], leg['option_type']))
+        analytics = snapshot.option_analytics(row) if row is not None else None
+        if analytics is None or analytics.get('delta') is None:
+            exposure['unpriced'].append(leg)
+            continue
+        quantity = leg['quantity']
+        underlying_value = snapshot.columns['underlying_value'][row].item()
+        # Delta-adjusted notional
+        exposure['options_exposure'] += abs(quantity * analytics['delta']) * underlying_value
+        exposure['net_delta'] += quantity * analytics['delta']
+        exposure['net_gamma'] += quantity * analytics['gamma']
+        exposure['net_theta'] += quantity * analytics['theta']
+        exposure['net_vega'] += quantity * analytics['vega']
+
+    exposure['total_exposure'] = (exposure['equity_exposure'] + exposure['futures_exposure']
+                                  + exposure['options_exposure'])
+    return exposure
+
 @market_data_bp.route('/risk/exposure', methods=['GET'])
 def get_risk_exposure():
-    """Get current risk exposure"""
+    """Get risk exposure and net greeks for the given positions"""
     try:
-        # In a real system, this would calculate based on positions
-        exposure = {
-            'total_exposure': 100000.00,
-            'equity_exposure': 50000.00,
-            'futures_exposure': 30000.00,
-            'options_exposure': 20000.00,
-            'net_delta': 0.75,
-            'net_gamma': 0.25,
-            'net_theta': -0.15,
-            'net_vega': 0.10
-        }
-        return jsonify(exposure)
+        legs = parse_positions(request.args.get('positions', ''))
+        return jsonify(calculate_exposure(legs))
+    except UpstreamError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         print(f"Error fetching risk exposure: {e}")
         return jsonify({'error': 'Failed to fetch risk exposure'}), 500
@@ -1151,9 +1576,16 @@ def get_market_overview():
     try:
         indices = ['^NSEI', '^BSESN', '^NSEBANK']
         overview = {}
-        
+
+        infos, errors = gateway.gather(
+            {index: partial(fetch_yahoo_info, index) for index in indices},
+            timeout=YAHOO_CALL_TIMEOUT
+        )
+        for index, error in errors.items():
+            print(f"Error fetching {index} for market overview: {error}")
+
         for index in indices:
-            data = get_stock_data(index)
+            data = infos.get(index)
             if data:
                 overview[index] = {
                     'price': data.get('regularMarketPrice', 0),
@@ -1166,44 +1598,96 @@ def get_market_overview():
         print(f"Error fetching market overview: {e}")
         return jsonify({'error': 'Failed to fetch market overview'}), 500
 
+def fetch_yahoo_search(query):
+    """Look up the tickers in query with yfinance"""
+    # Use yfinance to search for stocks
+    tickers = yf.Tickers(query)
+    infos, errors = gateway.gather(
+        {symbol: partial(getattr, ticker, 'info') for symbol, ticker in tickers.tickers.items()},
+        timeout=YAHOO_CALL_TIMEOUT
+    )
+    results = []
+
+    for symbol in tickers.tickers:
+        if symbol in errors:
+            print(f"Error fetching info for {symbol}: {errors[symbol]}")
+            continue
+        info = infos[symbol]
+        if info:
+            results.append({
+                'symbol': symbol,
+                'name': info.get('longName', ''),
+                'exchange': info.get('exchange', ''),
+                'type': info.get('quoteType', ''),
+                'currency': info.get('currency', '')
+            })
+
+    return {'results': results}
+
 @market_data_bp.route('/market/search', methods=['GET'])
 def search_stocks_yahoo():
     """Search for stocks using Yahoo Finance API"""
     query = request.args.get('q', '')
     if not query:
         return jsonify({'error': 'Query parameter is required'}), 400
-    
-    cache_key = f"yahoo_search_{query}"
-    cached_data = get_cached_data(cache_key)
-    if cached_data:
-        return jsonify(cached_data)
-    
+
     try:
-        # Use yfinance to search for stocks
-        tickers = yf.Tickers(query)
-        results = []
-        
-        for symbol, ticker in tickers.tickers.items():
-            try:
-                info = ticker.info
-                if info:
-                    results.append({
-                        'symbol': symbol,
-                        'name': info.get('longName', ''),
-                        'exchange': info.get('exchange', ''),
-                        'type': info.get('quoteType', ''),
-                        'currency': info.get('currency', '')
-                    })
-            except Exception as e:
-                print(f"Error fetching info for {symbol}: {e}")
-                continue
-        
-        data = {'results': results}
-        set_cached_data(cache_key, data)
+        if len(instrument_index):
+            data = {'results': [
+                {
+                    'symbol': instrument.symbol + YAHOO_SUFFIXES.get(instrument.exchange, ''),
+                    'name': instrument.name,
+                    'exchange': instrument.exchange,
+                    'type': 'EQUITY' if instrument.is_equity else instrument.instrument_type,
+                    'currency': 'INR'
+                }
+                for instrument in instrument_index.search(query, SEARCH_LIMIT)
+            ]}
+        else:
+            data = get_or_fetch(f"yahoo_search_{query}", lambda: fetch_yahoo_search(query))
         return jsonify(data)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Longest history Yahoo serves per intraday bar interval; daily and longer bars go back to the listing
+YAHOO_HISTORY_PERIODS = {'1m': '7d', '2m': '60d', '5m': '60d', '15m': '60d', '30m': '60d', '90m': '60d',
+                         '60m': '730d', '1h': '730d'}
+
+def stored_daily_symbol(symbol):
+    """Alpha Vantage symbol under which a Yahoo BSE listing's daily bars are stored, or None.
+
+    Only explicit .BO listings map across; a bare symbol is whatever Yahoo
+    lists under it (US stocks, indices), not necessarily the BSE instrument.
+    """
+    if symbol.endswith('.BO'):
+        return f"{symbol[:-3]}.BSE"
+    return None
+
+def stock_indicators(symbol, interval, stock):
+    """Latest indicators for a Yahoo symbol over its full history at interval.
+
+    Daily bars come from the stored history, as for /stock/technical; other
+    intervals and symbols without stored bars use the longest history Yahoo
+    has, so the 200-bar windows are filled. A symbol found to have no stored
+    history goes straight to Yahoo for HISTORY_SYNC_MINUTES.
+    """
+    stored = stored_daily_symbol(symbol) if interval == '1d' else None
+    if stored is not None and get_cached_data(f"no_history_{stored}") is None:
+        try:
+            return indicator_states.values(stored, ensure_daily_history(stored))
+        except (UpstreamError, QuotaExceeded) as e:
+            print(f"No stored history for {symbol}, using Yahoo bars: {e}")
+            set_cached_data(f"no_history_{stored}", True, HISTORY_SYNC_MINUTES)
+    hist = stock.history(period=YAHOO_HISTORY_PERIODS.get(interval, 'max'), interval=interval)
+    return indicators.latest(PriceSeries(
+        hist.index.asi8 // 10**9,
+        hist['Open'].to_numpy(),
+        hist['High'].to_numpy(),
+        hist['Low'].to_numpy(),
+        hist['Close'].to_numpy(),
+        hist['Volume'].to_numpy()
+    ))
+
 @market_data_bp.route('/market/stock/<symbol>', methods=['GET'])
 def get_stock_data_route(symbol):
     try:
@@ -1232,34 +1716,10 @@ def get_stock_data_route(symbol):
                 }
                 for index, row in hist.iterrows()
             ],
-            'indicators': {
-                'sma_20': hist['Close'].rolling(window=20).mean().iloc[-1],
-                'sma_50': hist['Close'].rolling(window=50).mean().iloc[-1],
-                'rsi': calculate_rsi(hist['Close']),
-                'macd': calculate_macd(hist['Close'])
-            }
+            'indicators': stock_indicators(symbol, interval, stock)
         }
         
         return jsonify(data)
     except Exception as e:
         print(f"Error fetching stock data: {e}")
         return jsonify({'error': 'Failed to fetch stock data'}), 500
-
-def calculate_rsi(prices, period=14):
-    delta = prices.diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-    rs = gain / loss
-    return 100 - (100 / (1 + rs)).iloc[-1]
-
-def calculate_macd(prices, fast=12, slow=26, signal=9):
-    exp1 = prices.ewm(span=fast, adjust=False).mean()
-    exp2 = prices.ewm(span=slow, adjust=False).mean()
-    macd = exp1 - exp2
-    signal_line = macd.ewm(span=signal, adjust=False).mean()
-    return {
-        'macd': macd.iloc[-1],
-        'signal': signal_line.iloc[-1],
-        'histogram': (macd - signal_line).iloc[-1]
-    }
-
@@ -0,0 +1,377 @@
+import heapq
+import itertools
+import threading
+import uuid
+from datetime import datetime
+
+# Accepted order type spellings, normalised to NSE's MARKET / LIMIT / SL / SL-M
+ORDER_TYPES = {
+    'MARKET': 'MARKET',
+    'LIMIT': 'LIMIT',
+    'SL': 'SL',
+    'STOP_LIMIT': 'SL',
+    'SL-M': 'SL-M',
+    'STOP': 'SL-M',
+    'STOP_MARKET': 'SL-M'
+}
+SIDES = ('BUY', 'SELL')
+
+# Rebuild a book's heaps once cancelled/modified entries outnumber live ones by this much
+COMPACT_SLACK = 1024
+
+
+class OrderError(ValueError):
+    """An order request that cannot be accepted; carries the HTTP status to return"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class FillConflict(Exception):
+    """A limit order's fill that lost a race with another trade; it rests again and retries on a later tick"""
+
+
+class Order:
+    __slots__ = ('id', 'user_id', 'symbol', 'side', 'quantity', 'order_type', 'limit_price', 'stop_price',
+                 'market', 'status', 'created_at', 'updated_at', 'filled_price', 'reason', 'version', 'seq')
+
+    def __init__(self, user_id, symbol, side, quantity, order_type, limit_price=None, stop_price=None,
+                 market=None, id=None, version=0, created_at=None):
+        side = (side or '').upper()
+        order_type = ORDER_TYPES.get((order_type or '').upper())
+        if side not in SIDES:
+            raise OrderError(f'Side must be one of {", ".join(SIDES)}')
+        if order_type is None:
+            raise OrderError(f'Order type must be one of {", ".join(sorted(set(ORDER_TYPES.values())))}')
+        if quantity <= 0:
+            raise OrderError('Quantity must be positive')
+        if order_type in ('LIMIT', 'SL') and not (limit_price and limit_price > 0):
+            raise OrderError('A positive limit price is required')
+        if order_type in ('SL', 'SL-M') and not (stop_price and stop_price > 0):
+            raise OrderError('A positive trigger price is required')
+
+        self.id = id or uuid.uuid4().hex
+        self.user_id = user_id
+        self.symbol = symbol
+        self.side = side
+        self.quantity = quantity
+        self.order_type = order_type
+        self.limit_price = limit_price if order_type in ('LIMIT', 'SL') else None
+        self.stop_price = stop_price if order_type in ('SL', 'SL-M') else None
+        self.market = market
+        self.status = 'OPEN'
+        self.created_at = created_at or datetime.utcnow()
+        self.updated_at = self.created_at
+        self.filled_price = None
+        self.reason = None
+        self.version = version
+        self.seq = None
+
+    @property
+    def triggered(self):
+        """Stop orders rest on their trigger price until it is hit, then act as market/limit orders"""
+        return self.stop_price is None
+
+    def fill_price(self, price):
+        """Price this order fills at when the market trades at price"""
+        if self.limit_price is None:
+            return price
+        return min(self.limit_price, price) if self.side == 'BUY' else max(self.limit_price, price)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'symbol': self.symbol,
+            'type': self.side,
+            'quantity': self.quantity,
+            'price': self.limit_price,
+            'trigger_price': self.stop_price,
+            'order_type': self.order_type,
+            'status': self.status,
+            'filled_price': self.filled_price,
+            'reason': self.reason,
+            'session_id': self.market,
+            'timestamp': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+
+
+class _Book:
+    """Resting orders for one symbol, as four heaps of (key, seq, order).
+
+    Buy limits pop highest price first and sell limits lowest first, so the
+    orders a trade at price p fills are always at the heap tops. Stops are
+    keyed the other way round: buy stops trigger when p rises to them,
+    sell stops when p falls to them. Cancelled and modified orders are left
+    in place and skipped when they surface (their seq no longer matches).
+    """
+
+    __slots__ = ('buy_limits', 'sell_limits', 'buy_stops', 'sell_stops', 'live', 'dead')
+
+    def __init__(self):
+        self.buy_limits = []
+        self.sell_limits = []
+        self.buy_stops = []
+        self.sell_stops = []
+        self.live = 0
+        self.dead = 0
+
+    def push(self, order):
+        if not order.triggered:
+            if order.side == 'BUY':
+                heapq.heappush(self.buy_stops, (order.stop_price, order.seq, order))
+            else:
+                heapq.heappush(self.sell_stops, (-order.stop_price, order.seq, order))
+        elif order.side == 'BUY':
+            heapq.heappush(self.buy_limits, (-order.limit_price, order.seq, order))
+        else:
+            heapq.heappush(self.sell_limits, (order.limit_price, order.seq, order))
+
+    @staticmethod
+    def _pop_crossed(heap, crossed):
+        orders = []
+        while heap and crossed(heap[0][0]):
+            _, seq, order = heapq.heappop(heap)
+            if order.status == 'OPEN' and order.seq == seq:
+                orders.append(order)
+        return orders
+
+    def match(self, price):
+        """Remove and return the orders a trade at price fills, triggering stops on the way"""
+        filled = []
+        triggered = self._pop_crossed(self.buy_stops, lambda stop: stop <= price)
+        triggered += self._pop_crossed(self.sell_stops, lambda stop: -stop >= price)
+        for order in triggered:
+            order.stop_price = None
+            if order.limit_price is None:
+                # SL-M becomes a market order
+                filled.append(order)
+            else:
+                self.push(order)
+
+        filled += self._pop_crossed(self.buy_limits, lambda limit: -limit >= price)
+        filled += self._pop_crossed(self.sell_limits, lambda limit: limit <= price)
+        return filled
+
+    def compact(self):
+        """Drop entries of orders that are no longer resting"""
+        for name in ('buy_limits', 'sell_limits', 'buy_stops', 'sell_stops'):
+            heap = [entry for entry in getattr(self, name) if entry[2].status == 'OPEN' and entry[2].seq == entry[1]]
+            heapq.heapify(heap)
+            setattr(self, name, heap)
+        self.dead = 0
+
+
+class MatchingEngine:
+    """Paper order matching driven by quote ticks.
+
+    Resting orders are kept per (market, symbol) book, where market is None
+    for live quotes or a replay session id. Each tick pops only the orders
+    it crosses off the heap tops, so a tick costs O(log n) per filled or
+    triggered order however many orders are resting.
+
+    Fills are handed to execute(order, price), which books the trade. It
+    raises to reject the fill and returns False when the order turns out to
+    be closed or changed elsewhere (e.g. by another worker), in which case
+    the order is simply dropped from this engine. Raising FillConflict
+    leaves the order resting instead.
+
+    watch(symbol) / unwatch(symbol) are called when a live symbol gets its
+    first resting order and loses its last, so its quotes can be polled
+    only while something is waiting on them.
+    """
+
+    def __init__(self, execute, watch=None, unwatch=None):
+        self.execute = execute
+        self.watch = watch
+        self.unwatch = unwatch
+        self._books = {}
+        self._orders = {}
+        self._last_prices = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.fills = 0
+        self.rejections = 0
+
+    def last_price(self, symbol, market=None):
+        return self._last_prices.get((market, symbol))
+
+    def validate(self, order, price=None):
+        """Raise OrderError if order cannot be accepted at price (or the last tick)"""
+        price = price if price is not None else self._last_prices.get((order.market, order.symbol))
+        if order.order_type == 'MARKET' and price is None:
+            raise OrderError(f'No price available for {order.symbol}')
+        if not order.triggered and price is not None:
+            beyond = price >= order.stop_price if order.side == 'BUY' else price <= order.stop_price
+            if beyond:
+                side = 'above' if order.side == 'BUY' else 'below'
+                raise OrderError(f'Trigger price must be {side} the last price ({price})')
+
+    def _rest(self, order):
+        """Add order to its book (lock held); returns whether its symbol needs watching"""
+        key = (order.market, order.symbol)
+        book = self._books.get(key)
+        watch = False
+        if book is None:
+            book = self._books[key] = _Book()
+            watch = order.market is None
+        order.seq = next(self._seq)
+        book.push(order)
+        book.live += 1
+        self._orders[order.id] = order
+        return watch
+
+    def place(self, order, price=None):
+        """Accept an order; price is the symbol's current price when the caller knows it.
+
+        Market orders fill at once at price (or the last tick). Limit orders
+        that are already marketable fill on the spot as well.
+        """
+        key = (order.market, order.symbol)
+        watch = False
+        with self._lock:
+            self.validate(order, price)
+            if price is not None:
+                self._last_prices[key] = price
+            price = self._last_prices.get(key)
+            if order.order_type == 'MARKET':
+                order.status = 'FILLING'
+            else:
+                watch = self._rest(order)
+
+        if watch and self.watch:
+            self.watch(order.symbol)
+        if order.order_type == 'MARKET':
+            self._fill(order, price)
+        elif price is not None:
+            self.on_quote(order.symbol, price, order.market)
+        return order
+
+    def load(self, order):
+        """Rest an order accepted earlier (e.g. restored from storage) until the next tick"""
+        with self._lock:
+            if order.id in self._orders:
+                return
+            watch = self._rest(order)
+        if watch and self.watch:
+            self.watch(order.symbol)
+
+    def on_quote(self, symbol, price, market=None):
+        """Fill every resting order a trade at price reaches; returns the orders it handed to execute"""
+        key = (market, symbol)
+        with self._lock:
+            book = self._books.get(key)
+            # Replay markets come and go, so only live prices are remembered without a book
+            if market is None or book is not None:
+                self._last_prices[key] = price
+            if book is None:
+                return []
+            filled = book.match(price)
+            for order in filled:
+                order.status = 'FILLING'
+            book.live -= len(filled)
+            unwatch = self._drop_if_empty(key, book)
+
+        if unwatch and self.unwatch:
+            self.unwatch(symbol)
+        for order in filled:
+            self._fill(order, order.fill_price(price))
+        return filled
+
+    def _drop_if_empty(self, key, book):
+        if book.live:
+            return False
+        del self._books[key]
+        return key[0] is None
+
+    def _fill(self, order, price):
+        try:
+            booked = self.execute(order, price) is not False
+        except FillConflict:
+            self._requeue(order)
+            return
+        except Exception as e:
+            status, reason = 'REJECTED', str(e)
+        else:
+            status, reason = ('FILLED', None) if booked else ('CLOSED', None)
+        with self._lock:
+            order.status = status
+            order.reason = reason
+            order.filled_price = price if status == 'FILLED' else None
+            order.updated_at = datetime.utcnow()
+            if status == 'FILLED':
+                self.fills += 1
+            elif status == 'REJECTED':
+                self.rejections += 1
+            self._orders.pop(order.id, None)
+
+    def _requeue(self, order):
+        with self._lock:
+            order.status = 'OPEN'
+            watch = self._rest(order)
+        if watch and self.watch:
+            self.watch(order.symbol)
+
+    def discard(self, order_id):
+        """Stop matching an order, e.g. once it is cancelled; returns it or None if not resting here"""
+        with self._lock:
+            order = self._orders.get(order_id)
+            if order is None or order.status != 'OPEN':
+                return None
+            order.status = 'CANCELLED'
+            order.updated_at = datetime.utcnow()
+            key = (order.market, order.symbol)
+            book = self._books[key]
+            book.live -= 1
+            book.dead += 1
+            if book.dead > book.live + COMPACT_SLACK:
+                book.compact()
+            unwatch = self._drop_if_empty(key, book)
+            del self._orders[order_id]
+        if unwatch and self.unwatch:
+            self.unwatch(order.symbol)
+        return order
+
+    def modify(self, order_id, quantity=None, limit_price=None, stop_price=None, version=None):
+        """Change a resting order; it queues again behind equal prices. Returns None if not resting here"""
+        with self._lock:
+            order = self._orders.get(order_id)
+            if order is None or order.status != 'OPEN':
+                return None
+            if quantity is not None:
+                order.quantity = quantity
+            if limit_price is not None and order.limit_price is not None:
+                order.limit_price = limit_price
+            if stop_price is not None and not order.triggered:
+                order.stop_price = stop_price
+            order.version = order.version + 1 if version is None else version
+            order.updated_at = datetime.utcnow()
+            book = self._books[(order.market, order.symbol)]
+            # The old heap entry goes stale once seq changes
+            order.seq = next(self._seq)
+            book.push(order)
+            book.dead += 1
+            if book.dead > book.live + COMPACT_SLACK:
+                book.compact()
+            price = self._last_prices.get((order.market, order.symbol))
+        if price is not None:
+            self.on_quote(order.symbol, price, order.market)
+        return order
+
+    def get(self, order_id):
+        return self._orders.get(order_id)
+
+    def resting_symbols(self):
+        """(market, symbol) of every book with resting orders"""
+        with self._lock:
+            return list(self._books)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'books': len(self._books),
+                'resting_orders': sum(book.live for book in self._books.values()),
+                'fills': self.fills,
+                'rejections': self.rejections
+            }
@@ -0,0 +1,204 @@
+from datetime import datetime, time as dt_time, timedelta
+
+import numpy as np
+
+# Annualised risk-free rate used for every chain; see configure()
+RISK_FREE_RATE = 0.065
+
+# NSE contracts expire at the 15:30 IST close
+EXPIRY_CLOSE = dt_time(15, 30)
+IST_OFFSET = timedelta(hours=5, minutes=30)
+SECONDS_PER_YEAR = 365.0 * 24 * 3600
+
+MIN_VOL = 1e-4
+MAX_VOL = 5.0
+NEWTON_STEPS = 20
+BISECTION_STEPS = 80
+IV_TOLERANCE = 1e-8
+
+_SQRT_2PI = np.sqrt(2 * np.pi)
+
+
+def configure(config):
+    """Apply the app's pricing settings"""
+    global RISK_FREE_RATE
+    RISK_FREE_RATE = config.get('RISK_FREE_RATE', RISK_FREE_RATE)
+
+
+def norm_pdf(x):
+    return np.exp(-0.5 * np.square(x)) / _SQRT_2PI
+
+
+def norm_cdf(x):
+    """Standard normal CDF to double precision (Hart's algorithm as given by West, 2005)"""
+    x = np.asarray(x, dtype=float)
+    z = np.abs(x)
+    e = np.exp(-0.5 * z * z)
+
+    num = 3.52624965998911e-02 * z + 0.700383064443688
+    for c in (6.37396220353165, 33.912866078383, 112.079291497871, 221.213596169931, 220.206867912376):
+        num = num * z + c
+    den = 8.83883476483184e-02 * z + 1.75566716318264
+    for c in (16.064177579207, 86.7807322029461, 296.564248779674, 637.333633378831,
+              793.826512519948, 440.413735824752):
+        den = den * z + c
+    near = e * num / den
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = z + 0.65
+        for c in (4.0, 3.0, 2.0, 1.0):
+            frac = z + c / frac
+        far = e / frac / 2.506628274631
+
+    tail = np.where(z < 7.07106781186547, near, far)
+    tail = np.where(z > 37, 0.0, tail)
+    return np.where(x > 0, 1 - tail, tail)
+
+
+def _d1_d2(S, K, T, r, sigma):
+    sqrt_t = np.sqrt(T)
+    d1 = (np.log(S / K) + (r + 0.5 * sigma * sigma) * T) / (sigma * sqrt_t)
+    return d1, d1 - sigma * sqrt_t
+
+
+def black_scholes(S, K, T, r, sigma, is_call):
+    """European option prices; is_call selects calls (True) or puts (False) per contract"""
+    d1, d2 = _d1_d2(S, K, T, r, sigma)
+    discount = K * np.exp(-r * T)
+    call = S * norm_cdf(d1) - discount * norm_cdf(d2)
+    put = discount * norm_cdf(-d2) - S * norm_cdf(-d1)
+    return np.where(is_call, call, put)
+
+
+def greeks(S, K, T, r, sigma, is_call):
+    """Delta, gamma, theta (per calendar day), vega and rho (per 1 point of vol / rate)"""
+    d1, d2 = _d1_d2(S, K, T, r, sigma)
+    sqrt_t = np.sqrt(T)
+    pdf = norm_pdf(d1)
+    discount = K * np.exp(-r * T)
+    call_delta = norm_cdf(d1)
+    decay = -S * pdf * sigma / (2 * sqrt_t)
+    return {
+        'delta': np.where(is_call, call_delta, call_delta - 1),
+        'gamma': pdf / (S * sigma * sqrt_t),
+        'theta': np.where(is_call, decay - r * discount * norm_cdf(d2), decay + r * discount * norm_cdf(-d2)) / 365,
+        'vega': S * pdf * sqrt_t / 100,
+        'rho': np.where(is_call, discount * T * norm_cdf(d2), -discount * T * norm_cdf(-d2)) / 100
+    }
+
+
+def implied_volatility(price, S, K, T, r, is_call):
+    """Solve Black-Scholes for volatility, contract by contract but in one array pass.
+
+    Each contract is solved as its out-of-the-money side (converted by
+    put-call parity), where the price is all time value. Newton steps start
+    from the Manaster-Koehler point, from which they converge monotonically,
+    and only still-unconverged contracts are carried into the next step.
+    Anything Newton leaves (vega too small to divide by) is finished by
+    bisection on [MIN_VOL, MAX_VOL]. Prices outside the no-arbitrage bounds,
+    or with no time left, give NaN.
+    """
+    inputs = (np.asarray(price, dtype=float), np.asarray(S, dtype=float), np.asarray(K, dtype=float),
+              np.asarray(T, dtype=float), np.asarray(r, dtype=float), np.asarray(is_call, dtype=bool))
+    shape = np.broadcast(*inputs).shape
+    # At least 1-d so scalar calls can be indexed like chains
+    price, S, K, T, r, is_call = np.broadcast_arrays(*np.atleast_1d(*inputs))
+    with np.errstate(invalid='ignore', over='ignore'):
+        discount = K * np.exp(-r * T)
+        otm_call = discount >= S
+        parity = np.where(is_call, -(S - discount), S - discount)
+        otm_price = np.where(is_call == otm_call, price, price + parity)
+        upper = np.where(otm_call, S, discount)
+        valid = (T > 0) & (S > 0) & (K > 0) & (otm_price > 0) & (otm_price < upper)
+
+    sigma = np.full(price.shape, np.nan)
+    idx = np.flatnonzero(valid)
+    if not len(idx):
+        return sigma.reshape(shape)
+    p, s, k, t, rate, call = otm_price[idx], S[idx], K[idx], T[idx], r[idx], otm_call[idx]
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        # Manaster-Koehler start; at the money it is zero, so fall back to Brenner-Subrahmanyam
+        start = np.sqrt(2 * np.abs(np.log(s / k) + rate * t) / t)
+        vol = np.clip(np.where(start > 0.05, start, np.sqrt(2 * np.pi / t) * p / s), MIN_VOL, MAX_VOL)
+
+        active = np.arange(len(idx))
+        stalled = []
+        for _ in range(NEWTON_STEPS):
+            if not len(active):
+                break
+            a_s, a_k, a_t, a_r, a_vol = s[active], k[active], t[active], rate[active], vol[active]
+            diff = black_scholes(a_s, a_k, a_t, a_r, a_vol, call[active]) - p[active]
+            vega = a_s * norm_pdf(_d1_d2(a_s, a_k, a_t, a_r, a_vol)[0]) * np.sqrt(a_t)
+            unconverged = np.abs(diff) >= IV_TOLERANCE * np.maximum(p[active], 1.0)
+            keep = unconverged & (vega >= 1e-8)
+            stalled.append(active[unconverged & ~keep])
+            active = active[keep]
+            vol[active] = np.clip(a_vol[keep] - diff[keep] / vega[keep], MIN_VOL, MAX_VOL)
+
+        active = np.concatenate([active] + stalled)
+        if len(active):
+            lo = np.full(len(active), MIN_VOL)
+            hi = np.full(len(active), MAX_VOL)
+            args = (s[active], k[active], t[active], rate[active])
+            for _ in range(BISECTION_STEPS):
+                mid = 0.5 * (lo + hi)
+                too_high = black_scholes(*args, mid, call[active]) > p[active]
+                hi = np.where(too_high, mid, hi)
+                lo = np.where(too_high, lo, mid)
+            vol[active] = 0.5 * (lo + hi)
+
+    sigma[idx] = vol
+    return sigma.reshape(shape)
+
+
+def years_to_expiry(expiry_dates, valuation_time):
+    """Year fractions from valuation_time (UTC epoch seconds) to each expiry's close"""
+    years = []
+    for expiry in expiry_dates:
+        if expiry is None:
+            years.append(np.nan)
+            continue
+        close = datetime.combine(expiry, EXPIRY_CLOSE) - IST_OFFSET
+        seconds = (close - datetime.utcfromtimestamp(valuation_time)).total_seconds()
+        years.append(seconds / SECONDS_PER_YEAR)
+    return np.array(years, dtype=float)
+
+
+def price_chain(snapshot, rate=None):
+    """Implied vols, theoretical prices and greeks for every option in a DerivativesSnapshot.
+
+    Valued at the snapshot's fetch time against each contract's reported
+    underlying value. NSE's own implied volatility (in percent) is used for
+    the theoretical price when it reports one; otherwise the expiry's
+    at-the-money implied volatility is. Returns {name: array} aligned with the snapshot's
+    option rows.
+    """
+    rate = RISK_FREE_RATE if rate is None else rate
+    columns = snapshot.columns
+    T = years_to_expiry(snapshot.expiry_dates, snapshot.fetched_at)[snapshot.expiry_index]
+    S = columns['underlying_value']
+    K = snapshot.strike
+
+    iv = implied_volatility(columns['last_price'], S, K, T, rate, snapshot.is_call)
+
+    model_vol = np.where(columns['implied_volatility'] > 0, columns['implied_volatility'] / 100, np.nan)
+    # Contracts NSE gives no vol for are valued at their expiry's at-the-money implied vol
+    for expiry in np.unique(snapshot.expiry_index):
+        rows = np.flatnonzero((snapshot.expiry_index == expiry) & np.isfinite(iv))
+        if not len(rows):
+            continue
+        distance = np.abs(K[rows] - S[rows])
+        atm_vol = iv[rows[distance == distance.min()]].mean()
+        expiry_rows = snapshot.expiry_index == expiry
+        model_vol[expiry_rows] = np.where(np.isnan(model_vol[expiry_rows]), atm_vol, model_vol[expiry_rows])
+
+    # Greeks at the market-implied vol where it exists, else the model vol
+    greek_vol = np.where(np.isfinite(iv), iv, model_vol)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        theoretical = black_scholes(S, K, T, rate, model_vol, snapshot.is_call)
+        result = greeks(S, K, T, rate, greek_vol, snapshot.is_call)
+    result['implied_volatility'] = iv * 100
+    result['theoretical_price'] = theoretical
+    result['time_to_expiry'] = T
+    return result
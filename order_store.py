@@ -0,0 +1,226 @@
+from datetime import datetime
+from decimal import Decimal
+
+from backend.models import db, Order as OrderRow, Fill
+from matching_engine import FillConflict, Order, OrderError
+from portfolio import TRADE_CONFLICT_STATUS, TradeError, execute_trade
+import valuation
+
+OPEN = 'OPEN'
+FINISHED_STATUSES = ('FILLED', 'CANCELLED', 'REJECTED')
+MAX_PAGE_SIZE = 200
+
+
+def _price(value):
+    return Decimal(str(round(value, 2))) if value is not None else None
+
+
+def _float(value):
+    return float(value) if value is not None else None
+
+
+def engine_order(row):
+    """Matching engine Order for a stored order row"""
+    return Order(
+        row.user_id, row.symbol, row.side, row.quantity, row.order_type,
+        limit_price=_float(row.limit_price),
+        stop_price=_float(row.trigger_price),
+        market=row.session_id,
+        id=row.id,
+        version=row.version,
+        created_at=row.created_at
+    )
+
+
+def apply_to_engine(engine, row):
+    """Bring a matching engine in line with a stored order"""
+    if row.status != OPEN:
+        engine.discard(row.id)
+        return
+    order = engine.get(row.id)
+    if order is None:
+        engine.load(engine_order(row))
+    elif order.version < row.version:
+        engine.modify(
+            row.id,
+            quantity=row.quantity,
+            limit_price=_float(row.limit_price),
+            stop_price=_float(row.trigger_price),
+            version=row.version
+        )
+
+
+def create_order(order):
+    """Store a new OPEN order and give the engine order its row id"""
+    row = OrderRow(
+        user_id=order.user_id,
+        symbol=order.symbol,
+        side=order.side,
+        order_type=order.order_type,
+        quantity=order.quantity,
+        limit_price=_price(order.limit_price),
+        trigger_price=_price(order.stop_price),
+        session_id=order.market,
+        status=OPEN,
+        version=order.version,
+        created_at=order.created_at,
+        updated_at=order.created_at
+    )
+    db.session.add(row)
+    db.session.commit()
+    order.id = row.id
+    return row
+
+
+def _update_open(order_id, values, user_id=None, version=None):
+    """One conditional UPDATE of an OPEN order; returns whether it matched"""
+    conditions = [OrderRow.id == order_id, OrderRow.status == OPEN]
+    if user_id is not None:
+        conditions.append(OrderRow.user_id == user_id)
+    if version is not None:
+        conditions.append(OrderRow.version == version)
+    values = dict(values, updated_at=datetime.utcnow())
+    result = db.session.execute(
+        db.update(OrderRow).where(*conditions).values(**values).execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def _not_open(order_id, user_id):
+    row = db.session.get(OrderRow, order_id)
+    if row is None or row.user_id != user_id:
+        return OrderError('Order not found', 404)
+    return OrderError(f'Order is already {row.status.lower()}', 409)
+
+
+def reject_order(order_id, reason):
+    _update_open(order_id, {'status': 'REJECTED', 'reason': reason[:200]})
+    db.session.commit()
+
+
+def fill_order(order, price):
+    """Book a fill of order at price; returns False if the order was no longer open at its version.
+
+    The order is claimed with a conditional UPDATE first, so when several
+    workers' engines fill the same order only one books the trade. The fill,
+    the trade and the order's new status commit together. A limit order
+    whose trade loses too many races with concurrent trades stays OPEN and
+    raises FillConflict; market orders have no later tick to wait for, so
+    they are rejected like any other trade that cannot be booked.
+    """
+    price = _price(price)
+    if not _update_open(order.id, {'status': 'FILLED', 'filled_price': price}, version=order.version):
+        db.session.rollback()
+        return False
+    try:
+        _, transaction = execute_trade(
+            order.user_id, order.symbol, order.side.lower(), order.quantity, price, commit=False
+        )
+        db.session.add(Fill(
+            order_id=order.id,
+            user_id=order.user_id,
+            transaction_id=transaction.id,
+            symbol=order.symbol,
+            side=order.side,
+            quantity=order.quantity,
+            price=price
+        ))
+        db.session.commit()
+    except TradeError as e:
+        db.session.rollback()
+        if e.status_code == TRADE_CONFLICT_STATUS and order.limit_price is not None:
+            # Contention is transient: a limit order stays OPEN at its version for the next tick
+            raise FillConflict(str(e))
+        reject_order(order.id, str(e))
+        raise
+    except Exception as e:
+        db.session.rollback()
+        reject_order(order.id, str(e))
+        raise
+    valuation.invalidate(order.user_id)
+    return True
+
+
+def cancel_order(order_id, user_id):
+    """Cancel a user's OPEN order; raises OrderError if there is none"""
+    if not _update_open(order_id, {'status': 'CANCELLED'}, user_id=user_id):
+        db.session.rollback()
+        raise _not_open(order_id, user_id)
+    db.session.commit()
+    return db.session.get(OrderRow, order_id)
+
+
+def modify_order(order_id, user_id, quantity=None, limit_price=None, trigger_price=None):
+    """Change a user's OPEN order and bump its version; raises OrderError if there is none.
+
+    Prices only change on orders that have one, as in the matching engine.
+    """
+    values = {'version': OrderRow.version + 1}
+    if quantity is not None:
+        values['quantity'] = quantity
+    if limit_price is not None:
+        values['limit_price'] = db.case(
+            (OrderRow.limit_price.isnot(None), _price(limit_price)), else_=OrderRow.limit_price
+        )
+    if trigger_price is not None:
+        values['trigger_price'] = db.case(
+            (OrderRow.trigger_price.isnot(None), _price(trigger_price)), else_=OrderRow.trigger_price
+        )
+    if not _update_open(order_id, values, user_id=user_id):
+        db.session.rollback()
+        raise _not_open(order_id, user_id)
+    db.session.commit()
+    return db.session.get(OrderRow, order_id)
+
+
+def active_orders(user_id):
+    """A user's OPEN orders, newest first"""
+    return (OrderRow.query
+            .filter(OrderRow.user_id == user_id, OrderRow.status == OPEN)
+            .order_by(OrderRow.created_at.desc(), OrderRow.id.desc())
+            .all())
+
+
+def encode_cursor(row):
+    return f"{row.created_at.isoformat()}_{row.id}"
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, order_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(order_id)
+    except (AttributeError, ValueError):
+        raise OrderError(f'Invalid cursor: {cursor}')
+
+
+def order_history(user_id, status=None, before=None, limit=50):
+    """One page of a user's finished orders, newest first; returns (rows, next cursor or None).
+
+    Pages are keyset paginated on (created_at, id) below the before cursor,
+    so each page is a range scan of the (user_id, status, created_at) index
+    however deep the client pages. Filtering on one status keeps the scan
+    to a single index range.
+    """
+    statuses = (status,) if status else FINISHED_STATUSES
+    if status and status not in FINISHED_STATUSES:
+        raise OrderError(f'Status must be one of {", ".join(FINISHED_STATUSES)}')
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = OrderRow.query.filter(OrderRow.user_id == user_id, OrderRow.status.in_(statuses))
+    if before:
+        created_at, order_id = decode_cursor(before)
+        query = query.filter(db.or_(
+            OrderRow.created_at < created_at,
+            db.and_(OrderRow.created_at == created_at, OrderRow.id < order_id)
+        ))
+    rows = query.order_by(OrderRow.created_at.desc(), OrderRow.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def open_orders():
+    return OrderRow.query.filter(OrderRow.status == OPEN).all()
+
+
+def changed_orders(since):
+    """Orders placed, modified or closed after since"""
+    return OrderRow.query.filter(OrderRow.updated_at > since).all()
@@ -1,8 +1,12 @@
 from flask import Blueprint, jsonify, request, session, current_app
 from datetime import datetime, timedelta
-from backend.models import db, User, Portfolio, Holding, Transaction, Subscription
+from backend.models import db, Portfolio, Holding, Transaction, Subscription
 from decimal import Decimal # Import Decimal
 from functools import wraps
+from sqlalchemy import event, or_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+import valuation
 
 portfolio_bp = Blueprint('portfolio', __name__)
 
@@ -15,46 +19,62 @@ def get_user_id():
 # For now, let's define it here, assuming it's a constant.
 FREE_TIER_LIMIT = 1000000.00 # 10 Lakh INR
 
-def check_trading_limit(user_id, amount_change, is_sell=False):
-    portfolio = Portfolio.query.filter_by(user_id=user_id).first()
+CENTS = Decimal('0.01')
+
+def effective_credit_limit(portfolio, now=None):
+    """The portfolio's cached subscription credit limit until it expires, then the free tier limit"""
+    expires_at = portfolio.credit_limit_expires_at
+    if portfolio.credit_limit is not None and expires_at and expires_at > (now or datetime.utcnow()):
+        return float(portfolio.credit_limit)
+    return FREE_TIER_LIMIT
+
+def current_invested_value(portfolio):
+    """The portfolio's maintained invested value; backfilled from its holdings for portfolios created without one"""
+    if portfolio.invested_value is None:
+        portfolio.invested_value = sum((h.quantity * h.avg_price for h in portfolio.holdings), Decimal('0'))
+    return portfolio.invested_value
+
+def check_trading_limit(portfolio, amount_change, is_sell=False):
     if not portfolio:
-        # If no portfolio exists, it means the user hasn't initialized yet.
-        # The trading limit check should probably happen *after* initialization.
-        # For now, let's assume an uninitialized portfolio allows the first trade within free tier.
-        # This might need refinement based on exact app logic.
+        # An uninitialized portfolio allows the first trade within the free tier
         return True, None
-    
-    # Calculate current total value including cash and holdings
-    current_total_value = portfolio.cash_balance
-    for holding in portfolio.holdings:
-        current_total_value += holding.quantity * holding.avg_price
-
-    # Calculate the new total value after the proposed transaction
-    # For a buy, amount_change is positive, so it adds to value
-    # For a sell, amount_change is positive (amount received), but it should be subtracted from value if it's considered for limit
-    # Assuming amount_change here is the value of the transaction (e.g., quantity * price)
-    
-    new_total_value = current_total_value
-    if not is_sell: # Buying
-        new_total_value = current_total_value + amount_change
-    # If selling, the limit applies to the *total value* of holdings you can *have*, not what you can sell to free up cash.
-    # So selling reducing total value is fine, unless the remaining portfolio exceeds the limit, which is unlikely
-    # For simplicity, we'll only check the limit on buying/increasing portfolio value.
-
-    # Get the user's current subscription limit
-    # This part needs to be refined. If subscription logic is in main.py, it needs to be passed or re-implemented here.
-    # For now, use the free tier limit.
-    limit = FREE_TIER_LIMIT # This should come from user's subscription or default
-    
-    subscription = Subscription.query.filter_by(user_id=user_id).first()
-    if subscription and subscription.expires_at > datetime.utcnow():
-        limit = float(subscription.credit_limit)
 
+    # Total value is cash plus the cost of holdings, both kept on the portfolio row.
+    # Only buys are checked: selling never raises the total value.
+    new_total_value = portfolio.cash_balance + current_invested_value(portfolio)
+    if not is_sell:
+        new_total_value += amount_change
+
+    limit = effective_credit_limit(portfolio)
     if new_total_value > limit:
         return False, f"Trading limit exceeded. Current limit: ₹{limit:,.2f}"
-    
+
     return True, None
 
+def new_portfolio(user_id):
+    """Add a portfolio with the initial virtual funds and the user's current credit limit"""
+    portfolio = Portfolio(user_id=user_id, cash_balance=Decimal(str(FREE_TIER_LIMIT)), invested_value=Decimal('0'))
+    subscription = (Subscription.query.filter_by(user_id=user_id)
+                    .order_by(Subscription.expires_at.desc()).first())
+    if subscription:
+        portfolio.credit_limit = subscription.credit_limit
+        portfolio.credit_limit_expires_at = subscription.expires_at
+    db.session.add(portfolio)
+    return portfolio
+
+@event.listens_for(Subscription, 'after_insert')
+@event.listens_for(Subscription, 'after_update')
+def cache_credit_limit(mapper, connection, subscription):
+    """Copy a subscription's credit limit onto the user's portfolio, unless a later-expiring one is there"""
+    table = Portfolio.__table__
+    connection.execute(
+        table.update()
+        .where(table.c.user_id == subscription.user_id)
+        .where(or_(table.c.credit_limit_expires_at.is_(None),
+                   table.c.credit_limit_expires_at <= subscription.expires_at))
+        .values(credit_limit=subscription.credit_limit, credit_limit_expires_at=subscription.expires_at)
+    )
+
 # Decorator to check trading limits and ensure user is authenticated
 def trading_limit_required(f):
     @wraps(f)
@@ -79,8 +99,7 @@ def initialize_portfolio():
         return jsonify({'message': 'Portfolio already exists', 'portfolio': portfolio.to_dict()})
     
     # Create new portfolio with initial virtual funds
-    portfolio = Portfolio(user_id=user_id, cash_balance=Decimal(str(FREE_TIER_LIMIT)))
-    db.session.add(portfolio)
+    portfolio = new_portfolio(user_id)
     db.session.commit()
     
     return jsonify({
@@ -97,8 +116,7 @@ def get_balance():
     # Auto-initialize portfolio if not found
         # This should ideally be handled by the frontend calling /initialize explicitly once
         # For robustness, we can create it here if it doesn't exist, but it's better if the frontend manages it
-        portfolio = Portfolio(user_id=user_id, cash_balance=Decimal(str(FREE_TIER_LIMIT)))
-        db.session.add(portfolio)
+        portfolio = new_portfolio(user_id)
         db.session.commit()
         return jsonify({'cash_balance': float(portfolio.cash_balance)})
 
@@ -112,63 +130,208 @@ def get_holdings():
     if not portfolio:
         return jsonify({'holdings': []})
 
-    return jsonify({'holdings': [h.to_dict() for h in portfolio.holdings]})
+    holdings = [h.to_dict() for h in portfolio.holdings]
+    if valuation.portfolio_valuer is not None:
+        # Add current price, market value, P&L and day change to each holding
+        valued = {h['symbol']: h for h in valuation.portfolio_valuer.value_user(user_id)['holdings']}
+        for holding in holdings:
+            holding.update(valued.get(holding['symbol'], {}))
+    return jsonify({'holdings': holdings})
+
+class TradeError(Exception):
+    """A trade that cannot be executed; carries the HTTP status to return"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+# Attempts at a holding update before giving up on a trade that keeps losing races
+MAX_TRADE_ATTEMPTS = 5
+TRADE_CONFLICT = 'Too many concurrent trades on this holding. Please try again.'
+TRADE_CONFLICT_STATUS = 409
+
+_UPSERT_DIALECTS = {
+    'sqlite': sqlite_insert,
+    'postgresql': postgresql_insert
+}
+
+def _holding_state(portfolio_id, symbol):
+    # Plain columns rather than a Holding, so a retry never sees the identity map's stale copy
+    return (db.session.query(Holding.id, Holding.quantity, Holding.avg_price, Holding.version)
+            .filter_by(portfolio_id=portfolio_id, symbol=symbol).first())
+
+def _update_holding(holding, **values):
+    """Versioned UPDATE of a holding; False when another trade changed it since it was read"""
+    result = db.session.execute(
+        db.update(Holding)
+        .where(Holding.id == holding.id, Holding.version == holding.version)
+        .values(version=Holding.version + 1, **values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def _insert_holding(portfolio_id, symbol, quantity, avg_price):
+    """Insert a new holding; False when another trade inserted it first"""
+    row = {
+        'portfolio_id': portfolio_id, 'symbol': symbol, 'quantity': quantity, 'avg_price': avg_price,
+        'version': 0, 'created_at': datetime.utcnow()
+    }
+    insert = _UPSERT_DIALECTS.get(db.engine.dialect.name)
+    if insert is None:
+        # No native upsert: a lost race surfaces as an IntegrityError for the caller
+        db.session.execute(Holding.__table__.insert().values(row))
+        return True
+    stmt = insert(Holding.__table__).values(row).on_conflict_do_nothing(index_elements=['portfolio_id', 'symbol'])
+    return db.session.execute(stmt).rowcount == 1
+
+def _add_to_holding(portfolio_id, symbol, quantity, price):
+    """Add quantity bought at price to the holding; returns the change in invested value"""
+    total_cost = quantity * price
+    for _ in range(MAX_TRADE_ATTEMPTS):
+        holding = _holding_state(portfolio_id, symbol)
+        if holding is None:
+            avg_price = price.quantize(CENTS)
+            if _insert_holding(portfolio_id, symbol, quantity, avg_price):
+                return quantity * avg_price
+        else:
+            new_quantity = holding.quantity + quantity
+            new_avg_price = (((holding.quantity * holding.avg_price) + total_cost) / new_quantity).quantize(CENTS)
+            if _update_holding(holding, quantity=new_quantity, avg_price=new_avg_price):
+                return new_quantity * new_avg_price - holding.quantity * holding.avg_price
+    raise TradeError(TRADE_CONFLICT, TRADE_CONFLICT_STATUS)
+
+def _remove_from_holding(portfolio_id, symbol, quantity):
+    """Take quantity sold out of the holding; returns the change in invested value"""
+    for _ in range(MAX_TRADE_ATTEMPTS):
+        holding = _holding_state(portfolio_id, symbol)
+        if not holding or holding.quantity < quantity:
+            raise TradeError('Insufficient shares to sell')
+        remaining = holding.quantity - quantity
+        if _update_holding(holding, quantity=remaining):
+            if remaining == 0:
+                # Unless a buy has topped it up again in the meantime
+                db.session.execute(
+                    db.delete(Holding)
+                    .where(Holding.id == holding.id, Holding.quantity == 0)
+                    .execution_options(synchronize_session=False)
+                )
+            return -(quantity * holding.avg_price)
+    raise TradeError(TRADE_CONFLICT, TRADE_CONFLICT_STATUS)
+
+def _debit_portfolio(portfolio, total_cost, invested_change, check_limit=True):
+    """Pay for a buy in one conditional UPDATE that re-checks cash and (optionally) the trading limit"""
+    limit = effective_credit_limit(portfolio)
+    conditions = [Portfolio.id == portfolio.id, Portfolio.cash_balance >= total_cost]
+    if check_limit:
+        conditions.append(Portfolio.cash_balance + Portfolio.invested_value + total_cost <= Decimal(str(limit)))
+    result = db.session.execute(
+        db.update(Portfolio)
+        .where(*conditions)
+        .values(cash_balance=Portfolio.cash_balance - total_cost,
+                invested_value=Portfolio.invested_value + invested_change)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        cash_balance = db.session.query(Portfolio.cash_balance).filter_by(id=portfolio.id).scalar()
+        if cash_balance is not None and cash_balance < total_cost:
+            raise TradeError('Insufficient cash balance')
+        raise TradeError(f"Trading limit exceeded. Current limit: ₹{limit:,.2f}")
+
+def _credit_portfolio(portfolio, proceeds, invested_change):
+    db.session.execute(
+        db.update(Portfolio)
+        .where(Portfolio.id == portfolio.id)
+        .values(cash_balance=Portfolio.cash_balance + proceeds,
+                invested_value=Portfolio.invested_value + invested_change)
+        .execution_options(synchronize_session=False)
+    )
+
+def execute_trade(user_id, symbol, side, quantity, price, commit=True):
+    """Buy or sell quantity of symbol at price (a Decimal) for a user and record the transaction.
+
+    Used by the buy/sell routes and for order fills. Returns (portfolio,
+    transaction); raises TradeError when the trade is not allowed. With
+    commit=False the changes are only flushed, so the caller can commit them
+    together with its own (or roll back on error) and then invalidate the
+    user's valuation.
+
+    Nothing is read, changed in Python and written back. The holding is
+    changed with a versioned UPDATE (or an insert that yields to a
+    concurrent one) and retried on a lost race. Cash and invested value
+    then move in one conditional UPDATE that only succeeds while the cash
+    and the trading limit still allow the trade. Concurrent trades by one
+    user therefore neither block each other nor overdraw.
+    """
+    if quantity <= 0 or price <= 0:
+        raise TradeError('Quantity and price must be positive')
+
+    try:
+        portfolio = Portfolio.query.filter_by(user_id=user_id).first()
+        if side == 'buy':
+            total_cost = quantity * price
+
+            # Cheap early checks against the row as read; the UPDATE below is what enforces them
+            can_trade, error_msg = check_trading_limit(portfolio, total_cost, is_sell=False)
+            if not can_trade:
+                raise TradeError(error_msg)
+
+            # As in check_trading_limit, the first trade of an uninitialized portfolio is not limit checked
+            check_limit = portfolio is not None
+            if not portfolio:
+                # This case should ideally be handled by frontend calling /initialize first
+                # But if it happens, auto-initialize with free tier limit
+                portfolio = new_portfolio(user_id)
+
+            if portfolio.cash_balance < total_cost:
+                raise TradeError('Insufficient cash balance')
+
+            current_invested_value(portfolio)
+            db.session.flush()
+            invested_change = _add_to_holding(portfolio.id, symbol, quantity, price)
+            _debit_portfolio(portfolio, total_cost, invested_change, check_limit)
+        else:
+            if not portfolio:
+                raise TradeError('Portfolio not found', 404)
+
+            current_invested_value(portfolio)
+            db.session.flush()
+            invested_change = _remove_from_holding(portfolio.id, symbol, quantity)
+            _credit_portfolio(portfolio, quantity * price, invested_change)
+        db.session.expire(portfolio, ['cash_balance', 'invested_value', 'holdings'])
+
+        transaction = Transaction(
+            user_id=user_id,
+            symbol=symbol,
+            quantity=quantity,
+            price=price,
+            type=side
+        )
+        db.session.add(transaction)
+        db.session.flush()
+    except Exception:
+        if commit:
+            db.session.rollback()
+        raise
+    if commit:
+        db.session.commit()
+        valuation.invalidate(user_id)
+    return portfolio, transaction
 
 @portfolio_bp.route('/buy', methods=['POST'])
 @trading_limit_required
 def buy_stock():
     user_id = get_user_id()
     data = request.json
-    symbol = data.get('symbol')
-    quantity = int(data.get('quantity', 0))
-    price = Decimal(str(data.get('price', 0)))
-    
-    if quantity <= 0 or price <= 0:
-        return jsonify({'error': 'Quantity and price must be positive'}), 400
-    
-    total_cost = quantity * price
-    
-    can_trade, error_msg = check_trading_limit(user_id, total_cost, is_sell=False)
-    if not can_trade:
-        return jsonify({'error': error_msg}), 400
+    try:
+        portfolio, transaction = execute_trade(
+            user_id, data.get('symbol'), 'buy', int(data.get('quantity', 0)), Decimal(str(data.get('price', 0)))
+        )
+    except TradeError as e:
+        return jsonify({'error': str(e)}), e.status_code
 
-    portfolio = Portfolio.query.filter_by(user_id=user_id).first()
-    if not portfolio:
-        # This case should ideally be handled by frontend calling /initialize first
-        # But if it happens, auto-initialize with free tier limit
-        portfolio = Portfolio(user_id=user_id, cash_balance=Decimal(str(FREE_TIER_LIMIT)))
-        db.session.add(portfolio)
-        db.session.commit()
-        db.session.refresh(portfolio) # Refresh to get the newly created portfolio object
-
-    if portfolio.cash_balance < total_cost:
-        return jsonify({'error': 'Insufficient cash balance'}), 400
-
-    holding = Holding.query.filter_by(portfolio_id=portfolio.id, symbol=symbol).first()
-    if holding:
-        new_quantity = holding.quantity + quantity
-        new_avg_price = ((holding.quantity * holding.avg_price) + total_cost) / new_quantity
-        holding.quantity = new_quantity
-        holding.avg_price = new_avg_price
-    else:
-        holding = Holding(portfolio_id=portfolio.id, symbol=symbol, quantity=quantity, avg_price=price)
-        db.session.add(holding)
-
-    portfolio.cash_balance -= total_cost
-
-    transaction = Transaction(
-        user_id=user_id,
-        symbol=symbol,
-        quantity=quantity,
-        price=price,
-        type='buy'
-    )
-    db.session.add(transaction)
-    db.session.commit()
-    
     return jsonify({
         'message': 'Stock purchased successfully',
-        'portfolio': portfolio.to_dict(),
+        'portfolio': portfolio.to_dict(include_holdings=False),
         'transaction': transaction.to_dict()
     })
 
@@ -177,40 +340,16 @@ def buy_stock():
 def sell_stock():
     user_id = get_user_id()
     data = request.json
-    symbol = data.get('symbol')
-    quantity_to_sell = int(data.get('quantity', 0))
-    price = Decimal(str(data.get('price', 0)))
-
-    if quantity_to_sell <= 0 or price <= 0:
-        return jsonify({'error': 'Quantity and price must be positive'}), 400
+    try:
+        portfolio, transaction = execute_trade(
+            user_id, data.get('symbol'), 'sell', int(data.get('quantity', 0)), Decimal(str(data.get('price', 0)))
+        )
+    except TradeError as e:
+        return jsonify({'error': str(e)}), e.status_code
 
-    portfolio = Portfolio.query.filter_by(user_id=user_id).first()
-    if not portfolio:
-        return jsonify({'error': 'Portfolio not found'}), 404
-    
-    holding = Holding.query.filter_by(portfolio_id=portfolio.id, symbol=symbol).first()
-    if not holding or holding.quantity < quantity_to_sell:
-        return jsonify({'error': 'Insufficient shares to sell'}), 400
-
-    holding.quantity -= quantity_to_sell
-    portfolio.cash_balance += (quantity_to_sell * price)
-
-    if holding.quantity == 0:
-        db.session.delete(holding)
-
-    transaction = Transaction(
-        user_id=user_id,
-        symbol=symbol,
-        quantity=quantity_to_sell,
-        price=price,
-        type='sell'
-    )
-    db.session.add(transaction)
-    db.session.commit()
-    
     return jsonify({
         'message': 'Stock sold successfully',
-        'portfolio': portfolio.to_dict(),
+        'portfolio': portfolio.to_dict(include_holdings=False),
         'transaction': transaction.to_dict()
     })
 
@@ -250,8 +389,7 @@ def reset_portfolio():
         db.session.commit()
 
     # Re-create portfolio with initial virtual funds
-    portfolio = Portfolio(user_id=user_id, cash_balance=Decimal(str(FREE_TIER_LIMIT)))
-    db.session.add(portfolio)
+    portfolio = new_portfolio(user_id)
     db.session.commit()
 
     # Optionally, delete all past transactions for the user as well on reset
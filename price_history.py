@@ -0,0 +1,145 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from backend.models import db, HistoricalPrice
+
+# Alpha Vantage 'compact' returns the latest 100 bars; beyond ~140 calendar
+# days of gap we need 'full' to be sure nothing is skipped
+COMPACT_WINDOW_DAYS = 140
+UPSERT_CHUNK_SIZE = 500
+IST_OFFSET = timedelta(hours=5, minutes=30)
+
+_UPSERT_DIALECTS = {
+    'sqlite': sqlite_insert,
+    'postgresql': postgresql_insert
+}
+
+
+def market_today():
+    """Today's date in India, where the exchanges are"""
+    return (datetime.utcnow() + IST_OFFSET).date()
+
+
+def expected_latest_bar(today=None):
+    """The most recent weekday, i.e. the newest daily bar there could be"""
+    day = today or market_today()
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+
+def parse_daily_series(time_series):
+    """Convert an Alpha Vantage 'Time Series (Daily)' dict into bars sorted by date"""
+    bars = []
+    for date_str in sorted(time_series):
+        bar = time_series[date_str]
+        bars.append({
+            'date': datetime.strptime(date_str, '%Y-%m-%d').date(),
+            'open': Decimal(bar['1. open']),
+            'high': Decimal(bar['2. high']),
+            'low': Decimal(bar['3. low']),
+            'close': Decimal(bar.get('4. close', bar.get('5. adjusted close'))),
+            'volume': int(bar.get('6. volume', bar.get('5. volume', 0)))
+        })
+    return bars
+
+
+def latest_stored_date(symbol):
+    return db.session.query(db.func.max(HistoricalPrice.date)).filter_by(symbol=symbol).scalar()
+
+
+def upsert_bars(symbol, bars):
+    """Insert bars for symbol, overwriting any stored bar for the same date"""
+    if not bars:
+        return 0
+    now = datetime.utcnow()
+    rows = [dict(bar, symbol=symbol, created_at=now) for bar in bars]
+
+    insert = _UPSERT_DIALECTS.get(db.engine.dialect.name)
+    if insert is not None:
+        for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+            stmt = insert(HistoricalPrice.__table__).values(rows[start:start + UPSERT_CHUNK_SIZE])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['symbol', 'date'],
+                set_={column: stmt.excluded[column] for column in ('open', 'high', 'low', 'close', 'volume')}
+            )
+            db.session.execute(stmt)
+    else:
+        # No native upsert: update what exists and bulk insert the rest
+        existing = {
+            price.date: price for price in
+            HistoricalPrice.query.filter(
+                HistoricalPrice.symbol == symbol,
+                HistoricalPrice.date >= rows[0]['date']
+            )
+        }
+        new_rows = []
+        for row in rows:
+            price = existing.get(row['date'])
+            if price is None:
+                new_rows.append(row)
+            else:
+                for column in ('open', 'high', 'low', 'close', 'volume'):
+                    setattr(price, column, row[column])
+        db.session.bulk_insert_mappings(HistoricalPrice, new_rows)
+    db.session.commit()
+    return len(rows)
+
+
+def sync_daily_history(symbol, fetch_series):
+    """Bring stored daily bars for symbol up to date, fetching only the missing tail.
+
+    fetch_series(symbol, outputsize) must return the 'Time Series (Daily)'
+    dict. Returns the number of bars written (0 when already current). A bar
+    stored for today may still be forming, so it is always re-fetched; callers
+    decide how often that is worth doing.
+    """
+    last = latest_stored_date(symbol)
+    if last is not None and expected_latest_bar() <= last < market_today():
+        return 0
+
+    if last is None or (market_today() - last).days > COMPACT_WINDOW_DAYS:
+        outputsize = 'full'
+    else:
+        outputsize = 'compact'
+
+    bars = parse_daily_series(fetch_series(symbol, outputsize))
+    if last is not None:
+        # Re-write the last stored bar too; it may have been taken intraday
+        bars = [bar for bar in bars if bar['date'] >= last]
+    written = upsert_bars(symbol, bars)
+    print(f"Stored {written} daily bars for {symbol} ({outputsize})")
+    return written
+
+
+def export_to_store(store, symbol):
+    """Append stored daily bars for symbol that the columnar store does not have yet.
+
+    The last bar already in the store is re-exported so a bar taken intraday
+    is replaced by its final values. Returns the number of bars written.
+    """
+    query = db.session.query(
+        HistoricalPrice.date, HistoricalPrice.open, HistoricalPrice.high,
+        HistoricalPrice.low, HistoricalPrice.close, HistoricalPrice.volume
+    ).filter(HistoricalPrice.symbol == symbol)
+    last_ts = store.last_timestamp(symbol)
+    if last_ts is not None:
+        query = query.filter(HistoricalPrice.date >= datetime.utcfromtimestamp(last_ts).date())
+    rows = query.order_by(HistoricalPrice.date).all()
+    if not rows:
+        return 0
+
+    epoch = date(1970, 1, 1)
+    return store.append(symbol, {
+        'ts': np.array([(row.date - epoch).days * 86400 for row in rows], dtype=np.int64),
+        'open': np.array([float(row.open) for row in rows]),
+        'high': np.array([float(row.high) for row in rows]),
+        'low': np.array([float(row.low) for row in rows]),
+        'close': np.array([float(row.close) for row in rows]),
+        'volume': np.array([int(row.volume or 0) for row in rows], dtype=np.int64)
+    })
@@ -0,0 +1,231 @@
+import contextvars
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+
+# Priority classes: user-facing requests are served before background refreshes
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BACKGROUND = 'background'
+
+_current_priority = contextvars.ContextVar('upstream_priority', default=PRIORITY_INTERACTIVE)
+
+
+class QuotaExceeded(Exception):
+    """Raised when an upstream call cannot be admitted within the provider's budget"""
+
+
+@contextmanager
+def background_priority():
+    """Mark upstream calls made inside this block as background work"""
+    token = _current_priority.set(PRIORITY_BACKGROUND)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority():
+    return _current_priority.get()
+
+
+class ProviderQuota:
+    """Token bucket with a per-minute rate and an optional daily cap for one provider.
+
+    Background callers may not dip into the last background_reserve share of
+    either budget and always yield to waiting interactive callers, so sector
+    refreshes can never starve a user's quote request. With a store, the
+    bucket itself lives there and is shared by every worker process; the
+    priority bookkeeping stays per process.
+    """
+
+    def __init__(self, name, per_minute, per_day=None, background_reserve=0.2, store=None):
+        self.name = name
+        self.per_minute = per_minute
+        self.per_day = per_day or None
+        self.background_reserve = background_reserve
+        self.tokens = float(per_minute)
+        self._rate = per_minute / 60.0
+        self._last_refill = time.monotonic()
+        self._day = date.today()
+        self.used_today = 0
+        self.granted = {PRIORITY_INTERACTIVE: 0, PRIORITY_BACKGROUND: 0}
+        self.rejected = {PRIORITY_INTERACTIVE: 0, PRIORITY_BACKGROUND: 0}
+        self._waiting_interactive = 0
+        self._cond = threading.Condition()
+        self.store = store
+        if store is not None:
+            store.register(name, per_minute)
+
+    def _refill(self, now):
+        self.tokens = min(self.per_minute, self.tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+        today = date.today()
+        if today != self._day:
+            self._day = today
+            self.used_today = 0
+
+    def _daily_floor(self, priority):
+        if self.per_day is None:
+            return None
+        return 0 if priority == PRIORITY_INTERACTIVE else self.per_day * self.background_reserve
+
+    def _take(self, minute_floor, daily_floor, spend):
+        """Spend one token if spend and the floors allow it; returns (granted, tokens, used_today)"""
+        daily_limit = None if daily_floor is None else self.per_day - daily_floor
+        if self.store is not None:
+            try:
+                return self.store.take(self.name, self.per_minute, minute_floor, daily_limit, spend)
+            except sqlite3.Error as e:
+                print(f"Shared quota unavailable for {self.name}, using this worker's bucket: {e}")
+        self._refill(time.monotonic())
+        if spend and self.tokens - 1 >= minute_floor and (daily_limit is None or self.used_today < daily_limit):
+            self.tokens -= 1
+            self.used_today += 1
+            return True, self.tokens, self.used_today
+        return False, self.tokens, self.used_today
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE, timeout=None):
+        """Take one call from the budget, waiting up to timeout seconds for a token"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interactive = priority == PRIORITY_INTERACTIVE
+        minute_floor = 0 if interactive else self.per_minute * self.background_reserve
+
+        with self._cond:
+            if interactive:
+                self._waiting_interactive += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    daily_floor = self._daily_floor(priority)
+                    yielding = not interactive and self._waiting_interactive > 0
+                    granted, tokens, used_today = self._take(minute_floor, daily_floor, spend=not yielding)
+                    if granted:
+                        self.granted[priority] += 1
+                        return
+                    if daily_floor is not None and self.per_day - used_today <= daily_floor:
+                        self.rejected[priority] += 1
+                        raise QuotaExceeded(f"{self.name} daily budget exhausted")
+
+                    wait = (minute_floor + 1 - tokens) / self._rate if not yielding else 0.05
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            self.rejected[priority] += 1
+                            raise QuotaExceeded(f"{self.name} per-minute budget exhausted")
+                        wait = min(wait, remaining)
+                    self._cond.wait(max(wait, 0.01))
+            finally:
+                if interactive:
+                    self._waiting_interactive -= 1
+                    self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            _, tokens, used_today = self._take(0, None, spend=False)
+            return {
+                'per_minute': self.per_minute,
+                'remaining_this_minute': int(tokens),
+                'per_day': self.per_day,
+                'used_today': used_today,
+                'remaining_today': self.per_day - used_today if self.per_day is not None else None,
+                'granted': dict(self.granted),
+                'rejected': dict(self.rejected),
+                'waiting_interactive': self._waiting_interactive
+            }
+
+
+class SQLiteQuotaStore:
+    """Token buckets shared by every worker on a host through one SQLite WAL file.
+
+    A take is one conditional UPDATE that refills the bucket from wall-clock
+    time and spends a token only while the caller's floors allow it, so
+    workers racing for the last token cannot both get it. Connections are
+    opened lazily per thread (and per process after a fork).
+    """
+
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS quota_buckets ('
+            'name TEXT PRIMARY KEY, tokens REAL NOT NULL, refilled_at REAL NOT NULL, '
+            'day TEXT NOT NULL, used_today INTEGER NOT NULL)'
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def register(self, name, per_minute):
+        """Create a full bucket for name unless another worker already has"""
+        self._connection().execute(
+            'INSERT OR IGNORE INTO quota_buckets (name, tokens, refilled_at, day, used_today) VALUES (?, ?, ?, ?, 0)',
+            (name, float(per_minute), time.time(), date.today().isoformat())
+        )
+
+    def take(self, name, per_minute, minute_floor, daily_limit, spend):
+        """Spend one token if spend and the floors allow it; returns (granted, tokens, used_today)"""
+        params = {
+            'name': name, 'cap': float(per_minute), 'rate': per_minute / 60.0, 'now': time.time(),
+            'today': date.today().isoformat(), 'floor': minute_floor, 'daily_limit': daily_limit
+        }
+        refilled = 'min(:cap, tokens + max(:now - refilled_at, 0) * :rate)'
+        used = 'CASE WHEN day = :today THEN used_today ELSE 0 END'
+        conn = self._connection()
+        if spend:
+            granted = conn.execute(
+                f'UPDATE quota_buckets SET tokens = {refilled} - 1, refilled_at = :now, '
+                f'used_today = {used} + 1, day = :today '
+                f'WHERE name = :name AND {refilled} - 1 >= :floor '
+                f'AND (:daily_limit IS NULL OR {used} < :daily_limit)',
+                params
+            ).rowcount == 1
+            if granted:
+                row = conn.execute('SELECT tokens, used_today FROM quota_buckets WHERE name = :name', params).fetchone()
+                return True, row[0], row[1]
+        row = conn.execute(f'SELECT {refilled}, {used} FROM quota_buckets WHERE name = :name', params).fetchone()
+        return False, row[0], row[1]
+
+
+def create_quota_store(config):
+    """Build the bucket store selected by UPSTREAM_QUOTA_BACKEND ('sqlite' or 'memory')"""
+    backend = config.get('UPSTREAM_QUOTA_BACKEND', 'sqlite')
+    if backend == 'memory':
+        return None
+    if backend == 'sqlite':
+        path = config.get('UPSTREAM_QUOTA_PATH') or os.path.join(tempfile.gettempdir(), 'virtualtrade_quota.db')
+        return SQLiteQuotaStore(path)
+    raise ValueError(f"Unknown UPSTREAM_QUOTA_BACKEND: {backend}")
+
+
+class QuotaManager:
+    """Registry of per-provider upstream budgets, shared across workers when given a store"""
+
+    # How long a caller of each priority will queue for a token
+    WAIT_TIMEOUTS = {PRIORITY_INTERACTIVE: 10, PRIORITY_BACKGROUND: 60}
+
+    def __init__(self, store=None):
+        self.providers = {}
+        self.store = store
+
+    def add_provider(self, name, per_minute, per_day=None, background_reserve=0.2):
+        self.providers[name] = ProviderQuota(name, per_minute, per_day, background_reserve, store=self.store)
+
+    def acquire(self, provider, priority=None):
+        """Admit one call to provider at the caller's priority or raise QuotaExceeded"""
+        priority = priority or current_priority()
+        self.providers[provider].acquire(priority, timeout=self.WAIT_TIMEOUTS[priority])
+
+    def stats(self):
+        return {name: quota.stats() for name, quota in self.providers.items()}
@@ -0,0 +1,262 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# Quote payloads keep their fields under this key, as GLOBAL_QUOTE does
+QUOTE_KEY = 'Global Quote'
+
+
+class QuoteMessage:
+    """A snapshot or delta for one symbol's quote.
+
+    A snapshot carries the full quote payload (the /quote schema) at seq. A
+    delta carries only the quote fields that changed since base_seq, with
+    None for removed fields; a client applies it only when its copy of the
+    symbol is at base_seq, and otherwise resyncs from a snapshot.
+    """
+
+    __slots__ = ('type', 'symbol', 'seq', 'base_seq', 'payload', '_encoded')
+
+    def __init__(self, type, symbol, seq, payload, base_seq=None):
+        self.type = type
+        self.symbol = symbol
+        self.seq = seq
+        self.base_seq = base_seq
+        self.payload = payload
+        self._encoded = None
+
+    def to_dict(self):
+        if self.type == 'snapshot':
+            return {'symbol': self.symbol, 'seq': self.seq, 'data': self.payload}
+        return {'symbol': self.symbol, 'seq': self.seq, 'base_seq': self.base_seq, 'changes': self.payload}
+
+    def encoded(self):
+        """Compact JSON, serialized once however many clients it is sent to"""
+        if self._encoded is None:
+            self._encoded = json.dumps(self.to_dict(), separators=(',', ':'))
+        return self._encoded
+
+    def merge(self, newer):
+        """One message equivalent to applying self and then newer"""
+        if newer.type == 'snapshot':
+            return newer
+        if self.type == 'snapshot':
+            fields = dict(self.payload.get(QUOTE_KEY, {}))
+            fields.update(newer.payload)
+            fields = {k: v for k, v in fields.items() if v is not None}
+            return QuoteMessage('snapshot', self.symbol, newer.seq, dict(self.payload, **{QUOTE_KEY: fields}))
+        return QuoteMessage('delta', self.symbol, newer.seq, dict(self.payload, **newer.payload), self.base_seq)
+
+
+def quote_delta(old, new):
+    """Changed quote fields between two quote payloads, None marking removed ones"""
+    old_fields = old.get(QUOTE_KEY, {})
+    new_fields = new.get(QUOTE_KEY, {})
+    changes = {k: v for k, v in new_fields.items() if old_fields.get(k) != v}
+    changes.update({k: None for k in old_fields if k not in new_fields})
+    return changes
+
+
+def _envelope(payload):
+    return {k: v for k, v in payload.items() if k != QUOTE_KEY}
+
+
+class Subscriber:
+    """One streaming client's view of the quote hub.
+
+    Pending messages are conflated per symbol: if the client falls behind,
+    a newer message is merged into the one it has not read yet instead of
+    queueing behind it (deltas combine, a delta folds into a pending
+    snapshot), so a slow client costs at most one pending message per
+    symbol and its chain of sequence numbers stays unbroken.
+    """
+
+    def __init__(self, symbols):
+        self.symbols = tuple(dict.fromkeys(symbols))
+        self.conflated = 0
+        self.closed = False
+        self._pending = OrderedDict()
+        self._ready = threading.Condition()
+
+    def push(self, symbol, message):
+        with self._ready:
+            pending = self._pending.pop(symbol, None)
+            if pending is not None:
+                self.conflated += 1
+                message = pending.merge(message)
+            self._pending[symbol] = message
+            self._ready.notify()
+
+    def next(self, timeout=None):
+        """Wait up to timeout seconds and return the pending [(symbol, QuoteMessage)], oldest first"""
+        with self._ready:
+            if not self._pending and not self.closed:
+                self._ready.wait(timeout)
+            updates = list(self._pending.items())
+            self._pending.clear()
+            return updates
+
+    def close(self):
+        with self._ready:
+            self.closed = True
+            self._ready.notify()
+
+
+class QuoteStreamHub:
+    """Fan quotes out from one poller to every streaming subscriber.
+
+    Symbols are reference counted across subscribers; while a symbol has any
+    subscriber the hub polls it once every interval through fetch_many. A
+    new subscriber is sent a snapshot of each symbol, and after that only
+    deltas of the fields that changed. Sequence numbers come from one
+    counter per hub, so they only ever increase for a symbol. Upstream load
+    therefore depends on how many symbols are watched, not on how many
+    clients. fetch_many(symbols) returns {symbol: quote}, omitting symbols it
+    could not fetch; quotes go through the shared market cache, so workers on
+    the same host poll a symbol at most once per cache period between them.
+    Without fetch_many the hub never polls and only fans out what is passed
+    to publish().
+    """
+
+    def __init__(self, fetch_many, interval=15, max_subscribers=500):
+        self.fetch_many = fetch_many
+        self.interval = interval
+        self.max_subscribers = max_subscribers
+        self._refcounts = {}
+        self._subscribers = {}
+        self._latest = {}
+        self.listeners = []
+        self._seq = 0
+        self._polls = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _retain(self, symbols):
+        """Count one more watcher of symbols; returns whether any was not watched yet (lock held)"""
+        new_symbols = False
+        for symbol in symbols:
+            if symbol not in self._refcounts:
+                self._refcounts[symbol] = 0
+                new_symbols = True
+            self._refcounts[symbol] += 1
+        return new_symbols
+
+    def _release(self, symbols):
+        for symbol in symbols:
+            self._refcounts[symbol] -= 1
+            if not self._refcounts[symbol]:
+                del self._refcounts[symbol]
+                self._latest.pop(symbol, None)
+
+    def _polled(self, new_symbols):
+        self._start()
+        if new_symbols:
+            # Poll a newly watched symbol now rather than at the next interval
+            self._wake.set()
+
+    def subscribe(self, symbols):
+        """Register a subscriber for symbols; it is sent a snapshot of each known quote right away.
+
+        Returns None when the hub is already at max_subscribers.
+        """
+        subscriber = Subscriber(symbols)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            self._subscribers[id(subscriber)] = subscriber
+            new_symbols = self._retain(subscriber.symbols)
+            for symbol in subscriber.symbols:
+                if symbol in self._latest:
+                    subscriber.push(symbol, self._latest[symbol])
+        self._polled(new_symbols)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if self._subscribers.pop(id(subscriber), None) is None:
+                return
+            self._release(subscriber.symbols)
+        subscriber.close()
+
+    def watch(self, symbol):
+        """Keep symbol polled without a subscriber, e.g. for listeners; undo with unwatch()"""
+        with self._lock:
+            new_symbols = self._retain([symbol])
+        self._polled(new_symbols)
+
+    def unwatch(self, symbol):
+        with self._lock:
+            if symbol in self._refcounts:
+                self._release([symbol])
+
+    def add_listener(self, listener):
+        """Call listener(symbol, quote) with every quote published to subscribers"""
+        self.listeners.append(listener)
+
+    def publish(self, symbol, quote):
+        """Push the fields of quote that changed to the symbol's subscribers"""
+        with self._lock:
+            if symbol not in self._refcounts:
+                return
+            previous = self._latest.get(symbol)
+            if previous is not None and previous.payload == quote:
+                return
+            self._seq += 1
+            message = self._latest[symbol] = QuoteMessage('snapshot', symbol, self._seq, quote)
+            # Deltas describe quote fields; anything else changing needs a snapshot
+            if previous is not None and _envelope(previous.payload) == _envelope(quote):
+                message = QuoteMessage('delta', symbol, self._seq, quote_delta(previous.payload, quote), previous.seq)
+            subscribers = [s for s in self._subscribers.values() if symbol in s.symbols]
+        for subscriber in subscribers:
+            subscriber.push(symbol, message)
+        for listener in self.listeners:
+            try:
+                listener(symbol, quote)
+            except Exception as e:
+                print(f"Quote listener failed for {symbol}: {e}")
+
+    def snapshot(self, symbols):
+        """Latest snapshot QuoteMessage of each watched symbol in symbols, for resyncing clients"""
+        with self._lock:
+            return {symbol: self._latest[symbol] for symbol in symbols if symbol in self._latest}
+
+    def poll(self):
+        """Fetch every watched symbol once and publish the changes"""
+        with self._lock:
+            symbols = list(self._refcounts)
+        if not symbols:
+            return
+        self._polls += 1
+        try:
+            quotes = self.fetch_many(symbols)
+        except Exception as e:
+            print(f"Quote stream poll failed: {e}")
+            return
+        for symbol, quote in quotes.items():
+            self.publish(symbol, quote)
+
+    def _run(self):
+        while True:
+            started = time.time()
+            self.poll()
+            self._wake.wait(max(self.interval - (time.time() - started), 0))
+            self._wake.clear()
+
+    def _start(self):
+        if self.fetch_many is None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='quote-stream', daemon=True)
+                self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'symbols': dict(self._refcounts),
+                'polls': self._polls,
+                'conflated': sum(s.conflated for s in self._subscribers.values())
+            }
@@ -0,0 +1,160 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from quota import background_priority
+
+
+class _Job:
+    def __init__(self, key, fetch, ttl):
+        self.key = key
+        self.fetch = fetch
+        self.ttl = ttl
+        self.next_refresh = 0.0
+        self.last_access = 0.0
+        self.refreshing = False
+        self.failures = 0
+        self.refreshes = 0
+
+
+class RefreshScheduler:
+    """Keep registered hot cache keys warm with stale-while-revalidate.
+
+    Each registered key is re-fetched in the background shortly before its
+    TTL lapses, and readers are always handed the last good value together
+    with its age. Only the very first read of a key (nothing cached yet)
+    waits on the network. Keys nobody has read for idle_timeout seconds stop
+    being refreshed until they are requested again.
+
+    Values live in the shared market data cache wrapped with their fetch
+    time, so when several workers share a cache backend a worker that finds
+    a fresh value written by another simply adopts it instead of refetching.
+    """
+
+    KEY_PREFIX = 'swr_'
+
+    def __init__(self, cache, flights, refresh_ahead=0.2, stale_ttl=3600,
+                 idle_timeout=1800, workers=2, tick=1.0, retry_delay=15):
+        self.cache = cache
+        self.flights = flights
+        self.refresh_ahead = refresh_ahead
+        self.stale_ttl = stale_ttl
+        self.idle_timeout = idle_timeout
+        self.tick = tick
+        self.retry_delay = retry_delay
+        self._jobs = {}
+        self._periodic = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='market-refresh')
+        self._thread = None
+
+    def register(self, key, fetch, ttl):
+        """Register fetch() as the source for key, refreshed every ttl seconds"""
+        with self._lock:
+            self._jobs[key] = _Job(key, fetch, ttl)
+
+    def every(self, interval, fn):
+        """Run fn() on the scheduler thread every interval seconds"""
+        with self._lock:
+            self._periodic.append([interval, fn, time.time() + interval])
+
+    def get(self, key):
+        """Return (data, meta) for a registered key without waiting on a refresh"""
+        job = self._jobs[key]
+        now = time.time()
+        was_idle = now - job.last_access > self.idle_timeout
+        job.last_access = now
+
+        entry = self.cache.get(self.KEY_PREFIX + key)
+        if entry is None:
+            # Cold start: nothing to serve yet, so wait for the first fetch
+            entry = self.flights.do(self.KEY_PREFIX + key, lambda: self._refresh(job))
+        elif was_idle or now - entry['fetched_at'] >= job.ttl:
+            # The key went idle and fell out of rotation; revalidate it now
+            self._submit(job)
+
+        age = now - entry['fetched_at']
+        return entry['data'], {
+            'fetched_at': entry['fetched_at'],
+            'age': max(age, 0.0),
+            'stale': age >= job.ttl
+        }
+
+    def _submit(self, job):
+        with self._lock:
+            if job.refreshing:
+                return
+            job.refreshing = True
+        self._executor.submit(self._refresh_in_background, job)
+
+    def _refresh_in_background(self, job):
+        try:
+            with background_priority():
+                self.flights.do(self.KEY_PREFIX + job.key, lambda: self._refresh(job))
+        except Exception as e:
+            print(f"Background refresh of {job.key} failed: {e}")
+        finally:
+            job.refreshing = False
+
+    def _refresh(self, job):
+        cache_key = self.KEY_PREFIX + job.key
+        lead = job.ttl * self.refresh_ahead
+        current = self.cache.get(cache_key)
+        now = time.time()
+        if current is not None and now - current['fetched_at'] < job.ttl - lead:
+            # Another worker refreshed it recently
+            job.next_refresh = current['fetched_at'] + job.ttl - lead
+            return current
+
+        try:
+            data = job.fetch()
+            if not data and current is not None:
+                raise ValueError('upstream returned no data')
+        except Exception:
+            job.failures += 1
+            job.next_refresh = time.time() + min(job.ttl, self.retry_delay * job.failures)
+            raise
+
+        entry = {'data': data, 'fetched_at': time.time()}
+        self.cache.set(cache_key, entry, ttl=job.ttl + self.stale_ttl)
+        job.failures = 0
+        job.refreshes += 1
+        job.next_refresh = entry['fetched_at'] + job.ttl - lead
+        return entry
+
+    def _run(self):
+        while True:
+            now = time.time()
+            for job in list(self._jobs.values()):
+                if job.last_access and now - job.last_access <= self.idle_timeout and now >= job.next_refresh:
+                    self._submit(job)
+            for task in list(self._periodic):
+                interval, fn, due = task
+                if now >= due:
+                    task[2] = now + interval
+                    try:
+                        fn()
+                    except Exception as e:
+                        print(f"Scheduled task {fn} failed: {e}")
+            time.sleep(self.tick)
+
+    def start(self):
+        """Start the scheduler thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='market-refresher', daemon=True)
+            self._thread.start()
+
+    def stats(self):
+        """Return per-key refresh state"""
+        now = time.time()
+        return {
+            key: {
+                'ttl': job.ttl,
+                'refreshes': job.refreshes,
+                'failures': job.failures,
+                'active': bool(job.last_access) and now - job.last_access <= self.idle_timeout,
+                'next_refresh': datetime.fromtimestamp(job.next_refresh).isoformat() if job.next_refresh else None
+            }
+            for key, job in self._jobs.items()
+        }
@@ -0,0 +1,349 @@
+import calendar
+import heapq
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+
+from quote_stream import QuoteStreamHub, QUOTE_KEY
+
+MIN_SPEED = 1
+MAX_SPEED = 1000
+TIMESTAMP_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+
+class ReplayError(ValueError):
+    """A replay session request that cannot be served; carries the HTTP status to return"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def series_key(symbol, interval):
+    """Price store key for a symbol's bars at interval ('daily' bars use the plain symbol)"""
+    return symbol if interval == 'daily' else f"{symbol}@{interval}"
+
+
+def parse_timestamp(value):
+    """'YYYY-MM-DD[ HH:MM[:SS]]' as epoch seconds on the price store's clock (naive as UTC)"""
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return calendar.timegm(datetime.strptime(value, fmt).timetuple())
+        except (TypeError, ValueError):
+            continue
+    raise ReplayError(f'Invalid timestamp: {value}')
+
+
+def time_series_columns(time_series):
+    """Price store columns from an Alpha Vantage 'Time Series (...)' mapping"""
+    stamps = sorted(time_series)
+    bars = [time_series[stamp] for stamp in stamps]
+    return {
+        'ts': np.array([parse_timestamp(stamp) for stamp in stamps], dtype=np.int64),
+        'open': np.array([float(bar['1. open']) for bar in bars]),
+        'high': np.array([float(bar['2. high']) for bar in bars]),
+        'low': np.array([float(bar['3. low']) for bar in bars]),
+        'close': np.array([float(bar['4. close']) for bar in bars]),
+        'volume': np.array([int(float(bar.get('5. volume', 0))) for bar in bars], dtype=np.int64)
+    }
+
+
+def bar_quote(symbol, series, i):
+    """Bar i of series as a GLOBAL_QUOTE payload, the schema /quote returns"""
+    close = float(series.close[i])
+    previous = float(series.close[i - 1]) if i > 0 else float(series.open[i])
+    change = close - previous
+    stamp = datetime.utcfromtimestamp(int(series.ts[i]))
+    return {QUOTE_KEY: {
+        '01. symbol': symbol,
+        '02. open': f"{float(series.open[i]):.4f}",
+        '03. high': f"{float(series.high[i]):.4f}",
+        '04. low': f"{float(series.low[i]):.4f}",
+        '05. price': f"{close:.4f}",
+        '06. volume': str(int(series.volume[i])),
+        '07. latest trading day': stamp.strftime('%Y-%m-%d'),
+        '08. previous close': f"{previous:.4f}",
+        '09. change': f"{change:.4f}",
+        '10. change percent': f"{change / previous * 100 if previous else 0.0:.4f}%"
+    }}
+
+
+class ReplaySession:
+    """One user's replay of stored bars on a virtual clock.
+
+    The session is fully described by its definition: the virtual clock
+    reads anchor_ts at wall time anchor_wall and runs speed times faster
+    than real time unless paused. Bars are not copied; each symbol keeps a
+    (memory-mapped) PriceSeries and a cursor, and advance() publishes every
+    bar the clock has passed through the session's own push-only quote hub
+    and to the listeners.
+    """
+
+    def __init__(self, definition, series, listeners=()):
+        self.definition = definition
+        self.id = definition['id']
+        self.symbols = list(definition['symbols'])
+        self.series = series
+        self.cursors = np.zeros(len(self.symbols), dtype=np.int64)
+        self.hub = QuoteStreamHub(None)
+        self.listeners = listeners
+        self.quotes = {}
+        self.last_access = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def speed(self):
+        return self.definition['speed']
+
+    @property
+    def paused(self):
+        return self.definition['paused']
+
+    def clock(self, now=None):
+        """Virtual time in epoch seconds"""
+        definition = self.definition
+        if definition['paused']:
+            return definition['anchor_ts']
+        now = time.time() if now is None else now
+        elapsed = (now - definition['anchor_wall']) * definition['speed']
+        return min(definition['anchor_ts'] + elapsed, definition['end_ts'])
+
+    @property
+    def finished(self):
+        return self.clock() >= self.definition['end_ts']
+
+    def advance(self, now=None):
+        """Publish the latest bar of every symbol the clock moved past; returns [(symbol, quote)]"""
+        virtual = self.clock(now)
+        updates = []
+        with self._lock:
+            for i, (symbol, series) in enumerate(zip(self.symbols, self.series)):
+                cursor = int(np.searchsorted(series.ts, virtual, side='right'))
+                if cursor != self.cursors[i] and cursor > 0:
+                    quote = bar_quote(symbol, series, cursor - 1)
+                    self.quotes[symbol] = quote
+                    updates.append((symbol, quote))
+                self.cursors[i] = cursor
+        for symbol, quote in updates:
+            self.hub.publish(symbol, quote)
+            for listener in self.listeners:
+                try:
+                    listener(self, symbol, quote)
+                except Exception as e:
+                    print(f"Replay listener failed for {self.id}: {e}")
+        return updates
+
+    def next_due(self):
+        """Wall time at which the next bar is due, or None when paused or out of bars"""
+        definition = self.definition
+        if definition['paused']:
+            return None
+        upcoming = [
+            series.ts[cursor] for series, cursor in zip(self.series, self.cursors.tolist())
+            if cursor < len(series) and series.ts[cursor] <= definition['end_ts']
+        ]
+        if not upcoming:
+            return None
+        return definition['anchor_wall'] + (min(upcoming) - definition['anchor_ts']) / definition['speed']
+
+    def subscribe(self):
+        """Subscribe to the session's quotes, starting from a snapshot of the current bars"""
+        subscriber = self.hub.subscribe(self.symbols)
+        if subscriber is not None:
+            for symbol, quote in list(self.quotes.items()):
+                self.hub.publish(symbol, quote)
+        return subscriber
+
+    def price(self, symbol):
+        """Replayed last price of symbol, or None before its first bar"""
+        quote = self.quotes.get(symbol)
+        return float(quote[QUOTE_KEY]['05. price']) if quote else None
+
+    def to_dict(self):
+        definition = self.definition
+        return {
+            'id': self.id,
+            'symbols': self.symbols,
+            'interval': definition['interval'],
+            'start': datetime.utcfromtimestamp(definition['start_ts']).isoformat(),
+            'end': datetime.utcfromtimestamp(definition['end_ts']).isoformat(),
+            'clock': datetime.utcfromtimestamp(self.clock()).isoformat(),
+            'speed': definition['speed'],
+            'paused': definition['paused'],
+            'finished': self.finished,
+            'quotes': self.quotes
+        }
+
+
+class ReplayEngine:
+    """Every replay session in this worker, advanced by one scheduler thread.
+
+    Sessions wait in a heap keyed by the wall time their next bar is due,
+    so the thread sleeps until the earliest one and each wake-up only
+    touches sessions with a bar to publish; hundreds of sessions cost one
+    thread and a cursor per symbol each. Definitions are also written to the
+    shared cache, so on a shared cache backend any worker can rebuild a
+    session (the clock is a function of the definition) and control changes
+    made by another worker are picked up on the next access.
+
+    load_series(symbol, interval) returns a PriceSeries or raises
+    ReplayError. Listeners are called as listener(session, symbol, quote)
+    for every published bar, e.g. to match orders against replayed prices.
+    """
+
+    KEY_PREFIX = 'replay_'
+
+    def __init__(self, load_series, cache, max_sessions=500, idle_timeout=1800):
+        self.load_series = load_series
+        self.cache = cache
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.listeners = []
+        self._sessions = {}
+        self._heap = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def create(self, symbols, start_ts, end_ts, speed=1, interval='daily'):
+        """Start a session replaying symbols' bars from start_ts to end_ts"""
+        if not MIN_SPEED <= speed <= MAX_SPEED:
+            raise ReplayError(f'Speed must be between {MIN_SPEED} and {MAX_SPEED}')
+        if end_ts <= start_ts:
+            raise ReplayError('End must be after start')
+        if len(self._sessions) >= self.max_sessions:
+            raise ReplayError('Too many replay sessions. Please try again later.', 503)
+        definition = {
+            'id': uuid.uuid4().hex,
+            'symbols': list(dict.fromkeys(symbols)),
+            'interval': interval,
+            'start_ts': start_ts,
+            'end_ts': end_ts,
+            'speed': speed,
+            'anchor_ts': start_ts,
+            'anchor_wall': time.time(),
+            'paused': False,
+            'revision': 0
+        }
+        session = self._build(definition)
+        self._save(definition)
+        return session
+
+    def _build(self, definition):
+        series = [self.load_series(symbol, definition['interval']) for symbol in definition['symbols']]
+        session = ReplaySession(definition, series, self.listeners)
+        session.advance()
+        with self._lock:
+            self._sessions[session.id] = session
+        self._schedule(session)
+        self._start()
+        return session
+
+    def _save(self, definition):
+        self.cache.set(self.KEY_PREFIX + definition['id'], definition, ttl=self.idle_timeout)
+
+    def get(self, session_id):
+        """The session, rebuilt from its shared definition if needed, or None"""
+        definition = self.cache.get(self.KEY_PREFIX + session_id)
+        if definition is None:
+            # Deleted through another worker or expired: the local copy is stale
+            with self._lock:
+                self._sessions.pop(session_id, None)
+            return None
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._build(definition)
+        elif definition['revision'] > session.definition['revision']:
+            session.definition = definition
+            session.advance()
+            self._schedule(session)
+        # Refresh the shared definition's expiry while the session is in use
+        self._save(definition)
+        session.last_access = time.time()
+        return session
+
+    def update(self, session_id, speed=None, paused=None):
+        """Change a session's speed and/or pause it; the virtual clock carries on from where it is"""
+        session = self.get(session_id)
+        if session is None:
+            return None
+        if speed is not None and not MIN_SPEED <= speed <= MAX_SPEED:
+            raise ReplayError(f'Speed must be between {MIN_SPEED} and {MAX_SPEED}')
+        now = time.time()
+        definition = dict(session.definition)
+        definition['anchor_ts'] = session.clock(now)
+        definition['anchor_wall'] = now
+        if speed is not None:
+            definition['speed'] = speed
+        if paused is not None:
+            definition['paused'] = paused
+        definition['revision'] += 1
+        session.definition = definition
+        self._save(definition)
+        session.advance(now)
+        self._schedule(session)
+        return session
+
+    def delete(self, session_id):
+        self.cache.delete(self.KEY_PREFIX + session_id)
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        return session is not None
+
+    def _schedule(self, session):
+        due = session.next_due()
+        if due is None:
+            return
+        with self._lock:
+            heapq.heappush(self._heap, (due, session.definition['revision'], session.id))
+        self._wake.set()
+
+    def _evict_idle(self, now):
+        with self._lock:
+            idle = [
+                session_id for session_id, session in self._sessions.items()
+                if now - session.last_access > self.idle_timeout and not session.hub.stats()['subscribers']
+            ]
+            for session_id in idle:
+                del self._sessions[session_id]
+
+    def _run(self):
+        last_eviction = time.time()
+        while True:
+            now = time.time()
+            due = []
+            with self._lock:
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap))
+                wait = self._heap[0][0] - now if self._heap else 60
+            for _, revision, session_id in due:
+                session = self._sessions.get(session_id)
+                if session is None or session.definition['revision'] != revision:
+                    continue
+                session.advance(now)
+                self._schedule(session)
+            if now - last_eviction > 60:
+                self._evict_idle(now)
+                last_eviction = now
+            self._wake.wait(min(wait, 60))
+            self._wake.clear()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='market-replay', daemon=True)
+                self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'scheduled': len(self._heap),
+                'subscribers': sum(s.hub.stats()['subscribers'] for s in self._sessions.values())
+            }
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+import indicators
+from indicator_state import IndicatorStateStore
+from timeseries_store import PriceSeries
+
+DAY = 86400
+
+
+def daily_series(n, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    spread = rng.uniform(0.001, 0.03, n) * close
+    return PriceSeries(
+        1600000000 + DAY * np.arange(n, dtype=np.int64),
+        close + rng.normal(0, 0.5, n),
+        close + spread,
+        close - spread,
+        close,
+        rng.integers(1000, 100000, n).astype(np.int64)
+    )
+
+
+def assert_same_values(actual, expected):
+    assert actual.keys() == expected.keys()
+    for name, value in expected.items():
+        if isinstance(value, dict):
+            assert_same_values(actual[name], value)
+        elif value is None:
+            assert actual[name] is None, name
+        else:
+            assert actual[name] == pytest.approx(value, rel=1e-9, abs=1e-9), name
+
+
+def test_state_matches_batch_over_full_history(tmp_path):
+    series = daily_series(300)
+    store = IndicatorStateStore(str(tmp_path))
+    assert_same_values(store.values('ABC', series), indicators.latest(series))
+
+
+def test_state_advances_incrementally_as_bars_arrive(tmp_path):
+    series = daily_series(320)
+    store = IndicatorStateStore(str(tmp_path))
+    for end in (250, 251, 260, 320):
+        window = series.between(end_ts=series.ts[end - 1])
+        assert_same_values(store.values('ABC', window), indicators.latest(window))
+
+
+def test_state_resumes_from_its_snapshot(tmp_path):
+    series = daily_series(300)
+    IndicatorStateStore(str(tmp_path)).values('ABC', series.between(end_ts=series.ts[279]))
+    restarted = IndicatorStateStore(str(tmp_path))
+    assert restarted.has_state('ABC')
+    assert_same_values(restarted.values('ABC', series), indicators.latest(series))
+
+
+def test_short_history_leaves_long_windows_undefined(tmp_path):
+    series = daily_series(30)
+    values = IndicatorStateStore(str(tmp_path)).values('ABC', series)
+    assert values['sma_200'] is None
+    assert values['sma_20'] is not None
+    assert_same_values(values, indicators.latest(series))
+
+
+def test_latest_batch_matches_latest_per_symbol():
+    series = {'A': daily_series(250, seed=1), 'B': daily_series(40, seed=2), 'C': None}
+    batch = indicators.latest_batch(series)
+    assert batch['C'] is None
+    assert_same_values(batch['A'], indicators.latest(series['A']))
+    assert_same_values(batch['B'], indicators.latest(series['B']))
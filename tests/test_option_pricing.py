@@ -0,0 +1,56 @@
+import numpy as np
+
+import option_pricing
+from option_pricing import black_scholes, implied_volatility
+
+RATE = 0.065
+
+
+def chain(n=500, seed=0):
+    rng = np.random.default_rng(seed)
+    S = np.full(n, 100.0)
+    K = rng.uniform(60, 160, n)
+    T = rng.uniform(0.01, 2.0, n)
+    vol = rng.uniform(0.05, 1.5, n)
+    is_call = rng.random(n) < 0.5
+    return S, K, T, vol, is_call
+
+
+def time_value(S, K, T, vol):
+    """Price of the out-of-the-money side, the only part of a price that depends on vol"""
+    return np.minimum(black_scholes(S, K, T, RATE, vol, True), black_scholes(S, K, T, RATE, vol, False))
+
+
+def test_round_trip_recovers_the_pricing_vol():
+    S, K, T, vol, is_call = chain()
+    price = black_scholes(S, K, T, RATE, vol, is_call)
+    iv = implied_volatility(price, S, K, T, RATE, is_call)
+    solved = np.isfinite(iv)
+    # Contracts with under a tick of time value carry no usable vol information
+    assert solved[time_value(S, K, T, vol) > 0.01].all()
+    repriced = black_scholes(S[solved], K[solved], T[solved], RATE, iv[solved], is_call[solved])
+    np.testing.assert_allclose(repriced, price[solved], rtol=1e-6, atol=1e-6)
+
+
+def test_scalar_inputs_give_a_scalar():
+    price = black_scholes(100.0, 105.0, 0.5, RATE, 0.25, True)
+    iv = implied_volatility(float(price), 100.0, 105.0, 0.5, RATE, True)
+    assert np.ndim(iv) == 0
+    assert abs(float(iv) - 0.25) < 1e-6
+
+
+def test_prices_outside_the_bounds_are_nan():
+    iv = implied_volatility([-1.0, 0.0, 150.0, 5.0], 100.0, 100.0, [1.0, 1.0, 1.0, 0.0], RATE, True)
+    assert np.isnan(iv).all()
+
+
+def test_stalled_newton_contracts_are_finished_by_bisection(monkeypatch):
+    S, K, T, vol, is_call = chain(n=50, seed=1)
+    price = black_scholes(S, K, T, RATE, vol, is_call)
+    # Zero vega everywhere: Newton cannot take a step, so every contract must be bisected
+    monkeypatch.setattr(option_pricing, 'norm_pdf', lambda x: np.zeros_like(x))
+    iv = implied_volatility(price, S, K, T, RATE, is_call)
+    solved = np.isfinite(iv)
+    assert solved[time_value(S, K, T, vol) > 0.01].all()
+    repriced = black_scholes(S[solved], K[solved], T[solved], RATE, iv[solved], is_call[solved])
+    np.testing.assert_allclose(repriced, price[solved], rtol=1e-6, atol=1e-6)
@@ -0,0 +1,131 @@
+from quote_stream import QUOTE_KEY, QuoteStreamHub
+
+
+def quote(price, volume='100', **envelope):
+    return dict(envelope, **{QUOTE_KEY: {'01. symbol': 'ABC', '05. price': price, '06. volume': volume}})
+
+
+def apply(state, message):
+    """Apply a streamed message to a client's copy of a symbol, as the stream protocol describes"""
+    if message.type == 'snapshot':
+        return message.seq, dict(message.payload[QUOTE_KEY])
+    seq, fields = state
+    assert message.base_seq == seq, 'delta does not continue from the client copy'
+    fields = dict(fields)
+    for key, value in message.payload.items():
+        if value is None:
+            fields.pop(key, None)
+        else:
+            fields[key] = value
+    return message.seq, fields
+
+
+def read_one(subscriber):
+    updates = subscriber.next(timeout=0)
+    assert len(updates) == 1
+    return updates[0][1]
+
+
+def test_snapshot_then_deltas_chain_by_seq():
+    hub = QuoteStreamHub(None)
+    subscriber = hub.subscribe(['ABC'])
+
+    hub.publish('ABC', quote('10.00'))
+    first = read_one(subscriber)
+    assert first.type == 'snapshot'
+    state = apply(None, first)
+
+    hub.publish('ABC', quote('10.50'))
+    delta = read_one(subscriber)
+    assert delta.type == 'delta'
+    assert delta.base_seq == first.seq
+    assert delta.seq > first.seq
+    assert delta.payload == {'05. price': '10.50'}
+    state = apply(state, delta)
+    assert state[1] == quote('10.50')[QUOTE_KEY]
+
+
+def test_unchanged_quote_is_not_sent():
+    hub = QuoteStreamHub(None)
+    subscriber = hub.subscribe(['ABC'])
+    hub.publish('ABC', quote('10.00'))
+    read_one(subscriber)
+    hub.publish('ABC', quote('10.00'))
+    assert subscriber.next(timeout=0) == []
+
+
+def test_conflated_deltas_keep_the_chain_unbroken():
+    hub = QuoteStreamHub(None)
+    subscriber = hub.subscribe(['ABC'])
+    hub.publish('ABC', quote('10.00'))
+    state = apply(None, read_one(subscriber))
+
+    # A slow client misses three updates; it gets one delta covering them all
+    hub.publish('ABC', quote('10.10'))
+    hub.publish('ABC', quote('10.20', volume='150'))
+    hub.publish('ABC', quote('10.30', volume='150'))
+    merged = read_one(subscriber)
+    assert subscriber.conflated == 2
+    assert merged.base_seq == state[0]
+    state = apply(state, merged)
+    assert state[0] == hub.snapshot(['ABC'])['ABC'].seq
+    assert state[1] == quote('10.30', volume='150')[QUOTE_KEY]
+
+
+def test_delta_folds_into_a_pending_snapshot():
+    hub = QuoteStreamHub(None)
+    subscriber = hub.subscribe(['ABC'])
+    hub.publish('ABC', quote('10.00'))
+    hub.publish('ABC', quote('10.40'))
+    message = read_one(subscriber)
+    assert message.type == 'snapshot'
+    assert message.seq == hub.snapshot(['ABC'])['ABC'].seq
+    assert message.payload[QUOTE_KEY]['05. price'] == '10.40'
+
+
+def test_late_subscriber_starts_from_the_latest_snapshot():
+    hub = QuoteStreamHub(None)
+    hub.subscribe(['ABC'])
+    hub.publish('ABC', quote('10.00'))
+    hub.publish('ABC', quote('10.60'))
+    latest = hub.snapshot(['ABC'])['ABC']
+
+    late = hub.subscribe(['ABC'])
+    message = read_one(late)
+    assert message.type == 'snapshot'
+    assert message.seq == latest.seq
+
+    hub.publish('ABC', quote('10.70'))
+    delta = read_one(late)
+    assert delta.base_seq == latest.seq
+
+
+def test_envelope_change_sends_a_snapshot():
+    hub = QuoteStreamHub(None)
+    subscriber = hub.subscribe(['ABC'])
+    hub.publish('ABC', quote('10.00', source='live'))
+    read_one(subscriber)
+    hub.publish('ABC', quote('10.00', source='cache'))
+    message = read_one(subscriber)
+    assert message.type == 'snapshot'
+    assert message.payload['source'] == 'cache'
+
+
+def test_seq_only_increases_across_symbols():
+    hub = QuoteStreamHub(None)
+    subscriber = hub.subscribe(['ABC', 'XYZ'])
+    seqs = []
+    for price in ('1', '2', '3'):
+        hub.publish('ABC', quote(price))
+        hub.publish('XYZ', quote(price))
+        seqs.extend(message.seq for _, message in subscriber.next(timeout=0))
+    assert seqs == sorted(seqs)
+    assert len(set(seqs)) == len(seqs)
+
+
+def test_unwatched_symbols_are_not_published():
+    hub = QuoteStreamHub(None)
+    subscriber = hub.subscribe(['ABC'])
+    hub.publish('XYZ', quote('1'))
+    assert subscriber.next(timeout=0) == []
+    assert hub.snapshot(['XYZ']) == {}
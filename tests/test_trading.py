@@ -0,0 +1,161 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+import order_store
+import portfolio
+from backend.models import db, Holding, Order as OrderRow, Portfolio
+from matching_engine import FillConflict, MatchingEngine, Order
+from portfolio import TRADE_CONFLICT_STATUS, TradeError, execute_trade
+
+USER_ID = 1
+
+
+@pytest.fixture
+def funded(app):
+    """A portfolio holding 10 ABC with a credit limit high enough not to get in the way"""
+    execute_trade(USER_ID, 'ABC', 'buy', 10, Decimal('100'))
+    row = Portfolio.query.filter_by(user_id=USER_ID).one()
+    row.credit_limit = Decimal('100000000')
+    row.credit_limit_expires_at = datetime.utcnow() + timedelta(days=1)
+    db.session.commit()
+    return row
+
+
+@pytest.fixture
+def always_raced(monkeypatch):
+    """Make every holding read stale, as if another trade always wins the race"""
+    read = portfolio._holding_state
+
+    def raced(portfolio_id, symbol):
+        state = read(portfolio_id, symbol)
+        if state is not None:
+            db.session.execute(
+                db.update(Holding).where(Holding.id == state.id).values(version=Holding.version + 1)
+            )
+        return state
+
+    monkeypatch.setattr(portfolio, '_holding_state', raced)
+
+
+def holding_quantity(symbol):
+    return db.session.query(Holding.quantity).filter_by(symbol=symbol).scalar()
+
+
+def test_buy_and_sell_move_cash_and_invested_value(funded):
+    execute_trade(USER_ID, 'ABC', 'buy', 10, Decimal('110'))
+    row = Portfolio.query.filter_by(user_id=USER_ID).one()
+    assert holding_quantity('ABC') == 20
+    assert row.invested_value == Decimal('2100')
+    assert row.cash_balance == Decimal('1000000') - Decimal('2100')
+
+    execute_trade(USER_ID, 'ABC', 'sell', 20, Decimal('120'))
+    assert holding_quantity('ABC') is None
+    assert row.invested_value == 0
+    assert row.cash_balance == Decimal('1000000') + Decimal('300')
+
+
+def test_trade_retries_a_lost_holding_race(funded, monkeypatch):
+    read = portfolio._holding_state
+    reads = []
+
+    def raced_once(portfolio_id, symbol):
+        state = read(portfolio_id, symbol)
+        reads.append(state)
+        if len(reads) == 1:
+            # Another trade buys 5 between this read and the write
+            db.session.execute(
+                db.update(Holding).where(Holding.id == state.id)
+                .values(version=Holding.version + 1, quantity=Holding.quantity + 5)
+            )
+        return state
+
+    monkeypatch.setattr(portfolio, '_holding_state', raced_once)
+    execute_trade(USER_ID, 'ABC', 'sell', 8, Decimal('100'))
+    assert len(reads) == 2
+    assert holding_quantity('ABC') == 7
+
+
+def test_trade_gives_up_after_max_attempts(funded, always_raced):
+    with pytest.raises(TradeError) as error:
+        execute_trade(USER_ID, 'ABC', 'buy', 1, Decimal('100'))
+    assert error.value.status_code == TRADE_CONFLICT_STATUS
+    assert holding_quantity('ABC') == 10
+    assert Portfolio.query.filter_by(user_id=USER_ID).one().cash_balance == Decimal('999000')
+
+
+def test_insufficient_cash_changes_nothing(funded):
+    with pytest.raises(TradeError, match='Insufficient cash'):
+        execute_trade(USER_ID, 'ABC', 'buy', 100000, Decimal('100'))
+    assert holding_quantity('ABC') == 10
+
+
+def stored_order(order_type='LIMIT', side='BUY', quantity=1, limit_price=100.0):
+    order = Order(USER_ID, 'ABC', side, quantity, order_type, limit_price=limit_price)
+    order_store.create_order(order)
+    return order
+
+
+def stored_status(order):
+    db.session.expire_all()
+    return db.session.get(OrderRow, order.id).status
+
+
+def test_fill_order_books_the_trade(funded):
+    order = stored_order()
+    assert order_store.fill_order(order, 99.0) is True
+    assert stored_status(order) == 'FILLED'
+    assert holding_quantity('ABC') == 11
+
+
+def test_fill_order_skips_an_order_changed_elsewhere(funded):
+    order = stored_order()
+    order_store.modify_order(order.id, USER_ID, quantity=2)
+    assert order_store.fill_order(order, 99.0) is False
+    assert stored_status(order) == 'OPEN'
+    assert holding_quantity('ABC') == 10
+
+
+def test_fill_conflict_leaves_a_limit_order_open(funded, always_raced):
+    order = stored_order()
+    with pytest.raises(FillConflict):
+        order_store.fill_order(order, 99.0)
+    assert stored_status(order) == 'OPEN'
+    assert db.session.get(OrderRow, order.id).version == order.version
+    assert holding_quantity('ABC') == 10
+
+
+def test_fill_conflict_rejects_a_market_order(funded, always_raced):
+    order = stored_order(order_type='MARKET', limit_price=None)
+    with pytest.raises(TradeError):
+        order_store.fill_order(order, 99.0)
+    assert stored_status(order) == 'REJECTED'
+
+
+def test_fill_order_rejects_on_insufficient_shares(funded):
+    order = stored_order(side='SELL', quantity=50)
+    with pytest.raises(TradeError, match='Insufficient shares'):
+        order_store.fill_order(order, 101.0)
+    assert stored_status(order) == 'REJECTED'
+
+
+def test_engine_rests_an_order_again_after_a_fill_conflict():
+    attempts = []
+
+    def execute(order, price):
+        attempts.append(price)
+        if len(attempts) == 1:
+            raise FillConflict('lost a race')
+        return True
+
+    engine = MatchingEngine(execute)
+    order = engine.place(Order(USER_ID, 'ABC', 'BUY', 1, 'LIMIT', limit_price=100.0, id=7))
+    engine.on_quote('ABC', 99.0)
+    assert order.status == 'OPEN'
+    assert engine.get(7) is order
+
+    engine.on_quote('ABC', 98.0)
+    assert order.status == 'FILLED'
+    assert engine.get(7) is None
+    assert attempts == [99.0, 98.0]
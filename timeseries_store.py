@@ -0,0 +1,160 @@
+import fcntl
+import os
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote
+
+import numpy as np
+
+# One file per column; timestamps are epoch seconds (UTC midnight for daily bars)
+COLUMNS = (
+    ('ts', np.dtype('<i8')),
+    ('open', np.dtype('<f8')),
+    ('high', np.dtype('<f8')),
+    ('low', np.dtype('<f8')),
+    ('close', np.dtype('<f8')),
+    ('volume', np.dtype('<i8'))
+)
+COLUMN_NAMES = tuple(name for name, _ in COLUMNS)
+
+
+class PriceSeries:
+    """Read-only column arrays for one symbol's bars in timestamp order.
+
+    Slicing methods return new PriceSeries over views of the same arrays, so
+    windows never copy price data. Date labels are formatted once per series
+    and shared with its slices.
+    """
+
+    __slots__ = COLUMN_NAMES + ('_dates',)
+
+    def __init__(self, ts, open, high, low, close, volume, dates=None):
+        self.ts = ts
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self._dates = dates
+
+    def __len__(self):
+        return len(self.ts)
+
+    def _slice(self, start, stop):
+        dates = self._dates[start:stop] if self._dates is not None else None
+        return PriceSeries(*(getattr(self, name)[start:stop] for name in COLUMN_NAMES), dates=dates)
+
+    def tail(self, n):
+        """The last n bars"""
+        return self._slice(max(len(self) - n, 0), len(self))
+
+    def between(self, start_ts=None, end_ts=None):
+        """Bars with start_ts <= ts <= end_ts, located by binary search"""
+        start = 0 if start_ts is None else int(np.searchsorted(self.ts, start_ts, side='left'))
+        stop = len(self) if end_ts is None else int(np.searchsorted(self.ts, end_ts, side='right'))
+        return self._slice(start, stop)
+
+    def dates(self):
+        """Bar timestamps as 'YYYY-MM-DD' strings"""
+        if self._dates is None:
+            self._dates = np.datetime_as_string(self.ts.astype('datetime64[s]'), unit='D').tolist()
+        return self._dates
+
+
+class TimeSeriesStore:
+    """Append-only on-disk columnar price store, read through memory maps.
+
+    Every gunicorn worker maps the same files, so the OS page cache holds a
+    single copy of each symbol's history no matter how many workers read it.
+    Writers take an flock per symbol; readers remap only when a column file
+    has grown.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._maps = {}
+        self._lock = threading.Lock()
+
+    def _dir(self, symbol):
+        return os.path.join(self.root, quote(symbol, safe=''))
+
+    def _column_path(self, symbol, name):
+        return os.path.join(self._dir(symbol), f'{name}.bin')
+
+    @contextmanager
+    def _write_lock(self, symbol):
+        os.makedirs(self._dir(symbol), exist_ok=True)
+        with open(os.path.join(self._dir(symbol), '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _lengths(self, symbol):
+        lengths = []
+        for name, dtype in COLUMNS:
+            try:
+                lengths.append(os.path.getsize(self._column_path(symbol, name)) // dtype.itemsize)
+            except OSError:
+                return 0
+        # A reader racing an append may see some columns longer than others
+        return min(lengths)
+
+    def read(self, symbol):
+        """Return the PriceSeries for symbol, or None if nothing is stored"""
+        length = self._lengths(symbol)
+        if not length:
+            return None
+        with self._lock:
+            cached = self._maps.get(symbol)
+            if cached is not None and cached[0] == length:
+                return cached[1]
+            series = PriceSeries(*(
+                np.memmap(self._column_path(symbol, name), dtype=dtype, mode='r', shape=(length,))
+                for name, dtype in COLUMNS
+            ))
+            self._maps[symbol] = (length, series)
+            return series
+
+    def last_timestamp(self, symbol):
+        series = self.read(symbol)
+        return int(series.ts[-1]) if series is not None else None
+
+    def append(self, symbol, columns):
+        """Append bars newer than the last stored one.
+
+        columns maps every name in COLUMN_NAMES to an array sorted by ts. A
+        bar with the same timestamp as the last stored bar replaces it (the
+        day's bar may have been stored while still forming); older bars are
+        ignored. Returns the number of bars written.
+        """
+        columns = {name: np.asarray(columns[name], dtype=dtype) for name, dtype in COLUMNS}
+
+        with self._write_lock(symbol):
+            length = self._lengths(symbol)
+            last_ts = None
+            if length:
+                with open(self._column_path(symbol, 'ts'), 'rb') as f:
+                    f.seek((length - 1) * 8)
+                    last_ts = int(np.frombuffer(f.read(8), dtype='<i8')[0])
+
+            start = 0
+            replaced = 0
+            if last_ts is not None:
+                start = int(np.searchsorted(columns['ts'], last_ts, side='left'))
+                if start < len(columns['ts']) and columns['ts'][start] == last_ts:
+                    for name, dtype in COLUMNS:
+                        with open(self._column_path(symbol, name), 'r+b') as f:
+                            f.seek((length - 1) * dtype.itemsize)
+                            f.write(columns[name][start:start + 1].tobytes())
+                    start += 1
+                    replaced = 1
+
+            for name, dtype in COLUMNS:
+                with open(self._column_path(symbol, name), 'ab') as f:
+                    # Trim a partial tail left by an interrupted append first
+                    f.truncate(length * dtype.itemsize)
+                    f.write(columns[name][start:].tobytes())
+            return len(columns['ts']) - start + replaced
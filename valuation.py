@@ -0,0 +1,170 @@
+from datetime import datetime
+
+import numpy as np
+
+from backend.models import db, Portfolio, Holding
+from derivatives import parse_contract_symbol
+
+# Set up by configure() when the market data blueprint is registered
+portfolio_valuer = None
+
+
+def position_type(symbol):
+    contract = parse_contract_symbol(symbol)
+    if contract is None:
+        return 'EQUITY'
+    return 'FUTURES' if contract[3] is None else 'OPTIONS'
+
+
+def _number(value):
+    return None if np.isnan(value) else round(float(value), 2)
+
+
+def mark_to_market(quantities, avg_prices, prices, previous_closes):
+    """Market value, cost, P&L and day change of positions, as arrays.
+
+    Unpriced positions (NaN price) come out NaN in every priced column, and
+    positions without a previous close have a NaN day change.
+    """
+    quantities = np.asarray(quantities, dtype=float)
+    cost = quantities * np.asarray(avg_prices, dtype=float)
+    value = quantities * np.asarray(prices, dtype=float)
+    pnl = value - cost
+    day_change = value - quantities * np.asarray(previous_closes, dtype=float)
+    previous_value = value - day_change
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pnl_percentage = np.where(cost != 0, pnl / cost * 100, np.nan)
+        day_change_percentage = np.where(previous_value != 0, day_change / previous_value * 100, np.nan)
+    return {
+        'value': value,
+        'cost': cost,
+        'pnl': pnl,
+        'pnl_percentage': pnl_percentage,
+        'day_change': day_change,
+        'day_change_percentage': day_change_percentage
+    }
+
+
+def _totals(value, cost, day_change):
+    """Portfolio totals over the priced positions"""
+    priced = ~np.isnan(value)
+    total_value = value[priced].sum()
+    total_cost = cost[priced].sum()
+    total_day_change = np.nansum(day_change[priced])
+    previous_value = total_value - total_day_change
+    return {
+        'value': round(float(total_value), 2),
+        'cost': round(float(total_cost), 2),
+        'pnl': round(float(total_value - total_cost), 2),
+        'pnl_percentage': round(float((total_value - total_cost) / total_cost * 100), 2) if total_cost else None,
+        'day_change': round(float(total_day_change), 2),
+        'day_change_percentage': round(float(total_day_change / previous_value * 100), 2) if previous_value else None,
+        'unpriced': int((~priced).sum())
+    }
+
+
+class PortfolioValuer:
+    """Mark-to-market valuation of holdings from one batched quote fetch.
+
+    fetch_quotes(symbols) returns {symbol: (price, previous close or None)},
+    omitting symbols it could not price. A valuation collects the distinct
+    symbols across the holdings it covers, whether one user's or every
+    user's, fetches them in one call and values every position at once
+    with array arithmetic. Per-user results are cached for ttl seconds and
+    dropped by invalidate() when the user trades.
+    """
+
+    KEY_PREFIX = 'valuation_'
+
+    def __init__(self, fetch_quotes, cache, ttl=30):
+        self.fetch_quotes = fetch_quotes
+        self.cache = cache
+        self.ttl = ttl
+
+    def invalidate(self, user_id):
+        self.cache.delete(f"{self.KEY_PREFIX}{user_id}")
+
+    def _positions(self, user_ids=None):
+        query = (db.session.query(Portfolio.user_id, Holding.symbol, Holding.quantity, Holding.avg_price)
+                 .join(Holding, Holding.portfolio_id == Portfolio.id)
+                 .filter(Holding.quantity > 0))
+        if user_ids is not None:
+            query = query.filter(Portfolio.user_id.in_(user_ids))
+        return query.all()
+
+    def _value(self, positions, user_ids):
+        """{user_id: valuation} for positions, with an empty valuation for users without any"""
+        symbols = list(dict.fromkeys(p.symbol for p in positions))
+        quotes = self.fetch_quotes(symbols) if symbols else {}
+        n = len(positions)
+        quantities = np.fromiter((p.quantity for p in positions), dtype=float, count=n)
+        avg_prices = np.fromiter((p.avg_price for p in positions), dtype=float, count=n)
+        prices = np.full(n, np.nan)
+        previous_closes = np.full(n, np.nan)
+        for i, position in enumerate(positions):
+            quote = quotes.get(position.symbol)
+            if quote is not None:
+                prices[i] = quote[0]
+                if quote[1] is not None:
+                    previous_closes[i] = quote[1]
+        marked = mark_to_market(quantities, avg_prices, prices, previous_closes)
+
+        as_of = datetime.utcnow().isoformat()
+        rows = {user_id: [] for user_id in user_ids}
+        for i, position in enumerate(positions):
+            rows.setdefault(position.user_id, []).append(i)
+        valuations = {}
+        for user_id, index in rows.items():
+            index = np.array(index, dtype=np.int64)
+            holdings = []
+            for i in index.tolist():
+                symbol = positions[i].symbol
+                holding = {
+                    'symbol': symbol,
+                    'type': position_type(symbol),
+                    'quantity': positions[i].quantity,
+                    'average_price': round(float(avg_prices[i]), 2),
+                    'current_price': _number(prices[i]),
+                    **{column: _number(values[i]) for column, values in marked.items()}
+                }
+                contract = parse_contract_symbol(symbol)
+                if contract is not None:
+                    holding.update({'underlying': contract[0], 'expiry': contract[1]})
+                    if contract[3] is not None:
+                        holding.update({'strike': contract[2], 'option_type': contract[3]})
+                holdings.append(holding)
+            valuations[user_id] = {
+                'holdings': holdings,
+                'totals': _totals(marked['value'][index], marked['cost'][index], marked['day_change'][index]),
+                'as_of': as_of
+            }
+        return valuations
+
+    def value_user(self, user_id):
+        """Valuation of one user's holdings, from the cache when fresh"""
+        key = f"{self.KEY_PREFIX}{user_id}"
+        valuation = self.cache.get(key)
+        if valuation is None:
+            valuation = self._value(self._positions([user_id]), [user_id])[user_id]
+            self.cache.set(key, valuation, ttl=self.ttl)
+        return valuation
+
+    def value_users(self, user_ids=None):
+        """Valuations of many users' holdings (every user's by default) from one quote fetch"""
+        positions = self._positions(user_ids)
+        valuations = self._value(positions, user_ids or [])
+        for user_id, valuation in valuations.items():
+            self.cache.set(f"{self.KEY_PREFIX}{user_id}", valuation, ttl=self.ttl)
+        return valuations
+
+
+def configure(fetch_quotes, cache, ttl=30):
+    """Set up the shared valuer with the app's quote source and cache"""
+    global portfolio_valuer
+    portfolio_valuer = PortfolioValuer(fetch_quotes, cache, ttl)
+
+
+def invalidate(user_id):
+    """Drop a user's cached valuation, e.g. after a trade"""
+    if portfolio_valuer is not None:
+        portfolio_valuer.invalidate(user_id)